@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Load .env once, before any backend module reads its configuration
+load_dotenv()
@@ -0,0 +1,226 @@
+import io
+import os
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+# Local (no API call) color and pattern analysis.
+# Colors are quantized with a small vectorized k-means on a downscaled copy of
+# the image and snapped to the same color names the vision prompt and the
+# frontend filters use.
+
+ANALYSIS_SIZE = 64          # Longest side of the downscaled analysis image
+NUM_CLUSTERS = 4
+KMEANS_ITERATIONS = 8
+SECONDARY_MIN_SHARE = 0.15  # Clusters below this share of pixels are ignored
+MIN_STRIPE_CYCLES = 4
+# A garment reads as solid when one palette color covers most of it and its
+# brightness barely varies. The spread is an interquartile range because the
+# mask edge, seams and shadows put a long tail on any garment; calibrated on
+# testphotos/, where the plain shorts and tee sit at 0.92+ and 7-27 and
+# everything patterned or multi-part at 0.71 or less.
+SOLID_MIN_SHARE = 0.85
+SOLID_MAX_LUMA_IQR = 40
+
+# Reference RGB values for the color vocabulary
+COLOR_PALETTE = {
+    "black": (25, 25, 25),
+    "white": (240, 240, 240),
+    "gray": (128, 128, 128),
+    "navy": (30, 40, 80),
+    "blue": (70, 110, 180),
+    "red": (190, 35, 40),
+    "green": (50, 130, 60),
+    "yellow": (235, 205, 60),
+    "pink": (235, 150, 180),
+    "brown": (110, 70, 40),
+    "beige": (210, 190, 150),
+    "orange": (235, 125, 40),
+    "purple": (110, 60, 140),
+}
+
+_PALETTE_NAMES = list(COLOR_PALETTE.keys())
+_PALETTE_RGB = np.array(list(COLOR_PALETTE.values()), dtype=np.float32)
+
+
+def _open(image: Union[str, bytes, Image.Image]) -> Image.Image:
+    if isinstance(image, str):
+        return Image.open(image)
+    if isinstance(image, bytes):
+        return Image.open(io.BytesIO(image))
+    return image.copy()
+
+
+def _load_pixels(image: Union[str, bytes, Image.Image], bbox: Optional[dict] = None) -> np.ndarray:
+    """Load the image (optionally cropped to a 0-100 percent bbox) as a small HxWx3 float array"""
+    with _open(image) as im:
+        im = im.convert("RGB")
+        if bbox:
+            w, h = im.size
+            box = (
+                int(w * max(0, min(100, bbox.get("x_min", 0))) / 100),
+                int(h * max(0, min(100, bbox.get("y_min", 0))) / 100),
+                int(w * max(0, min(100, bbox.get("x_max", 100))) / 100),
+                int(h * max(0, min(100, bbox.get("y_max", 100))) / 100),
+            )
+            if box[2] - box[0] >= 8 and box[3] - box[1] >= 8:
+                im = im.crop(box)
+        im.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+        return np.asarray(im, dtype=np.float32)
+
+
+def _foreground_mask(pixels: np.ndarray) -> np.ndarray:
+    """Mask out pixels that match the (roughly uniform) background seen on the image border"""
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    background = np.median(border, axis=0)
+    # A busy border means there is no plain backdrop to remove
+    if np.median(np.abs(border - background).sum(axis=1)) > 60:
+        return np.ones(pixels.shape[:2], dtype=bool)
+
+    mask = np.abs(pixels - background).sum(axis=2) > 45
+    if mask.mean() < 0.05:
+        # Garment is the same color as the backdrop; keep everything
+        return np.ones(pixels.shape[:2], dtype=bool)
+    return mask
+
+
+def _kmeans(points: np.ndarray, k: int) -> tuple:
+    """Vectorized k-means with deterministic luminance-quantile initialization"""
+    luminance = points @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    order = np.argsort(luminance)
+    seeds = order[np.linspace(0, len(order) - 1, k).astype(int)]
+    centers = points[seeds].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k).astype(np.float32)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, points)
+        nonempty = counts > 0
+        centers[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+    return centers, counts / counts.sum()
+
+
+def _to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert an Nx3 sRGB array (0-255) to CIE L*a*b*"""
+    c = rgb / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([
+        [0.4124, 0.2126, 0.0193],
+        [0.3576, 0.7152, 0.1192],
+        [0.1805, 0.0722, 0.9505],
+    ], dtype=np.float32)
+    xyz /= np.array([0.9505, 1.0, 1.089], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([
+        116 * f[:, 1] - 16,
+        500 * (f[:, 0] - f[:, 1]),
+        200 * (f[:, 1] - f[:, 2]),
+    ], axis=1)
+
+
+_PALETTE_LAB = _to_lab(_PALETTE_RGB)
+
+
+def _nearest_colors(rgb: np.ndarray) -> np.ndarray:
+    """Index into the palette of the closest color for each row.
+
+    Lightness is down-weighted so that shading (folds, shadows) does not push
+    a garment into a different color name.
+    """
+    diff = _to_lab(rgb)[:, None, :] - _PALETTE_LAB[None, :, :]
+    distance = (0.5 * diff[..., 0]) ** 2 + diff[..., 1] ** 2 + diff[..., 2] ** 2
+    return distance.argmin(axis=1)
+
+
+def _detect_pattern(pixels: np.ndarray, mask: np.ndarray, primary_share: float) -> Optional[str]:
+    """Cheap solid/striped heuristic; returns None when neither is clear-cut"""
+    luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    rows, cols = np.where(mask)
+    region = luminance[rows.min():rows.max() + 1, cols.min():cols.max() + 1]
+    region_mask = mask[rows.min():rows.max() + 1, cols.min():cols.max() + 1]
+    if region.shape[0] < 8 or region.shape[1] < 8:
+        return None
+
+    if primary_share >= SOLID_MIN_SHARE:
+        low, high = np.percentile(luminance[mask], [25, 75])
+        if high - low < SOLID_MAX_LUMA_IQR:
+            return "solid"
+
+    # Stripes show up as a strong periodic component in the row or column profile
+    filled = np.where(region_mask, region, region[region_mask].mean())
+    for profile in (filled.mean(axis=1), filled.mean(axis=0)):
+        profile = profile - profile.mean()
+        energy = (profile ** 2).sum()
+        if energy < 1e-3 or profile.std() < 12:
+            continue
+        spectrum = np.abs(np.fft.rfft(profile)) ** 2
+        spectrum[0] = 0
+        # At least four full cycles and most of the variation in one frequency;
+        # fewer cycles are usually legs, sleeves or a printed graphic
+        if len(spectrum) <= MIN_STRIPE_CYCLES:
+            continue
+        peak = spectrum[MIN_STRIPE_CYCLES:].argmax() + MIN_STRIPE_CYCLES
+        if spectrum[peak] / spectrum.sum() > 0.35:
+            return "striped"
+
+    return None
+
+
+def analyze_image(image: Union[str, bytes, Image.Image], bbox: Optional[dict] = None) -> Optional[Dict]:
+    """Derive primary/secondary colors and a basic pattern guess from pixels.
+
+    Accepts a file path, encoded image bytes or an already-decoded PIL
+    image. Returns None if the image cannot be analyzed.
+    """
+    try:
+        pixels = _load_pixels(image, bbox)
+    except Exception as e:
+        name = os.path.basename(image) if isinstance(image, str) else "image"
+        print(f"Local analysis failed for {name}: {e}")
+        return None
+
+    mask = _foreground_mask(pixels)
+    points = pixels[mask]
+    if len(points) < NUM_CLUSTERS:
+        return None
+
+    centers, shares = _kmeans(points, NUM_CLUSTERS)
+    names = _nearest_colors(centers)
+
+    # Merge clusters that snap to the same palette color
+    color_shares: Dict[str, float] = {}
+    for idx, share in zip(names, shares):
+        name = _PALETTE_NAMES[idx]
+        color_shares[name] = color_shares.get(name, 0.0) + float(share)
+    ranked = sorted(color_shares.items(), key=lambda kv: kv[1], reverse=True)
+
+    primary = ranked[0][0]
+    secondary: List[str] = [name for name, share in ranked[1:] if share >= SECONDARY_MIN_SHARE]
+
+    return {
+        "color_primary": primary,
+        "colors_secondary": secondary,
+        "pattern": _detect_pattern(pixels, mask, ranked[0][1]),
+        "color_shares": {name: round(share, 3) for name, share in ranked},
+    }
+
+
+def merge_local_tags(tags, local: Optional[Dict], override_colors: bool = True):
+    """Fill or override color/pattern fields of an ItemTags with the local analysis result"""
+    if not local:
+        return tags
+
+    updates = {}
+    if override_colors or tags.color_primary in ("", "unknown"):
+        updates["color_primary"] = local["color_primary"]
+        updates["colors_secondary"] = local["colors_secondary"]
+    pattern = (tags.pattern or "").strip().lower()
+    # The vision parsers default a missing pattern to "solid", so detected stripes win over it
+    if local.get("pattern") and (pattern in ("", "unknown") or (pattern == "solid" and local["pattern"] == "striped")):
+        updates["pattern"] = local["pattern"]
+
+    return tags.model_copy(update=updates) if updates else tags
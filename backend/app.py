@@ -1,37 +1,122 @@
-import os, uuid, json
-import random
+import os, io, uuid, json
+import asyncio
 import base64
+from collections import Counter
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
 from typing import Optional, List
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query, Form, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query, Form, Request, Header
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from sqlalchemy import and_, or_
 from PIL import Image
 
-from backend.db import Base, engine, get_db
+from backend.db import init_db, get_db, engine, SessionLocal
 from backend.models import Item, User, Outfit
-from backend.schemas import ItemTags, UserSignup, UserLogin, UserResponse, OutfitCreate, OutfitResponse
-from backend.vision import tag_item, separate_clothing_items, tag_item_with_context
+from backend.schemas import ItemTags, UserSignup, UserLogin, UserResponse, OutfitCreate, OutfitResponse, ItemBulkDelete
+from backend.vision import tag_item, separate_clothing_items, tag_item_with_context, PROMPT_VERSION, calls_provider, estimated_call_tokens
 from backend.auth import (
     get_password_hash, verify_password, create_access_token, 
     get_current_user, get_current_user_optional
 )
 from backend.weather import get_weather, get_season_colors
-
-# Ensure tables exist
-Base.metadata.create_all(bind=engine)
-
-STORAGE_DIR = os.getenv("STORAGE_DIR", "./storage")
-os.makedirs(STORAGE_DIR, exist_ok=True)
-
-app = FastAPI(title="LookLabs")
+from backend import vocab, dedup, similarity, search, metrics, profiling, storage, collector, archive, etags, decks, scheduler, ingest, assets, stats
+from backend.analyzer import analyze_image
+
+# Max Hamming distance between dHashes for an upload to count as a duplicate
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "6"))
+# Check/upgrade the schema when the app starts. Turn off when migrate_db.py runs
+# as a separate deploy step so each worker boots without touching the schema.
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() == "true"
+# Garments of one outfit photo tagged at the same time by POST /items/outfit/stream
+OUTFIT_TAG_CONCURRENCY = int(os.getenv("OUTFIT_TAG_CONCURRENCY", "4"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if RUN_MIGRATIONS_ON_STARTUP:
+        init_db()
+    assets.build()
+    collector.start()
+    yield
+    collector.stop()
+
+app = FastAPI(title="LookLabs", lifespan=lifespan)
+app.add_middleware(ingest.UploadLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
 )
+metrics.install(app, engine)
+profiling.install(app, engine)
+
+# ==================== HELPERS ====================
+
+def encode_jpeg(im: Image.Image, quality: int = 85) -> bytes:
+    """Encode an image the way uploads are stored"""
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+def item_to_json(r: Item) -> dict:
+    """Serialize an item row for API responses"""
+    return {
+        "id": r.id, "image_url": r.image_url,
+        "slot": r.slot, "type": r.type, "color_primary": r.color_primary,
+        "colors_secondary": json.loads(r.colors_secondary),
+        "pattern": r.pattern, "material": r.material, "fit": r.fit,
+        "formality": r.formality, "season": json.loads(r.season),
+        "features": json.loads(r.features),
+        "brand_or_logo_visible": bool(r.brand_or_logo_visible),
+        "notes": r.notes, "created_at": str(r.created_at or "")
+    }
+
+def vocab_filter(kind: str, value: Optional[str]) -> Optional[str]:
+    """Canonical label for a filter query parameter; 422 if it names nothing in the vocabulary"""
+    if not value:
+        return None
+    label = vocab.lookup(kind, value)
+    if label is None:
+        raise HTTPException(422, f"Unknown {kind} '{value}'; use one of: {', '.join(vocab.VOCABULARIES[kind])}")
+    return label
+
+async def run_vision(func, *args, max_tokens: int = 1000):
+    """Run a function making one vision call on a worker thread, once the scheduler admits the call.
+
+    The wait for a slot happens here on the event loop, so queued uploads hold
+    no threadpool thread (see scheduler.py).
+    """
+    if not calls_provider():
+        return await run_in_threadpool(func, *args)
+    async with scheduler.admitted(estimated_call_tokens(max_tokens)):
+        return await run_in_threadpool(func, *args)
+
+def tag_garment(data: bytes, im: Image.Image, item_info: dict):
+    """Vision tags and local color analysis for one garment of an outfit photo (one analysis, shared)"""
+    with metrics.stage("analyze"):
+        local = analyze_image(im, item_info.get("bbox_estimate"))
+    with metrics.stage("vision"):
+        tags: ItemTags = tag_item_with_context(data, item_info, local)
+    return tags, local
+
+def garment_row(user_id: str, image_key: str, tags: ItemTags, local: Optional[dict]) -> Item:
+    """New item row for a garment cut from a stored outfit photo"""
+    return Item(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        image_url=storage.image_url(image_key),
+        slot=tags.slot, type=tags.type, color_primary=tags.color_primary,
+        colors_secondary=json.dumps(tags.colors_secondary),
+        pattern=tags.pattern, material=tags.material, fit=tags.fit,
+        formality=tags.formality, season=json.dumps(tags.season),
+        features=json.dumps(tags.features),
+        brand_or_logo_visible=1 if tags.brand_or_logo_visible else 0,
+        notes=tags.notes,
+        color_hist=similarity.color_histogram(local and local["color_shares"]),
+        prompt_version=PROMPT_VERSION,
+    )
 
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
@@ -66,15 +151,13 @@ async def signup(
         # Save profile photo if provided
         profile_photo_url = None
         if profile_photo:
-            photo_id = str(uuid.uuid4())
-            photo_path = os.path.join(STORAGE_DIR, f"profile_{photo_id}.jpg")
+            # An unreadable or oversized photo fails the signup (415/413) rather than being dropped
             try:
-                im = Image.open(profile_photo.file).convert("RGB")
-                im.thumbnail((200, 200))
-                im.save(photo_path, "JPEG", quality=85)
-                profile_photo_url = f"/images/profile_{photo_id}.jpg"
-            except Exception as e:
-                print(f"Error saving profile photo: {e}")
+                im = ingest.load_image(profile_photo.file, 200)
+            finally:
+                profile_photo.file.close()
+            im.thumbnail((200, 200))
+            profile_photo_url = storage.image_url(storage.put(db, encode_jpeg(im)))
         
         # Create user
         user_id = str(uuid.uuid4())
@@ -169,28 +252,51 @@ def get_season_colors_endpoint():
 @app.post("/items")
 async def create_item(
     file: UploadFile = File(...),
+    allow_duplicate: bool = Query(False),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Upload a single clothing item"""
+    metrics.set_endpoint("create_item")
+    scheduler.set_principal(current_user.id, scheduler.INTERACTIVE)
     try:
         item_id = str(uuid.uuid4())
-        img_path = os.path.join(STORAGE_DIR, f"{item_id}.jpg")
-
-        try:
-            im = Image.open(file.file).convert("RGB")
-        finally:
-            file.file.close()
-
-        im.thumbnail((1024, 1024))
-        im.save(img_path, "JPEG", quality=85)
 
-        tags: ItemTags = tag_item(img_path)
+        with metrics.stage("decode"):
+            try:
+                im = ingest.load_image(file.file)
+            finally:
+                file.file.close()
+
+        # Catch re-uploads of the same garment before paying for a vision call
+        with metrics.stage("dedup"):
+            phash = dedup.dhash(im)
+            match = None if allow_duplicate else dedup.find_duplicate(db, current_user, phash, DUPLICATE_MAX_DISTANCE)
+        if match:
+            existing = db.query(Item).filter(Item.id == match[0], Item.user_id == current_user.id).first()
+            if existing:
+                raise HTTPException(status_code=409, detail={
+                    "message": f"This looks like an item already in your closet ({existing.type}).",
+                    "duplicate_of": {"id": existing.id, "image_url": existing.image_url, "type": existing.type, "slot": existing.slot},
+                    "distance": match[1],
+                })
+
+        with metrics.stage("save"):
+            im.thumbnail((1024, 1024))
+            data = encode_jpeg(im)
+            image_key = storage.write_blob(data)
+
+        # Off the event loop: k-means is CPU work, and the vision call may
+        # wait for a scheduler slot. The analysis is shared with tag_item.
+        with metrics.stage("analyze"):
+            local = await run_in_threadpool(analyze_image, im)
+        with metrics.stage("vision"):
+            tags: ItemTags = await run_vision(tag_item, data, local)
 
         row = Item(
             id=item_id,
             user_id=current_user.id,
-            image_url=f"/images/{item_id}.jpg",
+            image_url=storage.image_url(image_key),
             slot=tags.slot, type=tags.type, color_primary=tags.color_primary,
             colors_secondary=json.dumps(tags.colors_secondary),
             pattern=tags.pattern, material=tags.material, fit=tags.fit,
@@ -198,9 +304,20 @@ async def create_item(
             features=json.dumps(tags.features),
             brand_or_logo_visible=1 if tags.brand_or_logo_visible else 0,
             notes=tags.notes,
+            phash=phash,
+            color_hist=similarity.color_histogram(local and local["color_shares"]),
+            prompt_version=PROMPT_VERSION,
         )
-        db.add(row)
-        db.commit()
+        # References are taken at commit so no write transaction stays open
+        # while the vision call waits for the scheduler
+        with metrics.stage("commit"):
+            storage.retain(db, image_key, len(data))
+            db.add(row)
+            etags.bump(db, current_user.id)
+            db.commit()
+            dedup.register(current_user.id, [(item_id, phash)])
+            similarity.add_item(row)
+            decks.add_items(current_user.id, [row])
 
         return {"id": item_id, "image_url": row.image_url, **tags.model_dump()}
     except HTTPException:
@@ -218,55 +335,50 @@ async def create_items_from_outfit(
     db: Session = Depends(get_db)
 ):
     """Upload a photo of a person/outfit and automatically separate into individual items"""
+    metrics.set_endpoint("create_items_from_outfit")
+    scheduler.set_principal(current_user.id, scheduler.INTERACTIVE)
     try:
-        outfit_id = str(uuid.uuid4())
-        img_path = os.path.join(STORAGE_DIR, f"outfit_{outfit_id}.jpg")
-
-        try:
-            im = Image.open(file.file).convert("RGB")
-        finally:
-            file.file.close()
-
-        im.thumbnail((1024, 1024))
-        im.save(img_path, "JPEG", quality=85)
-
-        detected_items = separate_clothing_items(img_path)
+        with metrics.stage("decode"):
+            try:
+                im = ingest.load_image(file.file)
+            finally:
+                file.file.close()
+
+        # Every garment references the same stored photo, so it is written once
+        with metrics.stage("save"):
+            im.thumbnail((1024, 1024))
+            data = encode_jpeg(im)
+            image_key = storage.write_blob(data)
+
+        with metrics.stage("separate"):
+            detected_items = await run_vision(separate_clothing_items, data, max_tokens=2000)
         
         if not detected_items or len(detected_items) == 0:
             raise HTTPException(status_code=400, detail="No clothing items detected in the image. Please try a different photo.")
         
         created_items = []
+        rows = []
         
-        for idx, item_info in enumerate(detected_items):
-            item_id = str(uuid.uuid4())
-            item_img_path = os.path.join(STORAGE_DIR, f"{item_id}.jpg")
-            
-            im.save(item_img_path, "JPEG", quality=85)
-            
-            tags: ItemTags = tag_item_with_context(img_path, item_info)
-            
-            row = Item(
-                id=item_id,
-                user_id=current_user.id,
-                image_url=f"/images/{item_id}.jpg",
-                slot=tags.slot, type=tags.type, color_primary=tags.color_primary,
-                colors_secondary=json.dumps(tags.colors_secondary),
-                pattern=tags.pattern, material=tags.material, fit=tags.fit,
-                formality=tags.formality, season=json.dumps(tags.season),
-                features=json.dumps(tags.features),
-                brand_or_logo_visible=1 if tags.brand_or_logo_visible else 0,
-                notes=tags.notes,
-            )
+        for item_info in detected_items:
+            tags, local = await run_vision(tag_garment, data, im, item_info)
+            row = garment_row(current_user.id, image_key, tags, local)
             db.add(row)
+            rows.append(row)
             
             created_items.append({
-                "id": item_id,
+                "id": row.id,
                 "image_url": row.image_url,
                 "detected_info": item_info,
                 **tags.model_dump()
             })
         
-        db.commit()
+        with metrics.stage("commit"):
+            storage.retain(db, image_key, len(data), count=len(rows))
+            etags.bump(db, current_user.id)
+            db.commit()
+            similarity.add_items(current_user.id, rows)
+            dedup.register(current_user.id, [(row.id, row.phash) for row in rows])
+            decks.add_items(current_user.id, rows)
         return {"items": created_items, "total": len(created_items)}
     except HTTPException:
         raise
@@ -276,32 +388,196 @@ async def create_items_from_outfit(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to upload outfit: {str(e)}")
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _sse_error(error: Exception, detail: str, **fields) -> str:
+    """`error` event; a saturated vision scheduler passes on its retry hints"""
+    if isinstance(error, scheduler.VisionBusy):
+        return _sse("error", {**fields, **error.detail, "detail": error.detail["message"]})
+    return _sse("error", {**fields, "detail": detail})
+
+def _save_garment(db: Session, row: Item, image_key: str, size: int):
+    storage.retain(db, image_key, size)
+    db.add(row)
+    etags.bump(db, row.user_id)
+    db.commit()
+
+@app.post("/items/outfit/stream")
+async def create_items_from_outfit_stream(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+):
+    """Like POST /items/outfit, but answers with server-sent events as work completes.
+
+    Events: `separated` ({total}) once garments are found, then one `item`
+    (the saved item, as POST /items/outfit returns it) per garment in the order
+    they finish tagging, then `done` ({total, failed}). `error` ({detail})
+    reports a garment or the whole upload failing. Each garment is saved as
+    soon as it is tagged, so a dropped connection keeps what was already sent.
+    """
+    metrics.set_endpoint("create_items_from_outfit_stream")
+    scheduler.set_principal(current_user.id, scheduler.INTERACTIVE)
+    user_id = current_user.id
+
+    def prepare():
+        with metrics.stage("decode"):
+            try:
+                im = ingest.load_image(file.file)
+            finally:
+                file.file.close()
+        with metrics.stage("save"):
+            im.thumbnail((1024, 1024))
+            data = encode_jpeg(im)
+            return im, data, storage.write_blob(data)
+
+    try:
+        im, data, image_key = await run_in_threadpool(prepare)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(400, f"Could not read image: {e}")
+
+    def separate():
+        with metrics.stage("separate"):
+            return separate_clothing_items(data)
+
+    async def tag(index: int, item_info: dict, limit: asyncio.Semaphore):
+        async with limit:
+            try:
+                # The threadpool copies contextvars, so metrics stages keep their endpoint label
+                return index, item_info, await run_vision(tag_garment, data, im, item_info), None
+            except Exception as e:
+                return index, item_info, None, e
+
+    async def events():
+        db = SessionLocal()
+        tasks = []
+        try:
+            detected_items = await run_vision(separate, max_tokens=2000)
+            if not detected_items:
+                yield _sse("error", {"detail": "No clothing items detected in the image. Please try a different photo."})
+                return
+            yield _sse("separated", {"total": len(detected_items)})
+
+            limit = asyncio.Semaphore(OUTFIT_TAG_CONCURRENCY)
+            tasks = [asyncio.create_task(tag(i, info, limit)) for i, info in enumerate(detected_items)]
+            created = failed = 0
+            for next_done in asyncio.as_completed(tasks):
+                index, item_info, result, error = await next_done
+                if error is not None:
+                    failed += 1
+                    print(f"Error tagging garment {index}: {error}")
+                    yield _sse_error(error, f"Failed to tag item: {error}", index=index)
+                    continue
+                tags, local = result
+                row = garment_row(user_id, image_key, tags, local)
+                with metrics.stage("commit"):
+                    await run_in_threadpool(_save_garment, db, row, image_key, len(data))
+                similarity.add_item(row)
+                dedup.register(user_id, [(row.id, row.phash)])
+                decks.add_items(user_id, [row])
+                created += 1
+                yield _sse("item", {
+                    "index": index, "id": row.id, "image_url": row.image_url,
+                    "detected_info": item_info, **tags.model_dump(),
+                })
+            yield _sse("done", {"total": created, "failed": failed})
+        except Exception as e:
+            print(f"Error streaming outfit upload: {e}")
+            yield _sse_error(e, f"Failed to upload outfit: {str(e)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            db.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/items")
 def list_items(
     slot: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """List all items in user's closet, optionally filtered by slot"""
+    """List all items in user's closet, optionally filtered by slot (304 if unchanged)"""
+    slot = vocab_filter("slot", slot)
+    etag = etags.closet_etag(current_user)
+    if etags.matches(if_none_match, etag):
+        return etags.not_modified(etag)
+
     query = db.query(Item).filter(Item.user_id == current_user.id)
     
     if slot:
         query = query.filter(Item.slot == slot)
     
     rows = query.order_by(Item.created_at.desc()).all()
-    
-    def to_json(r: Item):
-        return {
-            "id": r.id, "image_url": r.image_url,
-            "slot": r.slot, "type": r.type, "color_primary": r.color_primary,
-            "colors_secondary": json.loads(r.colors_secondary),
-            "pattern": r.pattern, "material": r.material, "fit": r.fit,
-            "formality": r.formality, "season": json.loads(r.season),
-            "features": json.loads(r.features),
-            "brand_or_logo_visible": bool(r.brand_or_logo_visible),
-            "notes": r.notes, "created_at": str(r.created_at or "")
-        }
-    return [to_json(r) for r in rows]
+    return etags.json_response([item_to_json(r) for r in rows], etag)
+
+@app.get("/closet/stats")
+def get_closet_stats(
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Item counts per slot, primary color, formality and season (304 if unchanged)"""
+    etag = etags.closet_etag(current_user)
+    if etags.matches(if_none_match, etag):
+        return etags.not_modified(etag)
+    return etags.json_response(stats.closet_stats(db, current_user.id), etag)
+
+@app.get("/items/search")
+def search_items(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Full-text search over item type, material, pattern, features, colors and notes"""
+    if not search.fts_available(engine):
+        raise HTTPException(501, "search requires SQLite FTS5")
+
+    # Fetch one extra hit to know whether another page exists
+    hits = search.search_item_ids(db, current_user.id, q, limit + 1, offset)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    rows = {r.id: r for r in db.query(Item).filter(Item.id.in_([item_id for item_id, _ in hits]))}
+    return {
+        "items": [item_to_json(rows[item_id]) for item_id, _ in hits if item_id in rows],
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + limit if has_more else None,
+    }
+
+@app.get("/items/{item_id}/similar")
+def similar_items(
+    item_id: str,
+    k: int = Query(10, ge=1, le=100),
+    slot: Optional[str] = Query(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Items in the user's closet that look like / go with the given item"""
+    slot = vocab_filter("slot", slot)
+    item = db.query(Item).filter(Item.id == item_id, Item.user_id == current_user.id).first()
+    if not item:
+        raise HTTPException(404, "item not found")
+
+    # Over-fetch when filtering by slot since the index doesn't know about slots
+    matches = similarity.find_similar(db, current_user, item_id, k * 5 if slot else k)
+    scores = dict(matches)
+    query = db.query(Item).filter(Item.id.in_(scores.keys()), Item.user_id == current_user.id)
+    if slot:
+        query = query.filter(Item.slot == slot)
+    rows = sorted(query.all(), key=lambda r: scores[r.id], reverse=True)[:k]
+
+    return {
+        "item_id": item_id,
+        "similar": [{**item_to_json(r), "score": round(scores[r.id], 4)} for r in rows],
+    }
 
 @app.delete("/items/{item_id}")
 def delete_item(
@@ -314,15 +590,45 @@ def delete_item(
     if not item:
         raise HTTPException(404, "item not found")
     
-    img_filename = os.path.basename(item.image_url)
-    img_path = os.path.join(STORAGE_DIR, img_filename)
-    if os.path.exists(img_path):
-        os.remove(img_path)
-    
+    # The image file itself is removed by the background collector
+    storage.release_url(db, item.image_url)
     db.delete(item)
+    etags.bump(db, current_user.id)
     db.commit()
+    dedup.unregister(current_user.id, [item_id])
+    similarity.remove_item(current_user.id, item_id)
+    decks.remove_items(current_user.id, [item_id])
     return {"ok": True, "deleted_id": item_id}
 
+@app.post("/items/bulk-delete")
+def bulk_delete_items(
+    body: ItemBulkDelete,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Delete many items in one transaction; images are removed later by the background collector"""
+    ids = list(dict.fromkeys(body.ids))
+    items = db.query(Item.id, Item.image_url).filter(Item.user_id == current_user.id, Item.id.in_(ids)).all()
+    found = {item.id for item in items}
+
+    for key, count in Counter(storage.key_from_url(item.image_url) for item in items).items():
+        if key:
+            storage.release(db, key, count)
+    if found:
+        db.query(Item).filter(Item.user_id == current_user.id, Item.id.in_(found)).delete(synchronize_session=False)
+        etags.bump(db, current_user.id)
+    db.commit()
+
+    if found:
+        similarity.remove_items(current_user.id, found)
+        dedup.unregister(current_user.id, found)
+        decks.remove_items(current_user.id, found)
+    return {
+        "ok": True,
+        "deleted_ids": [item_id for item_id in ids if item_id in found],
+        "not_found": [item_id for item_id in ids if item_id not in found],
+    }
+
 # ==================== OUTFIT ENDPOINTS ====================
 
 @app.get("/outfits/generate")
@@ -333,86 +639,21 @@ def generate_outfit(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Generate a random outfit from items in the closet"""
-    # Start with all user's items
-    query = db.query(Item).filter(Item.user_id == current_user.id)
-    
-    # Apply filters (case-insensitive matching for SQLite)
-    if formality:
-        query = query.filter(func.lower(Item.formality) == func.lower(formality))
-    if color:
-        query = query.filter(func.lower(Item.color_primary) == func.lower(color))
-    
-    all_items = query.all()
-    
-    # Filter by season if specified
-    if season:
-        filtered_items = []
-        for item in all_items:
-            try:
-                item_seasons = json.loads(item.season)
-                if isinstance(item_seasons, list) and season.lower() in [s.lower() for s in item_seasons]:
-                    filtered_items.append(item)
-            except:
-                pass
-        all_items = filtered_items
-    
-    # Check if we have any items after filtering
-    if not all_items:
+    """Generate a random outfit from items in the closet (popped from a precomputed deck, see decks.py)"""
+    formality, color = vocab_filter("formality", formality), vocab_filter("color", color)
+    drawn = decks.draw(db, current_user, decks.filter_key(formality, season, color))
+    if drawn is None:
         raise HTTPException(
             status_code=404,
-            detail=f"No items match your filters. You have {db.query(Item).filter(Item.user_id == current_user.id).count()} total items in your closet."
-        )
-    
-    # Group items by slot
-    items_by_slot = {}
-    for item in all_items:
-        slot_name = item.slot
-        if slot_name not in items_by_slot:
-            items_by_slot[slot_name] = []
-        items_by_slot[slot_name].append({
-            "id": item.id,
-            "image_url": item.image_url,
-            "slot": item.slot,
-            "type": item.type,
-            "color_primary": item.color_primary,
-            "colors_secondary": json.loads(item.colors_secondary),
-            "pattern": item.pattern,
-            "material": item.material,
-            "fit": item.fit,
-            "formality": item.formality,
-            "season": json.loads(item.season),
-            "features": json.loads(item.features),
-            "brand_or_logo_visible": bool(item.brand_or_logo_visible),
-            "notes": item.notes,
-        })
-    
-    # Build outfit - prioritize essential slots
-    outfit = {}
-    priority_slots = ["top", "bottom", "shoes", "outerwear", "accessory", "dress"]
-    
-    # Add one item from each priority slot if available
-    for slot_name in priority_slots:
-        if slot_name in items_by_slot and items_by_slot[slot_name]:
-            outfit[slot_name] = random.choice(items_by_slot[slot_name])
-    
-    # Add any remaining slots
-    for slot_name, items in items_by_slot.items():
-        if slot_name not in outfit and items:
-            outfit[slot_name] = random.choice(items)
-    
-    # Check if outfit is empty (shouldn't happen if all_items check passed, but just in case)
-    if not outfit:
-        raise HTTPException(
-            status_code=404,
-            detail="Could not generate outfit from available items. Please add more items to your closet."
+            detail=f"No items match your filters. You have {stats.total_items(db, current_user.id)} total items in your closet."
         )
+    outfit, items_by_slot, total = drawn
     
     return {
         "outfit": outfit,
         "slots_used": list(outfit.keys()),
-        "total_items_available": len(all_items),
-        "items_by_slot": {slot: len(items) for slot, items in items_by_slot.items()}
+        "total_items_available": total,
+        "items_by_slot": items_by_slot
     }
 
 @app.post("/outfits/save")
@@ -431,6 +672,7 @@ def save_outfit(
         filters=json.dumps(outfit_data.filters) if outfit_data.filters else None
     )
     db.add(outfit)
+    etags.bump(db, current_user.id, items=False)
     db.commit()
     db.refresh(outfit)
     
@@ -438,10 +680,15 @@ def save_outfit(
 
 @app.get("/outfits")
 def list_outfits(
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """List all saved outfits for the user"""
+    """List all saved outfits for the user (304 if unchanged)"""
+    etag = etags.closet_etag(current_user)
+    if etags.matches(if_none_match, etag):
+        return etags.not_modified(etag)
+
     outfits = db.query(Outfit).filter(Outfit.user_id == current_user.id).order_by(Outfit.created_at.desc()).all()
     
     result = []
@@ -476,7 +723,7 @@ def list_outfits(
             "created_at": str(outfit.created_at)
         })
     
-    return result
+    return etags.json_response(result, etag)
 
 @app.patch("/outfits/{outfit_id}")
 async def update_outfit(
@@ -495,6 +742,7 @@ async def update_outfit(
     
     if name is not None:
         outfit.name = name
+        etags.bump(db, current_user.id, items=False)
     
     db.commit()
     db.refresh(outfit)
@@ -513,31 +761,102 @@ def delete_outfit(
         raise HTTPException(404, "outfit not found")
     
     db.delete(outfit)
+    etags.bump(db, current_user.id, items=False)
     db.commit()
     return {"ok": True, "deleted_id": outfit_id}
 
+# ==================== EXPORT / IMPORT ====================
+
+@app.get("/export")
+def export_closet(current_user: User = Depends(get_current_user)):
+    """Download the whole closet (items, outfits, images) as a zip, streamed as it is built"""
+    name = "".join(c for c in current_user.username if c.isascii() and (c.isalnum() or c in "-_")) or "closet"
+    filename = f"looklabs-{name}-{datetime.now(timezone.utc):%Y%m%d}.zip"
+    return StreamingResponse(
+        archive.export_closet(current_user.id, current_user.username),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.post("/import")
+def import_closet(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Restore a closet export into this account (added alongside existing items, not re-tagged)"""
+    try:
+        result = archive.import_closet(db, current_user.id, file.file)
+    except archive.ArchiveError as e:
+        db.rollback()
+        raise HTTPException(400, str(e))
+    finally:
+        file.file.close()
+    return {"ok": True, **result}
+
 # ==================== STATIC FILES ====================
 
 @app.get("/images/{filename}")
 def get_image(filename: str):
-    path = os.path.join(STORAGE_DIR, filename)
-    if not os.path.exists(path):
+    key = storage.key_from_url(filename)
+    # Object stores serve the bytes themselves; workers only hand out a short-lived link
+    presigned = key and storage.get_backend().presigned_url(key)
+    if presigned:
+        max_age = max(0, storage.S3_PRESIGN_EXPIRES - 300)
+        return RedirectResponse(presigned, status_code=307, headers={"Cache-Control": f"private, max-age={max_age}"})
+
+    path = storage.resolve(filename)
+    if not path:
         raise HTTPException(404, "image not found")
-    return FileResponse(path, media_type="image/jpeg")
+    # Content-addressed names never change meaning, so they can be cached forever
+    headers = {"Cache-Control": storage.IMMUTABLE_CACHE} if key else None
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
 
 @app.get("/healthz")
 def health():
     return {"ok": True}
 
-# Mount static files for frontend
-FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend")
-if os.path.exists(FRONTEND_DIR):
-    app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text-format metrics (404 unless METRICS_ENABLED)"""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(404, "Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, request: Request, format: str = Query("folded", pattern="^(folded|json)$")):
+    """Download a saved request profile: folded stacks, or the JSON summary with SQL timings"""
+    token = request.headers.get("x-profile") or request.query_params.get("profile")
+    if not profiling.PROFILING_ENABLED or not profiling.authorized(token):
+        raise HTTPException(404, "Not Found")
+    path = profiling.profile_path(profile_id, format)
+    if not path:
+        raise HTTPException(404, "Profile not found")
+    return FileResponse(path, media_type="application/json" if format == "json" else "text/plain")
+
+# Frontend assets: fingerprinted, precompressed copies prepared by assets.py
+@app.api_route("/static/{name}", methods=["GET", "HEAD"])
+def get_static(
+    name: str,
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    bundle = assets.get_bundle()
+    asset = bundle.hashed.get(name)
+    if asset is not None:
+        return assets.response(asset, accept_encoding, if_none_match, assets.IMMUTABLE)
+    asset = bundle.assets.get(name)  # Plain name, e.g. from a page cached before a deploy
+    if asset is None:
+        raise HTTPException(404, "Not found")
+    return assets.response(asset, accept_encoding, if_none_match, assets.REVALIDATE)
 
 @app.get("/")
-def serve_frontend():
-    """Serve the frontend HTML"""
-    frontend_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend", "index.html")
-    if os.path.exists(frontend_path):
-        return FileResponse(frontend_path)
-    return {"message": "Frontend not found. Please create frontend/index.html"}
+def serve_frontend(
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Serve the frontend HTML (references rewritten to fingerprinted assets)"""
+    index = assets.get_bundle().index
+    if index is None:
+        return {"message": "Frontend not found. Please create frontend/index.html"}
+    return assets.response(index, accept_encoding, if_none_match, assets.REVALIDATE)
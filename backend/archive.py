@@ -0,0 +1,316 @@
+import io
+import json
+import time
+import uuid
+import base64
+import zipfile
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from .models import Item, Outfit
+from .schemas import ItemTags
+from .vocab import normalize_tags
+from . import decks, dedup, etags, ingest, similarity, storage
+
+# Closet export/import archives.
+# An export is a zip streamed straight to the client:
+#   manifest.json    format, version, exporting user
+#   items.ndjson     one item per line (tags, hashes, archive name of its image)
+#   outfits.ndjson   one saved outfit per line (item ids as in items.ndjson)
+#   images/<name>    each distinct image once, stored uncompressed (already JPEG)
+# Rows are read in batches with yield_per and images are copied in chunks, so
+# memory stays flat whatever the closet size. Importing inserts everything
+# under fresh ids in bulk and keeps the stored tags: nothing is re-tagged.
+
+ARCHIVE_FORMAT = "looklabs-closet"
+ARCHIVE_VERSION = 1
+EXPORT_BATCH_SIZE = 500
+IMPORT_BATCH_SIZE = 500
+MAX_IMAGE_BYTES = 25 * 1024 * 1024
+
+
+class ArchiveError(ValueError):
+    """The uploaded file is not a usable closet export"""
+
+
+class _Sink:
+    """Write-only file object for ZipFile that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _entry(name: str, compress_type: int) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+def _image_name(url: str) -> str:
+    return f"images/{url.rsplit('/', 1)[-1]}"
+
+
+def _item_record(item: Item) -> dict:
+    return {
+        "id": item.id, "image": _image_name(item.image_url),
+        "slot": item.slot, "type": item.type, "color_primary": item.color_primary,
+        "colors_secondary": json.loads(item.colors_secondary),
+        "pattern": item.pattern, "material": item.material, "fit": item.fit,
+        "formality": item.formality, "season": json.loads(item.season),
+        "features": json.loads(item.features),
+        "brand_or_logo_visible": bool(item.brand_or_logo_visible), "notes": item.notes,
+        "phash": item.phash,
+        "color_hist": base64.b64encode(item.color_hist).decode() if item.color_hist else None,
+        "prompt_version": item.prompt_version,
+        "created_at": item.created_at.isoformat() if item.created_at else None,
+    }
+
+
+def _outfit_record(outfit: Outfit) -> dict:
+    return {
+        "id": outfit.id, "name": outfit.name, "items": json.loads(outfit.items),
+        "filters": json.loads(outfit.filters) if outfit.filters else None,
+        "created_at": outfit.created_at.isoformat() if outfit.created_at else None,
+    }
+
+
+def export_closet(user_id: str, username: str) -> Iterator[bytes]:
+    """Yield a zip archive of the user's closet, piece by piece.
+
+    Uses its own session: the response is still streaming after the request
+    handler (and its session) has finished.
+    """
+    sink = _Sink()
+    images: Dict[str, str] = {}  # archive name -> image URL
+    db = SessionLocal()
+    try:
+        with zipfile.ZipFile(sink, "w") as zf:
+            zf.writestr(_entry("manifest.json", zipfile.ZIP_DEFLATED), json.dumps({
+                "format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "username": username,
+                "exported_at": datetime.now(timezone.utc).isoformat(),
+            }, indent=2))
+
+            with zf.open(_entry("items.ndjson", zipfile.ZIP_DEFLATED), "w") as f:
+                rows = db.query(Item).filter(Item.user_id == user_id).order_by(Item.created_at, Item.id)
+                for i, item in enumerate(rows.yield_per(EXPORT_BATCH_SIZE), 1):
+                    record = _item_record(item)
+                    images.setdefault(record["image"], item.image_url)
+                    f.write(json.dumps(record).encode() + b"\n")
+                    if i % EXPORT_BATCH_SIZE == 0:
+                        yield sink.drain()
+            yield sink.drain()
+
+            with zf.open(_entry("outfits.ndjson", zipfile.ZIP_DEFLATED), "w") as f:
+                rows = db.query(Outfit).filter(Outfit.user_id == user_id).order_by(Outfit.created_at, Outfit.id)
+                for i, outfit in enumerate(rows.yield_per(EXPORT_BATCH_SIZE), 1):
+                    f.write(json.dumps(_outfit_record(outfit)).encode() + b"\n")
+                    if i % EXPORT_BATCH_SIZE == 0:
+                        yield sink.drain()
+            yield sink.drain()
+            db.close()  # Done with the database; don't hold a connection while copying images
+
+            for name, url in images.items():
+                chunks = storage.iter_image(url)
+                if chunks is None:
+                    print(f"Export: image missing for {url}")
+                    continue
+                with zf.open(_entry(name, zipfile.ZIP_STORED), "w") as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        yield sink.drain()
+        yield sink.drain()  # Central directory
+    finally:
+        db.close()
+
+
+def _read_image(zf: zipfile.ZipFile, name: str) -> Optional[bytes]:
+    """Bytes of an archived image if present, sane-sized and really an image"""
+    try:
+        info = zf.getinfo(name)
+    except KeyError:
+        return None
+    if not name.startswith("images/") or info.file_size > MAX_IMAGE_BYTES:
+        return None
+    data = zf.read(info)
+    try:
+        ingest.probe(io.BytesIO(data)).verify()  # Same format and pixel limits as uploads
+    except Exception:
+        return None
+    return data
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _decode_hist(value) -> Optional[bytes]:
+    """Stored color histogram, if it has the shape similarity.py expects"""
+    try:
+        hist = base64.b64decode(value, validate=True) if isinstance(value, str) else None
+    except ValueError:
+        return None
+    return hist if hist and len(hist) == 4 * len(similarity.COLOR_NAMES) else None
+
+
+def _valid_phash(value) -> Optional[str]:
+    if not isinstance(value, str) or len(value) != 16:
+        return None
+    try:
+        int(value, 16)
+    except ValueError:
+        return None
+    return value.lower()
+
+
+def _valid_version(value) -> Optional[int]:
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _ndjson(zf: zipfile.ZipFile, name: str) -> Iterator[dict]:
+    try:
+        f = zf.open(name)
+    except KeyError:
+        return
+    with f, io.TextIOWrapper(f, encoding="utf-8") as lines:
+        for line_no, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None
+                if not isinstance(record, dict):
+                    raise ArchiveError(f"{name} line {line_no} is not a JSON object")
+                yield record
+
+
+def _batches(records: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_closet(db: Session, user_id: str, fileobj) -> dict:
+    """Add the items and outfits of an export archive to the user's closet.
+
+    Everything gets new ids, so importing into the account it came from (or
+    twice) duplicates rather than overwrites. Items whose image is missing or
+    unreadable are skipped, as are outfit entries pointing at them. Runs in
+    one transaction; images stored before a failure are left for the collector.
+    """
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ArchiveError("Not a zip archive")
+
+    with zf:
+        try:
+            manifest = json.loads(zf.read("manifest.json"))
+        except (KeyError, ValueError):
+            raise ArchiveError("Archive has no readable manifest.json")
+        if manifest.get("format") != ARCHIVE_FORMAT or manifest.get("version") != ARCHIVE_VERSION:
+            raise ArchiveError("Not a LookLabs closet export (or from an unsupported version)")
+
+        id_map: Dict[str, str] = {}      # exported item id -> new item id
+        images: Dict[str, Optional[Tuple[str, int]]] = {}  # archive name -> (blob key, size), None if unusable
+        new_items: List[Item] = []
+        skipped = 0
+        now = datetime.now(timezone.utc)
+
+        for batch in _batches(_ndjson(zf, "items.ndjson"), IMPORT_BATCH_SIZE):
+            rows, refs = [], Counter()
+            for record in batch:
+                name = str(record.get("image") or "")
+                if name not in images:
+                    data = _read_image(zf, name)
+                    images[name] = (storage.write_blob(data), len(data)) if data is not None else None
+                try:
+                    tags = normalize_tags(ItemTags.model_validate(record))
+                except ValidationError:
+                    tags = None
+                if images[name] is None or tags is None:
+                    skipped += 1
+                    continue
+
+                item_id = str(uuid.uuid4())
+                id_map[str(record.get("id"))] = item_id
+                refs[images[name]] += 1
+                rows.append({
+                    "id": item_id, "user_id": user_id, "image_url": storage.image_url(images[name][0]),
+                    "slot": tags.slot, "type": tags.type, "color_primary": tags.color_primary,
+                    "colors_secondary": json.dumps(tags.colors_secondary),
+                    "pattern": tags.pattern, "material": tags.material, "fit": tags.fit,
+                    "formality": tags.formality, "season": json.dumps(tags.season),
+                    "features": json.dumps(tags.features),
+                    "brand_or_logo_visible": 1 if tags.brand_or_logo_visible else 0,
+                    "notes": tags.notes,
+                    "phash": _valid_phash(record.get("phash")),
+                    "color_hist": _decode_hist(record.get("color_hist")),
+                    "prompt_version": _valid_version(record.get("prompt_version")),
+                    "created_at": _parse_time(record.get("created_at")) or now,
+                })
+
+            if rows:
+                db.execute(insert(Item), rows)
+                new_items.extend(Item(**row) for row in rows)
+            for (key, size), count in refs.items():
+                storage.retain(db, key, size, count)
+
+        outfits = 0
+        for batch in _batches(_ndjson(zf, "outfits.ndjson"), IMPORT_BATCH_SIZE):
+            rows = []
+            for record in batch:
+                exported_ids = record.get("items")
+                item_ids = [id_map[str(i)] for i in exported_ids if str(i) in id_map] if isinstance(exported_ids, list) else []
+                if not item_ids:
+                    continue
+                name = record.get("name")
+                rows.append({
+                    "id": str(uuid.uuid4()), "user_id": user_id, "name": name if isinstance(name, str) else None,
+                    "items": json.dumps(item_ids),
+                    "filters": json.dumps(record["filters"]) if record.get("filters") else None,
+                    "created_at": _parse_time(record.get("created_at")) or now,
+                })
+            if rows:
+                db.execute(insert(Outfit), rows)
+                outfits += len(rows)
+
+    if new_items or outfits:
+        etags.bump(db, user_id, items=bool(new_items))
+    db.commit()
+
+    if new_items:
+        similarity.add_items(user_id, new_items)
+        dedup.register(user_id, [(item.id, item.phash) for item in new_items])
+        decks.add_items(user_id, new_items)
+    return {
+        "items_imported": len(new_items),
+        "items_skipped": skipped,
+        "outfits_imported": outfits,
+        "images_imported": sum(1 for image in images.values() if image),
+    }
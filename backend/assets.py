@@ -0,0 +1,135 @@
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+import threading
+from typing import Dict, Optional
+
+from fastapi import Response
+
+try:
+    import brotli  # Optional: pip install brotli for br variants
+except ImportError:
+    brotli = None
+
+# Frontend asset delivery, prepared in memory when the app starts (no build tool).
+# Every file in frontend/ except index.html gets a fingerprinted name
+# (app.<hash>.js) plus gzip and, with the brotli package, br variants.
+# index.html is served with its /static/ references rewritten to those names,
+# so hashed assets can be cached forever (immutable) while index.html itself
+# is revalidated on every visit. Plain names keep working, revalidated too.
+# Set ASSETS_RELOAD=true while editing the frontend to re-prepare changed files.
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend")
+ASSETS_RELOAD = os.getenv("ASSETS_RELOAD", "false").lower() == "true"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+MIN_COMPRESS_BYTES = 1024   # Smaller files aren't worth a compressed variant
+
+_STATIC_REF = re.compile(r'(?P<attr>href|src)="/static/(?P<name>[^"?#]+)(?:\?[^"#]*)?"')
+
+
+class Asset:
+    def __init__(self, name: str, data: bytes, media_type: str):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.hashed_name = f"{stem}.{self.digest}{ext}"
+        self.etag = f'W/"{self.digest}"'   # Weak: shared by the encoded variants
+        self.variants: Dict[str, bytes] = {"identity": data}
+        if len(data) >= MIN_COMPRESS_BYTES:
+            self.variants["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(data, quality=11)
+
+
+class Bundle:
+    def __init__(self, assets: Dict[str, Asset], index: Optional[Asset], mtimes: Dict[str, float]):
+        self.assets = assets              # plain name -> asset
+        self.hashed = {asset.hashed_name: asset for asset in assets.values()}
+        self.index = index
+        self.mtimes = mtimes
+
+
+_bundle: Optional[Bundle] = None
+_lock = threading.Lock()
+
+
+def _source_mtimes(directory: str) -> Dict[str, float]:
+    if not os.path.isdir(directory):
+        return {}
+    return {name: os.path.getmtime(os.path.join(directory, name))
+            for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name))}
+
+
+def build(directory: str = FRONTEND_DIR) -> Bundle:
+    """Fingerprint and precompress the frontend, then rewrite index.html to the hashed names"""
+    global _bundle
+    mtimes = _source_mtimes(directory)
+    assets = {}
+    for name in sorted(mtimes):
+        if name == "index.html" or name.startswith("."):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            data = f.read()
+        assets[name] = Asset(name, data, mimetypes.guess_type(name)[0] or "application/octet-stream")
+
+    index = None
+    if "index.html" in mtimes:
+        with open(os.path.join(directory, "index.html"), encoding="utf-8") as f:
+            html = f.read()
+
+        def rewrite(match):
+            asset = assets.get(match["name"])
+            name = asset.hashed_name if asset else match["name"]
+            return f'{match["attr"]}="/static/{name}"'
+
+        index = Asset("index.html", _STATIC_REF.sub(rewrite, html).encode("utf-8"), "text/html; charset=utf-8")
+
+    with _lock:
+        _bundle = Bundle(assets, index, mtimes)
+    return _bundle
+
+
+def get_bundle() -> Bundle:
+    """The prepared assets; built on first use, and again after edits when ASSETS_RELOAD is on"""
+    bundle = _bundle
+    if bundle is None or (ASSETS_RELOAD and _source_mtimes(FRONTEND_DIR) != bundle.mtimes):
+        bundle = build()
+    return bundle
+
+
+def _accepted(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Content codings from an Accept-Encoding header with their q-values"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def pick_encoding(asset: Asset, accept_encoding: Optional[str]) -> str:
+    accepted = _accepted(accept_encoding)
+    for coding in ("br", "gzip"):
+        if coding in asset.variants and accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return "identity"
+
+
+def response(asset: Asset, accept_encoding: Optional[str], if_none_match: Optional[str], cache_control: str) -> Response:
+    """The best precompressed variant of an asset, or 304 if the client's copy is current"""
+    headers = {"ETag": asset.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if if_none_match and asset.etag[2:] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    coding = pick_encoding(asset, accept_encoding)
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return Response(asset.variants[coding], media_type=asset.media_type, headers=headers)
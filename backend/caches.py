@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from typing import Any, ContextManager, Dict, Iterator, Optional, Sized
+
+# Version bookkeeping shared by the per-process closet caches (dedup hash
+# indexes, similarity vector indexes, outfit decks).
+# users.items_version is bumped, in the same transaction, by every change to a
+# user's items (etags.bump). Each cache records the items_version it reflects,
+# and each patch() a worker applies after its own commit stands for exactly
+# one bump. A cache behind the user's row therefore missed a change made by
+# another worker or a script, and is rebuilt from the database. Outfit changes
+# bump only closet_version (the listings' ETag), so they leave the caches alone.
+
+
+def items_version(user) -> int:
+    # Rows from before the column existed hold NULL
+    return user.items_version or 0
+
+
+def is_current(cache, user) -> bool:
+    """Whether a loaded cache (None if there is none) reflects every item change of the user"""
+    return cache is not None and cache.version >= items_version(user)
+
+
+@contextmanager
+def patch(caches: Dict[str, Any], user_id: str, lock: ContextManager, changes: Sized) -> Iterator[Optional[Any]]:
+    """Yield the user's loaded cache (None if there is none) to apply one committed change to.
+
+    Holds lock throughout and records the bump afterwards, unless the body
+    dropped the cache from caches. No changes means nothing was committed or
+    bumped, so the body gets None and the version stays put.
+    """
+    if not changes:
+        yield None
+        return
+    with lock:
+        cache = caches.get(user_id)
+        yield cache
+        if cache is not None and caches.get(user_id) is cache:
+            cache.version += 1
@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from typing import Dict, List
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import IntegrityError
+
+from .db import SessionLocal
+from . import etags, storage
+
+# Background garbage collector for image storage and saved outfits.
+# Requests never delete files themselves: they only drop blob references.
+# Every COLLECTOR_INTERVAL_SECONDS this reconciles storage with the database,
+# a batch at a time:
+#   - blobs whose reference count reached zero (row and object removed)
+#   - objects with no blob row at all, e.g. from uploads that failed before commit
+#   - legacy flat files in STORAGE_DIR that no row points at (old outfit_*.jpg originals)
+#   - item ids in saved outfits whose items no longer exist
+# Anything modified within COLLECTOR_GRACE_SECONDS is left alone so uploads
+# still in flight (object written, row not yet committed) are never touched.
+# Outfits left with no items are kept (empty) unless COLLECTOR_DELETE_EMPTY_OUTFITS
+# is set.
+#
+# Every worker starts the thread, but a pass only runs in the process holding
+# the "collector" row in the leases table, so N workers still sweep once per
+# interval. The holder renews the lease before each step; if it dies, another
+# worker takes over once the lease expires (COLLECTOR_LEASE_SECONDS).
+
+COLLECTOR_INTERVAL_SECONDS = float(os.getenv("COLLECTOR_INTERVAL_SECONDS", "600"))
+COLLECTOR_GRACE_SECONDS = float(os.getenv("COLLECTOR_GRACE_SECONDS", "3600"))
+COLLECTOR_BATCH_SIZE = int(os.getenv("COLLECTOR_BATCH_SIZE", "500"))
+COLLECTOR_LEASE_SECONDS = float(os.getenv("COLLECTOR_LEASE_SECONDS", str(max(2 * COLLECTOR_INTERVAL_SECONDS, 60))))
+COLLECTOR_DELETE_EMPTY_OUTFITS = os.getenv("COLLECTOR_DELETE_EMPTY_OUTFITS", "false").lower() == "true"
+
+LEASE_NAME = "collector"
+
+_stop = threading.Event()
+_thread = None
+_nonce = uuid.uuid4().hex[:8]
+
+
+def _holder() -> str:
+    # The pid is read per call: forked workers inherit the module but not the lease
+    return f"{socket.gethostname()}:{os.getpid()}:{_nonce}"
+
+
+def acquire_lease(db, name: str = LEASE_NAME, holder: str = None, seconds: float = None) -> bool:
+    """Take or renew a lease; False while another holder's lease is unexpired"""
+    holder = holder or _holder()
+    now = time.time()
+    expires_at = now + (COLLECTOR_LEASE_SECONDS if seconds is None else seconds)
+    params = {"name": name, "holder": holder, "now": now, "expires_at": expires_at}
+    taken = db.execute(text(
+        "UPDATE leases SET holder = :holder, expires_at = :expires_at "
+        "WHERE name = :name AND (holder = :holder OR expires_at < :now)"
+    ), params).rowcount
+    if not taken:
+        try:
+            db.execute(text("INSERT INTO leases (name, holder, expires_at) VALUES (:name, :holder, :expires_at)"),
+                       params)
+            taken = 1
+        except IntegrityError:
+            taken = 0  # Someone else holds it
+    if taken:
+        db.commit()
+    else:
+        db.rollback()
+    return bool(taken)
+
+
+def release_lease(db, name: str = LEASE_NAME, holder: str = None):
+    """Give up a lease early so another process need not wait for it to expire"""
+    db.execute(text("DELETE FROM leases WHERE name = :name AND holder = :holder"),
+               {"name": name, "holder": holder or _holder()})
+    db.commit()
+
+
+def _batches(iterable, size: int):
+    batch = []
+    for value in iterable:
+        batch.append(value)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def collect_released_blobs(db, cutoff: float) -> int:
+    """Delete zero-reference blobs (row, then object) that have not been re-uploaded recently"""
+    backend = storage.get_backend()
+    removed, last_key = 0, ""
+    while True:
+        keys = db.execute(text(
+            "SELECT key FROM blobs WHERE refcount <= 0 AND key > :after ORDER BY key LIMIT :limit"
+        ), {"after": last_key, "limit": COLLECTOR_BATCH_SIZE}).scalars().all()
+        if not keys:
+            return removed
+        last_key = keys[-1]
+        for key in keys:
+            modified = backend.modified_at(key)
+            if modified is not None and modified > cutoff:
+                continue  # Someone just uploaded the same image again
+            deleted = db.execute(text("DELETE FROM blobs WHERE key = :key AND refcount <= 0"), {"key": key})
+            db.commit()
+            # Check again: an upload may have re-stored it while the row was being removed
+            modified = backend.modified_at(key)
+            if deleted.rowcount and (modified is None or modified <= cutoff):
+                backend.delete(key)
+                removed += 1
+
+
+def collect_unreferenced_objects(db, cutoff: float) -> int:
+    """Delete stored objects that have no blob row and are older than the grace period"""
+    backend = storage.get_backend()
+    removed = 0
+    old_objects = ((key, modified) for key, modified in backend.iter_objects() if modified < cutoff)
+    for batch in _batches(old_objects, COLLECTOR_BATCH_SIZE):
+        keys = [key for key, _ in batch]
+        known = set(db.execute(
+            text("SELECT key FROM blobs WHERE key IN :keys").bindparams(bindparam("keys", expanding=True)),
+            {"keys": keys}
+        ).scalars())
+        for key in keys:
+            if key in known:
+                continue
+            modified = backend.modified_at(key)
+            if modified is not None and modified <= cutoff:
+                backend.delete(key)
+                removed += 1
+
+    if isinstance(backend, storage.LocalStorage):
+        for path in backend.stale_temp_files(cutoff):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def collect_legacy_files(db, cutoff: float) -> int:
+    """Delete flat pre-content-addressing files that no item or profile photo points at"""
+    backend = storage.get_backend()
+    if not isinstance(backend, storage.LocalStorage):
+        return 0
+    removed = 0
+    old_files = (name for name, modified in backend.legacy_files() if modified < cutoff)
+    for batch in _batches(old_files, COLLECTOR_BATCH_SIZE):
+        urls = [f"/images/{name}" for name in batch]
+        referenced = set(db.execute(
+            text("SELECT image_url FROM items WHERE image_url IN :urls "
+                 "UNION SELECT profile_photo_url FROM users WHERE profile_photo_url IN :urls")
+            .bindparams(bindparam("urls", expanding=True)), {"urls": urls}
+        ).scalars())
+        for name, url in zip(batch, urls):
+            if url not in referenced:
+                os.remove(backend.legacy_path(name))
+                removed += 1
+    return removed
+
+
+def prune_outfit_references(db, delete_empty: bool = None) -> Dict[str, int]:
+    """Drop deleted item ids from saved outfits; outfits left with no items are only
+    deleted with delete_empty (default COLLECTOR_DELETE_EMPTY_OUTFITS)"""
+    if delete_empty is None:
+        delete_empty = COLLECTOR_DELETE_EMPTY_OUTFITS
+    pruned = deleted = 0
+    last_id = ""
+    while True:
+        outfits = db.execute(text(
+            "SELECT id, user_id, items FROM outfits WHERE id > :after ORDER BY id LIMIT :limit"
+        ), {"after": last_id, "limit": COLLECTOR_BATCH_SIZE}).all()
+        if not outfits:
+            return {"outfit_refs_pruned": pruned, "outfits_deleted": deleted}
+        last_id = outfits[-1].id
+
+        wanted = {item_id for outfit in outfits for item_id in json.loads(outfit.items)}
+        existing = set()
+        if wanted:
+            existing = set(db.execute(
+                text("SELECT id FROM items WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": list(wanted)}
+            ).scalars())
+        changed_users = set()
+        for outfit in outfits:
+            item_ids: List[str] = json.loads(outfit.items)
+            kept = [item_id for item_id in item_ids if item_id in existing]
+            if len(kept) == len(item_ids):
+                continue
+            pruned += len(item_ids) - len(kept)
+            # Only touch the row if the user has not edited it since it was read
+            if kept or not delete_empty:
+                changed = db.execute(text("UPDATE outfits SET items = :items WHERE id = :id AND items = :old"),
+                                     {"items": json.dumps(kept), "id": outfit.id, "old": outfit.items}).rowcount
+            else:
+                changed = db.execute(text("DELETE FROM outfits WHERE id = :id AND items = :old"),
+                                     {"id": outfit.id, "old": outfit.items}).rowcount
+                deleted += changed
+            if changed:
+                changed_users.add(outfit.user_id)
+        etags.bump_many(db, changed_users, items=False)
+        db.commit()
+
+
+def run_once(use_lease: bool = False) -> Dict[str, int]:
+    """One full collection pass; returns what was removed.
+
+    With use_lease the pass runs only while this process holds the collector
+    lease, and returns {} (or stops between steps) once it does not.
+    """
+    cutoff = time.time() - COLLECTOR_GRACE_SECONDS
+    db = SessionLocal()
+    try:
+        steps = [
+            ("released_blobs", collect_released_blobs),
+            ("unreferenced_objects", collect_unreferenced_objects),
+            ("legacy_files", collect_legacy_files),
+        ]
+        stats = {}
+        for name, step in steps:
+            if use_lease and not acquire_lease(db):
+                return stats
+            stats[name] = step(db, cutoff)
+        if use_lease and not acquire_lease(db):
+            return stats
+        stats.update(prune_outfit_references(db))
+        return stats
+    finally:
+        db.close()
+
+
+def _loop():
+    while not _stop.wait(COLLECTOR_INTERVAL_SECONDS):
+        try:
+            stats = run_once(use_lease=True)
+            if any(stats.values()):
+                print(f"Collector: {stats}")
+        except Exception as e:
+            print(f"Collector error: {e}")
+
+
+def start():
+    """Start the background collector thread (no-op if the interval is 0)"""
+    global _thread
+    if COLLECTOR_INTERVAL_SECONDS <= 0 or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="storage-collector", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+    if _thread:
+        _thread.join(timeout=5)
+        db = SessionLocal()
+        try:
+            release_lease(db)
+        except Exception:
+            pass  # Database already gone; the lease simply expires
+        finally:
+            db.close()
@@ -1,10 +1,11 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from typing import Dict
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
 
 # Use SQLite for simplicity, can be changed to PostgreSQL later
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./closet.db")
@@ -24,3 +25,55 @@ def get_db():
     finally:
         db.close()
 
+
+@contextmanager
+def exclusive_schema_change(engine: Engine):
+    """Transaction that, on SQLite, holds the write lock from its first statement.
+
+    pysqlite runs DDL outside any transaction, so without it concurrent
+    workers booting together interleave their checks and CREATEs, and a write
+    landing between a DROP and a CREATE TRIGGER is never seen by the trigger.
+    """
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        yield conn
+
+
+def sync_triggers(conn: Connection, triggers: Dict[str, str]):
+    """Create missing triggers and replace those whose DDL changed; leaves current ones alone"""
+    existing = dict(conn.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).all())
+    for name, ddl in triggers.items():
+        if " ".join((existing.get(name) or "").split()) == " ".join(ddl.split()):
+            continue
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text(ddl))
+
+
+def init_db():
+    """Bring the schema up to date: create missing tables, add columns/indexes
+    introduced after a table was created, then the vocabulary, search index
+    and closet statistics.
+
+    Runs from the app lifespan (see RUN_MIGRATIONS_ON_STARTUP) or migrate_db.py,
+    never at import time.
+    """
+    from . import models, search, stats, vocab  # noqa: F401 - registers the tables on Base
+    with exclusive_schema_change(engine) as conn:
+        Base.metadata.create_all(bind=conn)
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    vocab.init_vocab(engine)  # First: it may rebuild the items table, dropping its triggers
+    search.init_search_index(engine)
+    stats.init_closet_stats(engine)
+    # Pooled connections that re-created the items triggers can fail a later
+    # INSERT ... RETURNING with "no such table: items" (SQLite 3.40); hand
+    # requests fresh connections instead
+    engine.dispose()
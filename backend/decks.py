@@ -0,0 +1,348 @@
+import os
+import json
+import random
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import caches
+from .db import SessionLocal
+from .models import Item, User
+from .vocab import normalize
+
+# Per-user outfit decks for /outfits/generate.
+# A deck holds, for one user and one filter combination (formality, season,
+# color), the matching item ids grouped by slot plus a queue of precomputed
+# outfits. Outfits are dealt like cards: each slot's items are shuffled and
+# handed out in turn before any repeats. generate_outfit pops the next outfit;
+# when the queue runs low a background thread deals more. Decks are built on
+# the first request for a filter combination and kept (LRU) afterwards.
+#
+# Adding or deleting items patches only the decks whose filters the item
+# matches (pools and queued outfits). Decks follow users.items_version (see
+# caches.py); a user's decks that are behind missed a change made elsewhere
+# (another worker). They are all rebuilt on the background thread and keep
+# dealing meanwhile; an outfit holding an item that no longer exists is never
+# returned.
+
+OUTFIT_DECK_SIZE = int(os.getenv("OUTFIT_DECK_SIZE", "32"))
+OUTFIT_DECK_MAX_KEYS = int(os.getenv("OUTFIT_DECK_MAX_KEYS", "16"))     # filter combinations kept per user
+OUTFIT_DECK_MAX_USERS = int(os.getenv("OUTFIT_DECK_MAX_USERS", "1000"))
+PRIORITY_SLOTS = ["top", "bottom", "shoes", "outerwear", "accessory", "dress"]
+
+FilterKey = Tuple[Optional[str], Optional[str], Optional[str]]  # formality, season, color
+
+
+def filter_key(formality: Optional[str], season: Optional[str], color: Optional[str]) -> FilterKey:
+    """Canonical deck key for generate_outfit's filters"""
+    return (
+        normalize("formality", formality) if formality else None,
+        season.lower() if season else None,
+        normalize("color", color) if color else None,
+    )
+
+
+def outfit_item(item: Item) -> dict:
+    """Serialize an item the way generated outfits return it"""
+    return {
+        "id": item.id,
+        "image_url": item.image_url,
+        "slot": item.slot,
+        "type": item.type,
+        "color_primary": item.color_primary,
+        "colors_secondary": json.loads(item.colors_secondary),
+        "pattern": item.pattern,
+        "material": item.material,
+        "fit": item.fit,
+        "formality": item.formality,
+        "season": json.loads(item.season),
+        "features": json.loads(item.features),
+        "brand_or_logo_visible": bool(item.brand_or_logo_visible),
+        "notes": item.notes,
+    }
+
+
+def _matches(item: dict, key: FilterKey) -> bool:
+    formality, season, color = key
+    if formality and item["formality"] != formality:
+        return False
+    if color and item["color_primary"] != color:
+        return False
+    if season:
+        seasons = item["season"]
+        return isinstance(seasons, list) and season in [str(s).lower() for s in seasons]
+    return True
+
+
+def _compose_outfit(slots: Iterable[str], pick: Callable[[str], str]) -> Dict[str, str]:
+    """One item per slot: the essential slots first, then any others"""
+    slots = list(slots)
+    ordered = [slot for slot in PRIORITY_SLOTS if slot in slots]
+    ordered += [slot for slot in slots if slot not in PRIORITY_SLOTS]
+    return {slot: pick(slot) for slot in ordered}
+
+
+class Deck:
+    """Matching items of one filter combination and the outfits queued from them"""
+
+    def __init__(self):
+        self.pools: Dict[str, List[str]] = {}       # slot -> item ids
+        self.members: Dict[str, str] = {}           # item id -> slot
+        self.queue: deque = deque()                 # outfits as {slot: item id}
+        self.cycles: Dict[str, Tuple[List[str], int]] = {}  # slot -> (shuffled ids, next position)
+        self.refilling = False
+
+    def _draw(self, slot: str) -> str:
+        order, pos = self.cycles.get(slot, ([], 0))
+        while True:
+            if pos >= len(order):
+                order, pos = list(self.pools[slot]), 0
+                random.shuffle(order)
+            item_id = order[pos]
+            pos += 1
+            if item_id in self.members:  # Skip items deleted since the shuffle
+                self.cycles[slot] = (order, pos)
+                return item_id
+
+    def deal(self, count: int):
+        for _ in range(count):
+            self.queue.append(_compose_outfit(self.pools, self._draw))
+
+    def add(self, item_id: str, slot: str):
+        if item_id in self.members:
+            return
+        pool = self.pools.setdefault(slot, [])
+        pool.append(item_id)
+        self.members[item_id] = slot
+        self.cycles.pop(slot, None)
+        # Give queued outfits the same chance of wearing it as if they had been dealt now
+        for outfit in self.queue:
+            if slot not in outfit or random.random() < 1 / len(pool):
+                outfit[slot] = item_id
+
+    def remove(self, item_id: str):
+        slot = self.members.pop(item_id, None)
+        if slot is None:
+            return
+        pool = self.pools[slot]
+        pool.remove(item_id)
+        if not pool:
+            del self.pools[slot]
+            self.cycles.pop(slot, None)
+        for outfit in self.queue:
+            if outfit.get(slot) == item_id:
+                if pool:
+                    outfit[slot] = self._draw(slot)
+                else:
+                    del outfit[slot]
+
+
+class UserDecks:
+    def __init__(self, version: int):
+        self.version = version                      # users.items_version the decks reflect
+        self.items: Dict[str, dict] = {}            # serialized items referenced by any deck
+        self.decks: "OrderedDict[FilterKey, Deck]" = OrderedDict()
+        self.rebuilding = False                     # a background _rebuild is queued
+
+
+_users: "OrderedDict[str, UserDecks]" = OrderedDict()
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _refill(deck: Deck):
+    with _lock:
+        deck.deal(max(0, OUTFIT_DECK_SIZE - len(deck.queue)))
+        deck.refilling = False
+
+
+def _build(db: Session, user_id: str, key: FilterKey) -> List[Item]:
+    formality, season, color = key
+    query = db.query(Item).filter(Item.user_id == user_id)
+    # Filter values are normalized and encoded by the column type, so these
+    # are exact matches on indexed vocabulary codes
+    if formality:
+        query = query.filter(Item.formality == formality)
+    if color:
+        query = query.filter(Item.color_primary == color)
+    return query.all()
+
+
+def _fill(state: UserDecks, key: FilterKey, rows: List[Item]) -> Deck:
+    """Deal a new deck for key from freshly read rows and file it under state (call with _lock held)"""
+    deck = Deck()
+    for row in rows:
+        item = outfit_item(row)
+        if _matches(item, key):
+            state.items[row.id] = item
+            deck.add(row.id, item["slot"])
+    deck.deal(OUTFIT_DECK_SIZE)
+    state.decks[key] = deck
+    while len(state.decks) > OUTFIT_DECK_MAX_KEYS:
+        state.decks.popitem(last=False)
+    return deck
+
+
+def _install(user_id: str, state: UserDecks):
+    _users[user_id] = state
+    _users.move_to_end(user_id)
+    while len(_users) > OUTFIT_DECK_MAX_USERS:
+        _users.popitem(last=False)
+
+
+def _rebuild(user_id: str):
+    """Re-read every cached deck of a user whose closet changed in another worker"""
+    db = SessionLocal()
+    try:
+        for _ in range(3):
+            with _lock:
+                state = _users.get(user_id)
+                if state is None:
+                    return
+                seen, keys = state.version, list(state.decks)
+            # One read transaction: the version and the rows come from the same snapshot
+            version = db.query(User.items_version).filter(User.id == user_id).scalar() or 0
+            rows = {key: _build(db, user_id, key) for key in keys}
+            db.rollback()
+            with _lock:
+                state = _users.get(user_id)
+                if state is None:
+                    return
+                if state.version != seen:
+                    continue  # Patched while we were reading; the rows may predate the patch
+                fresh = UserDecks(max(version, state.version))
+                for key in keys:
+                    _fill(fresh, key, rows[key])
+                _install(user_id, fresh)
+                return
+    except Exception as e:
+        print(f"Outfit deck rebuild failed for {user_id}: {e}")
+    finally:
+        with _lock:
+            state = _users.get(user_id)
+            if state is not None:
+                state.rebuilding = False
+        db.close()
+
+
+def _submit(task: Callable, *args):
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outfit-decks")
+    _executor.submit(task, *args)
+
+
+def _pop(user_id: str, state: UserDecks, key: FilterKey, deck: Deck):
+    """Pop the next outfit (call with _lock held); None when no items match"""
+    state.decks.move_to_end(key)
+    _users.move_to_end(user_id)
+    if not deck.pools:
+        return None, False
+    if not deck.queue:
+        deck.deal(1)
+    outfit = {slot: state.items[item_id] for slot, item_id in deck.queue.popleft().items()}
+    counts = {slot: len(pool) for slot, pool in deck.pools.items()}
+    refill = len(deck.queue) < OUTFIT_DECK_SIZE // 4 and not deck.refilling
+    if refill:
+        deck.refilling = True
+    return (outfit, counts, len(deck.members)), refill
+
+
+def draw(db: Session, user: User, key: FilterKey) -> Optional[Tuple[Dict[str, dict], Dict[str, int], int]]:
+    """Next outfit for these filters as (outfit, items per slot, total matching items).
+
+    None when no items match. A deck left behind by another worker's change
+    keeps serving while it is rebuilt in the background, as long as the items
+    it deals still exist; only a missing deck is built on the request path.
+    """
+    version = caches.items_version(user)
+    with _lock:
+        state = _users.get(user.id)
+        deck = state.decks.get(key) if state is not None else None
+        stale = rebuild = refill = False
+        if deck is not None:
+            stale = not caches.is_current(state, user)
+            rebuild = stale and not state.rebuilding
+            if rebuild:
+                state.rebuilding = True
+            drawn, refill = _pop(user.id, state, key, deck)
+    if rebuild:
+        _submit(_rebuild, user.id)
+    if refill:
+        _submit(_refill, deck)
+
+    if deck is not None:
+        if not stale:
+            return drawn
+        if drawn is not None:
+            ids = [item["id"] for item in drawn[0].values()]
+            if db.query(Item.id).filter(Item.id.in_(ids)).count() == len(ids):
+                return drawn
+        # The stale deck dealt an item deleted elsewhere, or had no items though
+        # some may have been added since: build this one now
+
+    attempts = 0
+    while True:
+        with _lock:
+            state = _users.get(user.id)
+            seen = state.version if state is not None else None
+        rows = _build(db, user.id, key)
+        attempts += 1
+        with _lock:
+            state = _users.get(user.id)
+            if state is not None and state.version != seen and attempts < 3:
+                continue  # Patched while we were reading; the rows may predate the patch
+            if state is None or state.version < version:
+                state = UserDecks(version)
+                _install(user.id, state)
+            deck = _fill(state, key, rows)
+            drawn, refill = _pop(user.id, state, key, deck)
+        if refill:
+            _submit(_refill, deck)
+        return drawn
+
+
+def add_items(user_id: str, items: Iterable[Item]):
+    """Patch the user's loaded decks with newly committed items"""
+    items = list(items)
+    with caches.patch(_users, user_id, _lock, items) as state:
+        if state is None:
+            return
+        for row in items:
+            item = outfit_item(row)
+            for key, deck in state.decks.items():
+                if _matches(item, key):
+                    state.items[row.id] = item
+                    deck.add(row.id, item["slot"])
+
+
+def update_items(user_id: str, items: Iterable[Item]):
+    """Re-file items whose tags changed (e.g. re-tagged) in the user's loaded decks"""
+    items = list(items)
+    with caches.patch(_users, user_id, _lock, items) as state:
+        if state is None:
+            return
+        for row in items:
+            item = outfit_item(row)
+            state.items.pop(row.id, None)
+            for key, deck in state.decks.items():
+                deck.remove(row.id)
+                if _matches(item, key):
+                    state.items[row.id] = item
+                    deck.add(row.id, item["slot"])
+
+
+def remove_items(user_id: str, item_ids: Iterable[str]):
+    """Take deleted items out of the user's loaded decks"""
+    item_ids = list(item_ids)
+    with caches.patch(_users, user_id, _lock, item_ids) as state:
+        if state is None:
+            return
+        for item_id in item_ids:
+            for deck in state.decks.values():
+                deck.remove(item_id)
+            state.items.pop(item_id, None)
@@ -0,0 +1,133 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+from sqlalchemy.orm import Session
+
+from . import caches
+from .models import Item, User
+
+# Perceptual-hash duplicate detection.
+# Each item gets a 64-bit difference hash (dHash) at upload time. Per-user
+# multi-index hash tables split the hash into 8 byte-wide bands: any two hashes
+# within Hamming distance 7 share at least one identical band (pigeonhole), so
+# a lookup only compares against the few items in 8 buckets instead of the
+# whole closet.
+#
+# Indexes are per process and follow users.items_version (see caches.py): one
+# that is behind is rebuilt from the database before it is used.
+
+HASH_BITS = 64
+BANDS = 8
+BAND_BITS = HASH_BITS // BANDS
+MAX_SEARCH_DISTANCE = BANDS - 1
+
+
+def dhash(im: Image.Image) -> str:
+    """64-bit difference hash of an image as a 16-char hex string"""
+    small = im.convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+class HashIndex:
+    """Multi-index hash table for Hamming-distance lookups over 64-bit hashes"""
+
+    def __init__(self):
+        self.hashes: Dict[str, int] = {}
+        self.bands: List[Dict[int, Set[str]]] = [{} for _ in range(BANDS)]
+        self.version = 0   # users.items_version this index reflects
+
+    def _band_keys(self, value: int):
+        mask = (1 << BAND_BITS) - 1
+        for band in range(BANDS):
+            yield band, (value >> (band * BAND_BITS)) & mask
+
+    def add(self, item_id: str, value: int):
+        self.remove(item_id)
+        self.hashes[item_id] = value
+        for band, key in self._band_keys(value):
+            self.bands[band].setdefault(key, set()).add(item_id)
+
+    def remove(self, item_id: str):
+        value = self.hashes.pop(item_id, None)
+        if value is None:
+            return
+        for band, key in self._band_keys(value):
+            bucket = self.bands[band].get(key)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del self.bands[band][key]
+
+    def query(self, value: int, max_distance: int) -> List[Tuple[str, int]]:
+        """Items within max_distance bits of value, closest first"""
+        max_distance = min(max_distance, MAX_SEARCH_DISTANCE)
+        candidates: Set[str] = set()
+        for band, key in self._band_keys(value):
+            candidates |= self.bands[band].get(key, set())
+
+        matches = []
+        for item_id in candidates:
+            distance = (self.hashes[item_id] ^ value).bit_count()
+            if distance <= max_distance:
+                matches.append((item_id, distance))
+        return sorted(matches, key=lambda m: m[1])
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+# Per-user indexes, loaded lazily from the database on first use
+_indexes: Dict[str, HashIndex] = {}
+_lock = threading.Lock()
+
+
+def _get_index(db: Session, user: User) -> HashIndex:
+    with _lock:
+        index = _indexes.get(user.id)
+        if not caches.is_current(index, user):
+            index = HashIndex()
+            index.version = caches.items_version(user)
+            rows = db.query(Item.id, Item.phash).filter(
+                Item.user_id == user.id, Item.phash.isnot(None)
+            )
+            for item_id, phash in rows:
+                index.add(item_id, int(phash, 16))
+            _indexes[user.id] = index
+        return index
+
+
+def find_duplicate(db: Session, user: User, phash: str, max_distance: int) -> Optional[Tuple[str, int]]:
+    """Closest existing item of this user whose hash is within max_distance, if any"""
+    index = _get_index(db, user)
+    with _lock:
+        matches = index.query(int(phash, 16), max_distance)
+    return matches[0] if matches else None
+
+
+def register(user_id: str, items: Iterable[Tuple[str, Optional[str]]]):
+    """Add newly committed (item id, phash) pairs to an already-loaded index.
+
+    Pass every new item, even one without a hash (a garment cut from an
+    outfit photo): the call stands for the items_version bump.
+    """
+    items = list(items)
+    with caches.patch(_indexes, user_id, _lock, items) as index:
+        if index is None:
+            return
+        for item_id, phash in items:
+            if phash:
+                index.add(item_id, int(phash, 16))
+
+
+def unregister(user_id: str, item_ids: Iterable[str]):
+    """Drop deleted items from an already-loaded index"""
+    item_ids = list(item_ids)
+    with caches.patch(_indexes, user_id, _lock, item_ids) as index:
+        if index is None:
+            return
+        for item_id in item_ids:
+            index.remove(item_id)
@@ -0,0 +1,56 @@
+from typing import Iterable, Optional
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+# Conditional GETs for closet listings.
+# users.closet_version is bumped, in the same transaction, by every change to
+# a user's items or outfits. GET /items and GET /outfits send it as their
+# ETag, so a client repeating a request with If-None-Match gets an empty 304
+# after nothing more than the user lookup authentication already does.
+# Item changes also bump users.items_version, which the per-process closet
+# caches follow (caches.py); outfit changes pass items=False.
+
+CACHE_CONTROL = "private, no-cache"   # Browsers may keep it, but must revalidate
+
+
+def bump(db: Session, user_id: str, items: bool = True):
+    """Mark the user's closet as changed (part of the caller's transaction)"""
+    bump_many(db, [user_id], items)
+
+
+def bump_many(db: Session, user_ids: Iterable[str], items: bool = True):
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    # Rows from before the columns existed hold NULL
+    columns = ("closet_version", "items_version") if items else ("closet_version",)
+    assignments = ", ".join(f"{column} = COALESCE({column}, 0) + 1" for column in columns)
+    db.execute(
+        text(f"UPDATE users SET {assignments} WHERE id IN :ids")
+        .bindparams(bindparam("ids", expanding=True)),
+        {"ids": user_ids},
+    )
+
+
+def closet_etag(user) -> str:
+    # The user id keeps a cached list from one account from validating for another
+    return f'"{user.id}.{user.closet_version or 0}"'
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header lists etag (weak comparison, as for GET)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def json_response(content, etag: str) -> JSONResponse:
+    return JSONResponse(content, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
@@ -0,0 +1,118 @@
+import os
+from typing import BinaryIO
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from PIL import Image, UnidentifiedImageError
+
+try:  # Optional HEIC/HEIF (iPhone photo) support
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+# Guards for uploaded images, so oversized or hostile uploads are turned away
+# before they cost memory or CPU:
+#   - UploadLimitMiddleware caps request bodies while they are received: a
+#     Content-Length over the cap is refused before reading anything, and a
+#     body that streams past it is cut off with 413.
+#   - probe() reads only the image header to identify the format and check
+#     the pixel count, so a decompression bomb (tiny file, huge dimensions) is
+#     refused without being decoded. Any format Pillow can open is accepted
+#     (JPEG, PNG, WebP, AVIF, GIF, BMP, TIFF, ...; HEIC when pillow-heif is
+#     installed); the stored copy is always a JPEG.
+#   - load_image() decodes JPEGs at reduced scale (draft mode lets the
+#     decoder skip detail at 1/2, 1/4 or 1/8 size), since uploads are
+#     shrunk to 1024px anyway.
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMPORT_BYTES = int(os.getenv("MAX_IMPORT_BYTES", str(1024 * 1024 * 1024)))  # closet archives
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+BODY_LIMITS = {"/import": MAX_IMPORT_BYTES}
+
+
+def readable_size(size: int) -> str:
+    """Byte count for error messages: KB under a megabyte, else MB to one decimal"""
+    if size < 1024 * 1024:
+        return f"{max(1, round(size / 1024))} KB"
+    return f"{size / (1024 * 1024):.1f}".removesuffix(".0") + " MB"
+
+
+class BodyTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"Upload is larger than {readable_size(limit)}")
+
+
+def body_limit(path: str) -> int:
+    return BODY_LIMITS.get(path, MAX_UPLOAD_BYTES)
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware answering 413 as soon as a request body passes its cap"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+
+        limit = body_limit(scope["path"])
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            return await _too_large(limit)(scope, receive, send)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise BodyTooLarge(limit)  # FastAPI's body parsing passes HTTPExceptions on
+            return message
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, send_wrapper)
+        except BodyTooLarge:
+            if started:
+                raise
+            await _too_large(limit)(scope, receive, send)
+
+
+def _too_large(limit: int) -> JSONResponse:
+    error = BodyTooLarge(limit)
+    return JSONResponse({"detail": error.detail}, status_code=error.status_code)
+
+
+def probe(fileobj: BinaryIO) -> Image.Image:
+    """Open an upload lazily (header only) and check its size; raises 415 if Pillow cannot identify it, 413"""
+    try:
+        im = Image.open(fileobj)
+    except UnidentifiedImageError:
+        raise HTTPException(415, "Unsupported or unreadable image file")
+    except Image.DecompressionBombError:
+        raise HTTPException(413, "Image dimensions are too large")
+    width, height = im.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise HTTPException(413, f"Image is {width}x{height}; at most {MAX_IMAGE_PIXELS // 1_000_000} megapixels are accepted")
+    return im
+
+
+def load_image(fileobj: BinaryIO, max_side: int = 1024) -> Image.Image:
+    """Probe, then decode an upload as RGB at no less than max_side (JPEGs decode at reduced scale)"""
+    im = probe(fileobj)
+    if im.format in ("JPEG", "MPO"):  # MPO is how Pillow reports many phone JPEGs
+        im.draft("RGB", (max_side, max_side))
+    try:
+        return im.convert("RGB")
+    except OSError as e:  # Truncated or corrupt image data
+        raise HTTPException(400, f"Could not decode image: {e}")
@@ -0,0 +1,248 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Tuple
+
+# Minimal Prometheus-style metrics (text exposition format, no extra dependency).
+# Everything is off unless METRICS_ENABLED=true; when off, the helpers below
+# return a shared no-op context manager and record nothing.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+_NOOP = nullcontext()
+_INF = 'le="+Inf"'
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                base = _format_labels(self.labelnames, labels)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_join(base, le)} {cumulative}")
+                lines.append(f"{self.name}_bucket{_join(base, _INF)} {count}")
+                lines.append(f"{self.name}_sum{_join(base)} {total}")
+                lines.append(f"{self.name}_count{_join(base)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...]):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_join(_format_labels(self.labelnames, labels))} {value}")
+        return lines
+
+
+def _format_labels(names, values) -> str:
+    return ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+
+
+def _join(*parts) -> str:
+    parts = [p for p in parts if p]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+_registry: list = []
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route",
+                            ("method", "route", "status"))
+REQUEST_DB_QUERIES = Histogram("http_request_db_queries", "SQL statements executed per request",
+                               ("method", "route"), COUNT_BUCKETS)
+STAGE_LATENCY = Histogram("upload_stage_duration_seconds", "Time spent in each stage of an upload",
+                          ("endpoint", "stage"))
+VISION_LATENCY = Histogram("vision_call_duration_seconds", "Vision API call latency",
+                           ("function", "model", "outcome"))
+VISION_TOKENS = Counter("vision_tokens_total", "Vision API token usage", ("function", "model", "kind"))
+WEATHER_LATENCY = Histogram("weather_upstream_duration_seconds", "Weather API latency", ("outcome",))
+VISION_QUEUE_WAIT = Histogram("vision_queue_wait_seconds", "Time vision calls waited for a scheduler slot",
+                              ("priority",))
+VISION_REJECTED = Counter("vision_rejected_total", "Vision calls turned away by the scheduler",
+                          ("priority", "reason"))
+
+# Per-request state, shared with threadpool workers through context copying
+_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_endpoint", default="none")
+_query_count: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("metrics_query_count", default=None)
+
+
+@contextmanager
+def _timed(histogram: Histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+
+
+def set_endpoint(endpoint: str):
+    """Attribute stage() timings in the current request (including vision helpers) to an endpoint"""
+    if METRICS_ENABLED:
+        _endpoint.set(endpoint)
+
+
+def stage(name: str):
+    """Time one stage (decode, save, encode, vision, commit, ...) of the current upload"""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _timed(STAGE_LATENCY, _endpoint.get(), name)
+
+
+def vision_call(function: str, model: str):
+    """Time a vision API call; call .record(response) to count tokens and mark it successful"""
+    return _VisionCall(function, model) if METRICS_ENABLED else _NOOP_CALL
+
+
+def vision_queue_wait(priority: str, seconds: float):
+    if METRICS_ENABLED:
+        VISION_QUEUE_WAIT.observe(seconds, priority)
+
+
+def vision_rejected(priority: str, reason: str):
+    if METRICS_ENABLED:
+        VISION_REJECTED.inc(1, priority, reason)
+
+
+def weather_call():
+    """Time an upstream weather request; set .outcome on failure"""
+    return _Call(WEATHER_LATENCY) if METRICS_ENABLED else _NOOP_CALL
+
+
+class _Call:
+    """Times a block and records it with an outcome label (ok unless told otherwise)"""
+
+    def __init__(self, histogram: Histogram, *labels):
+        self.histogram, self.labels, self.outcome = histogram, labels, "ok"
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.outcome = "error"
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels, self.outcome)
+
+    def record(self, response):
+        pass
+
+
+class _VisionCall(_Call):
+    def __init__(self, function: str, model: str):
+        super().__init__(VISION_LATENCY, function, model)
+
+    def record(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            function, model = self.labels
+            VISION_TOKENS.inc(usage.prompt_tokens or 0, function, model, "prompt")
+            VISION_TOKENS.inc(usage.completion_tokens or 0, function, model, "completion")
+
+
+class _NoopCall:
+    outcome = "ok"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def __setattr__(self, name, value):
+        pass  # Shared instance: ignore .outcome updates
+
+    def record(self, response):
+        pass
+
+
+_NOOP_CALL = _NoopCall()
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and SQL statement counts"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        queries = [0]
+        token = _query_count.set(queries)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _query_count.reset(token)
+            route = scope.get("route")
+            # Use the route template so /items/{item_id} is one series, not one per id
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.observe(time.perf_counter() - start, scope["method"], path, status[0])
+            REQUEST_DB_QUERIES.observe(queries[0], scope["method"], path)
+
+
+def install(app, engine):
+    """Add the middleware and SQL listener when metrics are enabled"""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+    event.listen(engine, "before_cursor_execute", _count_query)
+    app.add_middleware(MetricsMiddleware)
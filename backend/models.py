@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, Integer, Float, DateTime, ForeignKey, LargeBinary, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .db import Base
+from .vocab import VocabCode
 
 class User(Base):
     __tablename__ = "users"
@@ -12,6 +13,8 @@ class User(Base):
     username = Column(String, unique=True, nullable=False)
     password_hash = Column(String, nullable=False)
     profile_photo_url = Column(String, nullable=True)
+    closet_version = Column(Integer, nullable=False, default=0, server_default="0")  # Bumped on item/outfit changes (etags.py)
+    items_version = Column(Integer, nullable=False, default=0, server_default="0")   # Bumped on item changes only (caches.py)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Item(Base):
@@ -20,20 +23,52 @@ class Item(Base):
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
     image_url = Column(String, nullable=False)
 
-    slot = Column(String, nullable=False)
+    # Vocabulary-backed tags are stored as small integer codes (see vocab.py)
+    slot = Column(VocabCode("slot"), nullable=False)
     type = Column(String, nullable=False)
-    color_primary = Column(String, nullable=False)
+    color_primary = Column(VocabCode("color"), nullable=False)
     colors_secondary = Column(Text, nullable=False)       # JSON string
-    pattern = Column(String, nullable=False)
-    material = Column(String, nullable=False)
-    fit = Column(String, nullable=False)
-    formality = Column(String, nullable=False)
+    pattern = Column(VocabCode("pattern"), nullable=False)
+    material = Column(VocabCode("material"), nullable=False)
+    fit = Column(VocabCode("fit"), nullable=False)
+    formality = Column(VocabCode("formality"), nullable=False)
     season = Column(Text, nullable=False)                 # JSON string
     features = Column(Text, nullable=False)               # JSON string
     brand_or_logo_visible = Column(Integer, nullable=False)  # 0/1
     notes = Column(Text, nullable=False, default="")
+    phash = Column(String(16), nullable=True)             # 64-bit dHash, hex
+    color_hist = Column(LargeBinary, nullable=True)       # float32 shares per palette color
+    prompt_version = Column(Integer, nullable=True)       # vision.PROMPT_VERSION that tagged it (NULL: before versioning)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_items_user_slot", "user_id", "slot"),
+        Index("ix_items_user_color", "user_id", "color_primary"),
+        Index("ix_items_user_formality", "user_id", "formality"),
+    )
+
+class VocabTerm(Base):
+    """Lookup table of vocabulary codes, for SQL (triggers, ad-hoc queries) that needs labels"""
+    __tablename__ = "vocab_terms"
+    kind = Column(String, primary_key=True)
+    code = Column(Integer, primary_key=True)
+    label = Column(String, nullable=False)
+
+class Blob(Base):
+    """Reference-counted image file in content-addressed storage (see storage.py)"""
+    __tablename__ = "blobs"
+    key = Column(String(64), primary_key=True)            # sha256 hex of the file
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Lease(Base):
+    """Named lease held by one process at a time, e.g. the background collector (see collector.py)"""
+    __tablename__ = "leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)               # host:pid:nonce of the holding process
+    expires_at = Column(Float, nullable=False)            # Unix time; anyone may take it over after this
+
 class Outfit(Base):
     __tablename__ = "outfits"
     id = Column(String, primary_key=True)                 # UUID str
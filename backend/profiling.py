@@ -0,0 +1,199 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from collections import Counter
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+# On-demand profiling of single requests.
+# With PROFILING_ENABLED=true and a PROFILING_TOKEN, a request carrying
+# "X-Profile: <token>" (or ?profile=<token>) is sampled: a background thread
+# snapshots the stacks of the threads working on that request every
+# PROFILE_INTERVAL_MS and the SQL statements it runs are timed. The result is
+# written to PROFILE_DIR as a folded-stack file (flamegraph.pl / speedscope)
+# plus a JSON summary, and its id is returned in the X-Profile-Id header.
+# When disabled nothing is installed, so normal requests pay nothing.
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+MAX_SQL_STATEMENTS = 1000
+MAX_STACK_DEPTH = 128
+
+_session: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar("profile_session", default=None)
+# Worker thread -> session it last ran SQL for (threadpool threads are shared between requests)
+_thread_owner: Dict[int, "ProfileSession"] = {}
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _frame_label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class ProfileSession:
+    def __init__(self, method: str, path: str, task: asyncio.Task):
+        self.id = uuid.uuid4().hex
+        self.method, self.path = method, path
+        self.loop_thread = threading.get_ident()
+        self.loop = asyncio.get_running_loop()
+        self.task = task            # The request's task, recorded by the middleware
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.sql = []
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id[:8]}", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self._stop.set()
+        self._sampler.join()
+        for ident in [i for i, owner in _thread_owner.items() if owner is self]:
+            _thread_owner.pop(ident, None)
+
+    def _owns_loop(self) -> bool:
+        # Other requests' tasks run on the same loop thread; only count samples
+        # taken while this request's task is the one the loop is stepping
+        return asyncio.current_task(self.loop) is self.task
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            frames = sys._current_frames()
+            threads = [i for i, owner in list(_thread_owner.items()) if owner is self]
+            if self._owns_loop():
+                threads.append(self.loop_thread)
+            for ident in threads:
+                frame = frames.get(ident)
+                stack, in_backend = [], False
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_label(frame.f_code))
+                    in_backend = in_backend or frame.f_code.co_filename.startswith(BACKEND_DIR)
+                    frame = frame.f_back
+                if ident == self.loop_thread:
+                    self.stacks[";".join(["loop"] + stack[::-1])] += 1
+                elif in_backend:
+                    # Pooled workers idle between tasks; only count them while running our code
+                    self.stacks[";".join(["worker"] + stack[::-1])] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, status: int) -> dict:
+        return {
+            "id": self.id, "method": self.method, "path": self.path, "status": status,
+            "duration_ms": round(self.duration * 1000, 3),
+            "interval_ms": PROFILE_INTERVAL_MS, "samples": self.samples,
+            "sql_count": len(self.sql),
+            "sql_total_ms": round(sum(q["duration_ms"] for q in self.sql), 3),
+            "sql": self.sql,
+        }
+
+    def save(self, status: int):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{self.id}.folded"), "w") as f:
+            f.write(self.folded())
+        with open(os.path.join(PROFILE_DIR, f"{self.id}.json"), "w") as f:
+            json.dump(self.summary(status), f, indent=2)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    session = _session.get()
+    ident = threading.get_ident()
+    if session is None:
+        _thread_owner.pop(ident, None)
+        return
+    if ident != session.loop_thread:
+        _thread_owner[ident] = session
+    conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    session = _session.get()
+    if session is None or not conn.info.get("profile_query_start"):
+        return
+    elapsed = time.perf_counter() - conn.info["profile_query_start"].pop()
+    if len(session.sql) < MAX_SQL_STATEMENTS:
+        session.sql.append({
+            "statement": " ".join(statement.split()),
+            "duration_ms": round(elapsed * 1000, 3),
+            "offset_ms": round((time.perf_counter() - session.started - elapsed) * 1000, 3),
+            "executemany": executemany,
+        })
+
+
+def authorized(token: Optional[str]) -> bool:
+    return bool(token) and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def _requested_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile":
+            return value.decode("latin-1")
+    if b"profile=" in scope.get("query_string", b""):
+        return parse_qs(scope["query_string"].decode("latin-1")).get("profile", [None])[0]
+    return None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that carry a valid profiling token"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not authorized(_requested_token(scope)):
+            return await self.app(scope, receive, send)
+
+        session = ProfileSession(scope["method"], scope["path"], asyncio.current_task())
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", session.id.encode())]
+            await send(message)
+
+        token = _session.set(session)
+        session.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _session.reset(token)
+            session.stop()
+            try:
+                session.save(status[0])
+            except OSError as e:
+                print(f"Could not save profile {session.id}: {e}")
+
+
+def profile_path(profile_id: str, kind: str) -> Optional[str]:
+    """Path of a saved profile artifact (kind is 'folded' or 'json'), or None"""
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{kind}")
+    return path if os.path.exists(path) else None
+
+
+def install(app, engine):
+    """Add the middleware and SQL timing hooks when profiling is enabled"""
+    if not PROFILING_ENABLED:
+        return
+    if not PROFILING_TOKEN:
+        print("PROFILING_ENABLED is set but PROFILING_TOKEN is empty; profiling stays off")
+        return
+    from sqlalchemy import event
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.add_middleware(ProfilingMiddleware)
@@ -0,0 +1,404 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from . import metrics
+
+# Scheduler for outgoing vision API calls.
+# Every call to the vision model (tag_item, separate_clothing_items,
+# tag_item_with_context) waits here for a slot. A slot is granted when:
+#   - the provider's limits allow it: global token buckets refilled at
+#     VISION_RPM requests and VISION_TPM tokens per minute (0 = no limit),
+#     and fewer than VISION_MAX_CONCURRENCY calls are in flight
+#   - it is the call's turn: waiting calls are ordered by weighted fair
+#     queuing (self-clocked virtual finish times) over (user, priority) flows,
+#     so one user's 50-photo upload can't hold everyone else back, and
+#     interactive uploads weigh PRIORITY_WEIGHTS more than batch work
+# Token costs are estimated before the call (prompt, image and max_tokens, as
+# the provider counts them) and corrected with the usage the reply reports.
+# A call that would wait longer than VISION_MAX_WAIT_SECONDS, or that finds the
+# queue full, raises VisionBusy: a 429 with Retry-After and its queue position.
+# Limits are per process; with several workers divide the account's limits
+# between them.
+#
+# Request handlers wait for their turn on the event loop (admitted()) and only
+# then hand the vision call to a worker thread, which uses the ticket already
+# held. Queued uploads therefore hold no threadpool thread: at most
+# VISION_MAX_CONCURRENCY threads are busy with vision calls, however long the
+# queue (VISION_QUEUE_LIMIT), and sync endpoints keep the rest of the pool.
+# Scripts without an event loop (retag.py) wait in acquire() on their thread.
+
+VISION_RPM = int(os.getenv("VISION_RPM", "500"))
+VISION_TPM = int(os.getenv("VISION_TPM", "30000"))
+VISION_MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "16"))
+VISION_QUEUE_LIMIT = int(os.getenv("VISION_QUEUE_LIMIT", "200"))            # waiting calls, all users
+VISION_USER_QUEUE_LIMIT = int(os.getenv("VISION_USER_QUEUE_LIMIT", "50"))   # waiting calls, one user
+VISION_MAX_WAIT_SECONDS = float(os.getenv("VISION_MAX_WAIT_SECONDS", "30"))
+VISION_IMAGE_TOKENS = int(os.getenv("VISION_IMAGE_TOKENS", "800"))          # estimate for one 1024px image
+RATE_LIMIT_BACKOFF_SECONDS = 5.0   # Pause after a provider 429 that names no Retry-After
+PRIORITY_WEIGHTS = {"interactive": 8, "batch": 1}
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Who the current request or job is calling on behalf of: (user id, priority)
+_principal: contextvars.ContextVar[Tuple[Optional[str], str]] = contextvars.ContextVar(
+    "vision_principal", default=(None, BATCH))
+# Slot admitted on the event loop for the next vision call made in this context
+_admitted: contextvars.ContextVar[Optional["Ticket"]] = contextvars.ContextVar("vision_admitted", default=None)
+
+
+class VisionBusy(HTTPException):
+    """Raised instead of queueing a vision call the scheduler can't serve in time"""
+
+    def __init__(self, retry_after: float, position: int, reason: str):
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.position = position
+        self.reason = reason
+        super().__init__(status_code=429, headers={"Retry-After": str(self.retry_after)}, detail={
+            "message": "Image analysis is busy right now. Please try again shortly.",
+            "retry_after": self.retry_after,
+            "queue_position": position,
+        })
+
+
+class Ticket:
+    __slots__ = ("flow", "weight", "tokens", "used", "usage", "finish", "seq", "priority", "claimed")
+
+    def __init__(self, flow: Tuple[Optional[str], str], tokens: int):
+        self.flow, self.priority = flow, flow[1]
+        self.weight = PRIORITY_WEIGHTS.get(self.priority, 1)
+        self.tokens = self.used = tokens
+        self.usage = None   # (prompt, completion) tokens the reply reported
+        self.claimed = False  # an admitted() ticket was taken by slot()
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+    def record(self, response):
+        """Charge the tokens the reply says were used instead of the estimate"""
+        usage = getattr(response, "usage", None)
+        total = getattr(usage, "total_tokens", None) if usage is not None else None
+        if total:
+            self.used = total
+            self.usage = (usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+_cond = threading.Condition()
+_async_waiters: Dict[asyncio.Event, asyncio.AbstractEventLoop] = {}   # admit() calls waiting on a loop
+_queue: List[Ticket] = []                # waiting tickets, a heap ordered by finish tag
+_queued: Dict[Optional[str], int] = {}   # user id -> waiting tickets
+_last_finish: Dict[Tuple[Optional[str], str], float] = {}
+_virtual_time = 0.0
+_seq = itertools.count()
+_in_flight = 0
+_requests = float(VISION_RPM)
+_tokens = float(VISION_TPM)
+_refilled_at = time.monotonic()
+_paused_until = 0.0
+_avg_tokens = float(VISION_IMAGE_TOKENS + 1000)
+_avg_latency = 2.0
+_totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def set_principal(user_id: Optional[str], priority: str = INTERACTIVE):
+    """Attribute vision calls made from here on (this request or job) to a user and priority"""
+    _principal.set((user_id, priority))
+
+
+def set_limits(rpm: int, tpm: int):
+    """Replace the provider limits for this process, e.g. a script's share of the account's"""
+    global VISION_RPM, VISION_TPM, _requests, _tokens
+    with _cond:
+        VISION_RPM, VISION_TPM = rpm, tpm
+        _requests = min(_requests, float(rpm))
+        _tokens = min(_tokens, float(tpm))
+        _wake()
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Rough token cost of one call: ~4 characters per prompt token, the image, and max_tokens"""
+    return len(prompt) // 4 + VISION_IMAGE_TOKENS + max_tokens
+
+
+def _refill(now: float):
+    global _requests, _tokens, _refilled_at
+    elapsed = now - _refilled_at
+    _refilled_at = now
+    if VISION_RPM:
+        _requests = min(float(VISION_RPM), _requests + elapsed * VISION_RPM / 60)
+    if VISION_TPM:
+        _tokens = min(float(VISION_TPM), _tokens + elapsed * VISION_TPM / 60)
+
+
+def _ready_in(ticket: Ticket, now: float) -> Optional[float]:
+    """Seconds until the limits admit this ticket (0 = now, None = when a call finishes)"""
+    if _in_flight >= VISION_MAX_CONCURRENCY:
+        return None
+    _refill(now)
+    wait = max(0.0, _paused_until - now)
+    if VISION_RPM and _requests < 1:
+        wait = max(wait, (1 - _requests) * 60 / VISION_RPM)
+    if VISION_TPM and _tokens < ticket.tokens:
+        wait = max(wait, (ticket.tokens - _tokens) * 60 / VISION_TPM)
+    return wait
+
+
+def _seconds_per_call() -> float:
+    """Recent throughput, for Retry-After hints"""
+    interval = _avg_latency / max(1, VISION_MAX_CONCURRENCY)
+    if VISION_RPM:
+        interval = max(interval, 60 / VISION_RPM)
+    if VISION_TPM:
+        interval = max(interval, _avg_tokens * 60 / VISION_TPM)
+    return interval
+
+
+def _predicted_wait(position: int) -> float:
+    """Rough wait for the call at this queue position, for rejecting early and Retry-After hints"""
+    now = time.monotonic()
+    _refill(now)
+    free = VISION_MAX_CONCURRENCY - _in_flight
+    if VISION_RPM:
+        free = min(free, int(_requests))
+    if VISION_TPM:
+        free = min(free, int(_tokens // _avg_tokens))
+    return max(0.0, _paused_until - now) + max(0, position - max(0, free)) * _seconds_per_call()
+
+
+def _position(ticket: Ticket) -> int:
+    return 1 + sum(1 for other in _queue if other is not ticket and other < ticket)
+
+
+def _reject(ticket: Ticket, position: int, reason: str):
+    metrics.vision_rejected(ticket.priority, reason)
+    raise VisionBusy(_predicted_wait(position), position, reason)
+
+
+def _dequeue(ticket: Ticket):
+    _queue.remove(ticket)
+    heapq.heapify(_queue)
+    user_id = ticket.flow[0]
+    _queued[user_id] -= 1
+    if not _queued[user_id]:
+        del _queued[user_id]
+
+
+def _wake():
+    """Tell every waiting caller, thread or coroutine, that the queue or the limits changed"""
+    _cond.notify_all()
+    for event, loop in list(_async_waiters.items()):
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            _async_waiters.pop(event, None)  # Loop closed
+
+
+def _new_ticket(tokens: int) -> Ticket:
+    return Ticket(_principal.get(), min(tokens, VISION_TPM) if VISION_TPM else tokens)
+
+
+def _enqueue(ticket: Ticket):
+    """Give a ticket its place in the fair queue, or reject it (call with _cond held)"""
+    user_id = ticket.flow[0]
+    ticket.finish = max(_virtual_time, _last_finish.get(ticket.flow, 0.0)) + ticket.tokens / ticket.weight
+    ticket.seq = next(_seq)
+    position = _position(ticket)
+    if len(_queue) >= VISION_QUEUE_LIMIT or _queued.get(user_id, 0) >= VISION_USER_QUEUE_LIMIT:
+        _reject(ticket, position, "queue_full")
+    if _predicted_wait(position) > VISION_MAX_WAIT_SECONDS:
+        _reject(ticket, position, "backlog")
+
+    _last_finish[ticket.flow] = ticket.finish
+    heapq.heappush(_queue, ticket)
+    _queued[user_id] = _queued.get(user_id, 0) + 1
+
+
+def _try_admit(ticket: Ticket, deadline: float) -> Optional[float]:
+    """Admit the ticket if it is its turn and the limits allow (returns None); else the
+    seconds to wait before trying again. Raises VisionBusy past the deadline. Call with _cond held.
+    """
+    global _virtual_time, _in_flight, _requests, _tokens
+    now = time.monotonic()
+    wait = _ready_in(ticket, now) if _queue[0] is ticket else None
+    if wait != 0:
+        if now >= deadline:
+            _reject(ticket, _position(ticket), "timeout")
+        return deadline - now if wait is None else min(wait, deadline - now)
+
+    _dequeue(ticket)
+    _virtual_time = ticket.finish
+    _in_flight += 1
+    _requests -= 1
+    _tokens -= ticket.tokens
+    if len(_last_finish) > 1000:
+        for flow in [flow for flow, finish in _last_finish.items() if finish <= _virtual_time]:
+            del _last_finish[flow]
+    _wake()
+    return None
+
+
+def _abandon(ticket: Ticket):
+    """Take a ticket that gave up (timeout, cancellation) out of the queue"""
+    with _cond:
+        if ticket in _queue:
+            _dequeue(ticket)
+            _wake()  # The next ticket may now be at the head
+
+
+def acquire(tokens: int) -> Ticket:
+    """Wait for a slot for one call costing about `tokens`, blocking this thread; raises VisionBusy when saturated"""
+    ticket = _new_ticket(tokens)
+    started = time.monotonic()
+    deadline = started + VISION_MAX_WAIT_SECONDS
+    with _cond:
+        _enqueue(ticket)
+        try:
+            while (wait := _try_admit(ticket, deadline)) is not None:
+                _cond.wait(wait)
+        except BaseException:
+            _abandon(ticket)
+            raise
+    metrics.vision_queue_wait(ticket.priority, time.monotonic() - started)
+    return ticket
+
+
+async def admit(tokens: int) -> Ticket:
+    """acquire() for the event loop: waits for a slot without holding a thread"""
+    ticket = _new_ticket(tokens)
+    started = time.monotonic()
+    deadline = started + VISION_MAX_WAIT_SECONDS
+    event = asyncio.Event()
+    with _cond:
+        _enqueue(ticket)
+        _async_waiters[event] = asyncio.get_running_loop()
+    try:
+        while True:
+            with _cond:
+                event.clear()
+                wait = _try_admit(ticket, deadline)
+            if wait is None:
+                break
+            try:
+                await asyncio.wait_for(event.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+    except BaseException:
+        _abandon(ticket)
+        raise
+    finally:
+        with _cond:
+            _async_waiters.pop(event, None)
+    metrics.vision_queue_wait(ticket.priority, time.monotonic() - started)
+    return ticket
+
+
+@asynccontextmanager
+async def admitted(tokens: int):
+    """Wait for a slot on the event loop, then let the next slot() in this context (and
+    the worker threads it hands work to) use it: `async with admitted(n): await run_in_threadpool(...)`
+    """
+    ticket = await admit(tokens)
+    token = _admitted.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _admitted.reset(token)
+        if not ticket.claimed:
+            _refund(ticket)
+
+
+def _refund(ticket: Ticket):
+    """Hand back a slot that was admitted but never used for a call"""
+    global _in_flight, _requests, _tokens
+    with _cond:
+        _in_flight -= 1
+        if VISION_RPM:
+            _requests = min(float(VISION_RPM), _requests + 1)
+        if VISION_TPM:
+            _tokens = min(float(VISION_TPM), _tokens + ticket.tokens)
+        _wake()
+
+
+def _claim(tokens: int) -> Optional[Ticket]:
+    """The admitted ticket for this context, re-estimated at `tokens`, if it is still unused"""
+    global _tokens
+    ticket = _admitted.get()
+    if ticket is None or ticket.claimed:
+        return None
+    with _cond:
+        ticket.claimed = True
+        tokens = min(tokens, VISION_TPM) if VISION_TPM else tokens
+        if VISION_TPM:
+            _tokens -= tokens - ticket.tokens
+        ticket.tokens = ticket.used = tokens
+    return ticket
+
+
+def release(ticket: Ticket, latency: float):
+    """Return the slot and settle the difference between estimated and reported tokens"""
+    global _in_flight, _tokens, _avg_tokens, _avg_latency
+    with _cond:
+        _in_flight -= 1
+        if VISION_TPM:
+            _tokens = min(float(VISION_TPM), _tokens - (ticket.used - ticket.tokens))
+        _avg_tokens += 0.1 * (ticket.used - _avg_tokens)
+        _avg_latency += 0.1 * (latency - _avg_latency)
+        _totals["calls"] += 1
+        if ticket.usage:
+            _totals["prompt_tokens"] += ticket.usage[0]
+            _totals["completion_tokens"] += ticket.usage[1]
+        _wake()
+
+
+def usage_totals() -> dict:
+    """Calls this process made through the scheduler and the tokens they reported"""
+    with _cond:
+        return dict(_totals)
+
+
+def pause(seconds: float):
+    """Hold every call back, e.g. after the provider answered 429 despite the buckets"""
+    global _paused_until
+    with _cond:
+        _paused_until = max(_paused_until, time.monotonic() + seconds)
+
+
+def _provider_retry_after(error: Exception) -> Optional[float]:
+    """Seconds to back off if the error is the provider rate limiting us"""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return RATE_LIMIT_BACKOFF_SECONDS
+
+
+@contextmanager
+def slot(tokens: int):
+    """Hold a scheduler slot for one vision call: `with slot(estimate) as ticket: ...; ticket.record(response)`.
+
+    Uses the slot admitted() already holds for this context, if any; otherwise waits for one.
+    """
+    ticket = _claim(tokens) or acquire(tokens)
+    start = time.monotonic()
+    try:
+        yield ticket
+    except Exception as e:
+        backoff = _provider_retry_after(e)
+        if backoff is not None:
+            pause(backoff)
+        raise
+    finally:
+        release(ticket, time.monotonic() - start)
+
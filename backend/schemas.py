@@ -40,6 +40,9 @@ class OutfitCreate(BaseModel):
     items: List[str]  # List of item IDs
     filters: Optional[dict] = None
 
+class ItemBulkDelete(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=1000)
+
 class OutfitResponse(BaseModel):
     id: str
     name: Optional[str]
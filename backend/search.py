@@ -0,0 +1,110 @@
+import re
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .db import exclusive_schema_change, sync_triggers
+
+# Full-text search over item tags and notes using an SQLite FTS5 table.
+# items_fts holds one row per item and is kept in sync by triggers on the
+# items table, so every write path (uploads, deletes, re-tags, raw SQL) stays
+# indexed. Rows are located by the indexed item_id column rather than rowid,
+# because VACUUM may renumber rowids of tables without an INTEGER PRIMARY KEY.
+
+FTS_COLUMNS = ["type", "material", "pattern", "features", "colors", "notes"]
+# bm25 weights, in table column order: item_id, user_id, then FTS_COLUMNS
+BM25_WEIGHTS = "0, 0, 4.0, 2.0, 2.0, 1.5, 3.0, 0.5"
+
+_CREATE_TABLE = """
+CREATE VIRTUAL TABLE items_fts USING fts5(
+    item_id, user_id, type, material, pattern, features, colors, notes,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+
+def _label(kind: str, column: str) -> str:
+    """SQL expression turning a vocabulary code back into its label (legacy text passes through)"""
+    return f"COALESCE((SELECT label FROM vocab_terms WHERE kind = '{kind}' AND code = {column}), {column})"
+
+
+_FTS_VALUES = f"""
+    new.id, new.user_id, new.type, {_label("material", "new.material")},
+    {_label("pattern", "new.pattern")}, new.features,
+    {_label("color", "new.color_primary")} || ' ' || new.colors_secondary, new.notes
+"""
+
+_DELETE_OLD = """
+    DELETE FROM items_fts WHERE items_fts MATCH 'item_id:"' || old.id || '"';
+"""
+
+_TRIGGERS = {
+    "items_fts_insert": f"""
+        CREATE TRIGGER items_fts_insert AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts (item_id, user_id, {", ".join(FTS_COLUMNS)})
+            VALUES ({_FTS_VALUES});
+        END
+    """,
+    "items_fts_delete": f"""
+        CREATE TRIGGER items_fts_delete AFTER DELETE ON items BEGIN
+            {_DELETE_OLD}
+        END
+    """,
+    "items_fts_update": f"""
+        CREATE TRIGGER items_fts_update AFTER UPDATE ON items BEGIN
+            {_DELETE_OLD}
+            INSERT INTO items_fts (item_id, user_id, {", ".join(FTS_COLUMNS)})
+            VALUES ({_FTS_VALUES});
+        END
+    """,
+}
+
+
+def fts_available(engine: Engine) -> bool:
+    return engine.dialect.name == "sqlite"
+
+
+def init_search_index(engine: Engine):
+    """Create the FTS table (backfilling existing items) and any missing or outdated sync triggers"""
+    if not fts_available(engine):
+        return
+    # One locked transaction: no write can slip past the index between
+    # creating the table, backfilling it and creating the triggers
+    with exclusive_schema_change(engine) as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'"
+        )).first()
+        if not exists:
+            conn.execute(text(_CREATE_TABLE))
+            conn.execute(text(f"""
+                INSERT INTO items_fts (item_id, user_id, {", ".join(FTS_COLUMNS)})
+                SELECT {_FTS_VALUES.replace("new.", "items.")} FROM items
+            """))
+        sync_triggers(conn, _TRIGGERS)
+
+
+def build_match_query(user_id: str, q: str) -> str:
+    """FTS5 MATCH expression: every word of q (as a prefix) within this user's items"""
+    terms = re.findall(r"\w+", q.lower())
+    if not terms:
+        return ""
+    words = " ".join(f'"{term}"*' for term in terms)
+    return f'user_id:"{user_id}" AND {{{" ".join(FTS_COLUMNS)}}}: ({words})'
+
+
+def search_item_ids(db: Session, user_id: str, q: str, limit: int, offset: int) -> List[Tuple[str, float]]:
+    """Ranked (item_id, bm25 score) pairs for one page of results; lower scores rank higher"""
+    match = build_match_query(user_id, q)
+    if not match:
+        return []
+    rows = db.execute(text(f"""
+        SELECT item_id, bm25(items_fts, {BM25_WEIGHTS}) AS score
+        FROM items_fts
+        WHERE items_fts MATCH :match
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """), {"match": match, "limit": limit, "offset": offset})
+    return [(row.item_id, row.score) for row in rows]
@@ -0,0 +1,375 @@
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import caches
+from .analyzer import COLOR_PALETTE
+from .models import Item, User
+from .vocab import VOCABULARIES
+
+# Per-user vector index for "similar item" search.
+# Every item is described by a small float32 vector: its color histogram over
+# the palette plus one-hot encoded categorical tags. Vectors are L2-normalized
+# and kept in one contiguous matrix per user, so top-k cosine search is a
+# single matrix-vector product.
+
+# Optional on-disk persistence (memory-mapped .npy per user); empty disables it
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", "")
+
+COLOR_NAMES = list(COLOR_PALETTE.keys())
+# One-hot blocks over the canonical vocabularies (the fallback label gets no bit)
+CATEGORIES = {
+    kind: VOCABULARIES[kind][1:] for kind in ("slot", "formality", "pattern", "material", "fit")
+}
+CATEGORIES["season"] = ["spring", "summer", "fall", "winter"]
+# Relative weight of each block in the final vector
+BLOCK_WEIGHTS = {"color": 1.5, "slot": 1.0, "formality": 0.7, "pattern": 0.5,
+                 "material": 0.5, "fit": 0.3, "season": 0.5}
+
+FEATURE_DIM = len(COLOR_NAMES) + sum(len(values) for values in CATEGORIES.values())
+
+
+def color_histogram(color_shares: Optional[Dict[str, float]]) -> bytes:
+    """Pack analyzer color shares into the float32 bytes stored on the item row"""
+    hist = np.zeros(len(COLOR_NAMES), dtype=np.float32)
+    for name, share in (color_shares or {}).items():
+        if name in COLOR_PALETTE:
+            hist[COLOR_NAMES.index(name)] = share
+    return hist.tobytes()
+
+
+def item_features(item: Item) -> np.ndarray:
+    """Feature vector for an item row"""
+    blocks = []
+
+    if item.color_hist:
+        color = np.frombuffer(item.color_hist, dtype=np.float32).copy()
+    else:
+        color = np.zeros(len(COLOR_NAMES), dtype=np.float32)
+        if item.color_primary in COLOR_PALETTE:
+            color[COLOR_NAMES.index(item.color_primary)] = 1.0
+    blocks.append(("color", color))
+
+    season = item.season
+    if isinstance(season, str):
+        season = json.loads(season)
+    values = {
+        "slot": [item.slot], "formality": [item.formality], "pattern": [item.pattern],
+        "material": [item.material], "fit": [item.fit], "season": season or [],
+    }
+    for name, vocab in CATEGORIES.items():
+        block = np.zeros(len(vocab), dtype=np.float32)
+        for value in values[name]:
+            value = (value or "").lower()
+            if value in vocab:
+                block[vocab.index(value)] = 1.0
+        blocks.append((name, block))
+
+    parts = []
+    for name, block in blocks:
+        norm = np.linalg.norm(block)
+        parts.append(block / norm * BLOCK_WEIGHTS[name] if norm > 0 else block)
+    vector = np.concatenate(parts)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class VectorIndex:
+    """Contiguous float32 matrix of unit vectors with O(1) append and delete.
+
+    With a path, the matrix lives in a memory-mapped <path>.npy file that is
+    updated in place (rows beyond len(ids) are spare capacity), and the row
+    ids in an append-only log, <path>.ids: one "+id" or "-id" line per append
+    or delete, replayed on load and compacted (written and renamed) once it
+    is twice as long as needed.
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 64):
+        self.path = path
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.version = 0            # users.items_version this index reflects
+        self.log_lines = 0
+        self.log_id = None          # (inode, size) of the id log as this process left it
+        self.pending: List[str] = []
+        self.matrix = self._allocate(capacity)
+        if path:
+            self._compact_log()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        if not self.path:
+            return np.zeros((capacity, FEATURE_DIM), dtype=np.float32)
+        tmp_path = self.path + ".npy.tmp"
+        matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, FEATURE_DIM))
+        os.replace(tmp_path, self.path + ".npy")
+        return matrix
+
+    def _place(self, item_id: str):
+        self.rows[item_id] = len(self.ids)
+        self.ids.append(item_id)
+
+    def _remove(self, item_id: str) -> Optional[int]:
+        """Drop a row id by moving the last one into its place; returns the freed row"""
+        row = self.rows.pop(item_id, None)
+        if row is None:
+            return None
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.rows[moved] = row
+        self.ids.pop()
+        return row
+
+    def append(self, item_id: str, vector: np.ndarray):
+        if item_id in self.rows:
+            self.matrix[self.rows[item_id]] = vector
+            return
+        n = len(self.ids)
+        if n == self.matrix.shape[0]:
+            grown = self._allocate(self.matrix.shape[0] * 2)
+            grown[:n] = self.matrix[:n]
+            self.matrix = grown
+        self.matrix[n] = vector
+        self._place(item_id)
+        self.pending.append(f"+{item_id}")
+
+    def delete(self, item_id: str):
+        last = len(self.ids) - 1
+        row = self._remove(item_id)
+        if row is None:
+            return
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+        self.pending.append(f"-{item_id}")
+
+    def vector(self, item_id: str) -> Optional[np.ndarray]:
+        row = self.rows.get(item_id)
+        return None if row is None else self.matrix[row]
+
+    def search(self, vector: np.ndarray, k: int, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Top-k (item_id, cosine score) pairs, best first"""
+        n = len(self.ids)
+        if n == 0 or k <= 0:
+            return []
+        scores = self.matrix[:n] @ vector
+        if exclude in self.rows:
+            scores[self.rows[exclude]] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def _stat_log(self):
+        st = os.stat(self.path + ".ids")
+        return st.st_ino, st.st_size
+
+    def _compact_log(self):
+        with open(self.path + ".ids.tmp", "w") as f:
+            f.writelines(f"+{item_id}\n" for item_id in self.ids)
+        os.replace(self.path + ".ids.tmp", self.path + ".ids")
+        self.log_lines = len(self.ids)
+
+    def current(self) -> bool:
+        """Whether the files are as this process left them (no other process wrote since)"""
+        try:
+            return self._stat_log() == self.log_id
+        except OSError:
+            return False
+
+    def flush(self):
+        """Write pending changes (matrix pages and id log lines) to disk"""
+        if not self.path:
+            self.pending.clear()
+            return
+        self.matrix.flush()
+        if self.pending or self.log_id is None:
+            if self.log_lines + len(self.pending) > 2 * len(self.ids) + 64:
+                self._compact_log()
+            else:
+                with open(self.path + ".ids", "a") as f:
+                    f.writelines(line + "\n" for line in self.pending)
+                self.log_lines += len(self.pending)
+            self.pending.clear()
+        self.log_id = self._stat_log()
+
+    @classmethod
+    def load(cls, path: str) -> Optional["VectorIndex"]:
+        """Reopen a persisted index: memory-map its matrix and replay its id log"""
+        index = cls.__new__(cls)
+        index.path, index.ids, index.rows = path, [], {}
+        index.version, index.pending = 0, []
+        try:
+            index.matrix = np.lib.format.open_memmap(path + ".npy", mode="r+")
+            with open(path + ".ids") as f:
+                lines = f.read().splitlines()
+            index.log_id = index._stat_log()
+        except (OSError, ValueError):
+            return None
+        for line in lines:
+            op, item_id = line[:1], line[1:]
+            if op == "+" and item_id not in index.rows:
+                index._place(item_id)
+            elif op == "-":
+                index._remove(item_id)
+        index.log_lines = len(lines)
+        matrix = index.matrix
+        if matrix.dtype != np.float32 or matrix.shape[1] != FEATURE_DIM or matrix.shape[0] < len(index.ids):
+            return None
+        return index
+
+
+# Per-user indexes, built lazily on first search. They are per process and
+# follow users.items_version (see caches.py): a worker whose index is behind
+# reloads it before searching.
+# With SIMILARITY_INDEX_DIR, writers hold an exclusive lock on <path>.lock
+# while they touch a user's files; a worker that finds the files changed by
+# another process drops its copy instead of writing over them.
+_indexes: Dict[str, VectorIndex] = {}
+_locks: Dict[str, threading.RLock] = {}
+_locks_guard = threading.Lock()
+
+
+def _user_lock(user_id: str) -> threading.RLock:
+    with _locks_guard:
+        lock = _locks.get(user_id)
+        if lock is None:
+            lock = _locks[user_id] = threading.RLock()
+        return lock
+
+
+@contextmanager
+def _file_lock(path: Optional[str]):
+    """Exclusive lock on a persisted index across processes (no-op without a path)"""
+    if not path:
+        yield
+        return
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _index_path(user_id: str) -> Optional[str]:
+    if not SIMILARITY_INDEX_DIR:
+        return None
+    os.makedirs(SIMILARITY_INDEX_DIR, exist_ok=True)
+    return os.path.join(SIMILARITY_INDEX_DIR, f"similar_{user_id}")
+
+
+def get_index(db: Session, user: User) -> VectorIndex:
+    """The user's index: kept if current, else reloaded from disk if that matches the database, else rebuilt"""
+    with _user_lock(user.id):
+        index = _indexes.get(user.id)
+        if caches.is_current(index, user):
+            return index
+
+        path = _index_path(user.id)
+        with _file_lock(path):
+            index = VectorIndex.load(path) if path else None
+            if index is not None:
+                current = {item_id for (item_id,) in db.query(Item.id).filter(Item.user_id == user.id)}
+                if current != set(index.ids):
+                    index = None
+
+            if index is None:
+                index = VectorIndex(path)
+                for item in db.query(Item).filter(Item.user_id == user.id).yield_per(500):
+                    index.append(item.id, item_features(item))
+                index.flush()
+
+        index.version = caches.items_version(user)
+        _indexes[user.id] = index
+        return index
+
+
+def _patch(user_id: str, items: list, change: Callable[[VectorIndex], None]):
+    """Apply one committed item change to the user's loaded index, if any"""
+    with caches.patch(_indexes, user_id, _user_lock(user_id), items) as index:
+        if index is None:
+            return
+        with _file_lock(index.path):
+            if index.path and not index.current():
+                del _indexes[user_id]  # Another process wrote; reload on next search
+                return
+            change(index)
+            index.flush()
+
+
+def add_item(item: Item):
+    """Append (or refresh) an item in its owner's index if that index is loaded"""
+    add_items(item.user_id, [item])
+
+
+def add_items(user_id: str, items) -> None:
+    """Append several new items of one user, flushing the index once"""
+    items = list(items)
+
+    def change(index: VectorIndex):
+        for item in items:
+            index.append(item.id, item_features(item))
+    _patch(user_id, items, change)
+
+
+def refresh_items(user_id: str, items) -> None:
+    """Rewrite the vectors of re-tagged items.
+
+    Without a loaded index this updates the persisted file, if any, in place,
+    so a script such as retag.py keeps it current for the workers that reload it.
+    """
+    items = list(items)
+
+    def change(index: VectorIndex):
+        for item in items:
+            row = index.rows.get(item.id)
+            if row is not None:
+                index.matrix[row] = item_features(item)
+
+    with _user_lock(user_id):
+        if user_id in _indexes:
+            _patch(user_id, items, change)
+            return
+        path = _index_path(user_id)
+        if not path:
+            return
+        with _file_lock(path):
+            index = VectorIndex.load(path)
+            if index is not None:
+                change(index)
+                index.matrix.flush()
+
+
+def remove_item(user_id: str, item_id: str):
+    """Drop a deleted item from its owner's index if that index is loaded"""
+    remove_items(user_id, [item_id])
+
+
+def remove_items(user_id: str, item_ids) -> None:
+    """Drop several deleted items, flushing the index once"""
+    item_ids = list(item_ids)
+
+    def change(index: VectorIndex):
+        for item_id in item_ids:
+            index.delete(item_id)
+    _patch(user_id, item_ids, change)
+
+
+def find_similar(db: Session, user: User, item_id: str, k: int) -> List[Tuple[str, float]]:
+    """Top-k items most similar to item_id in the same closet"""
+    index = get_index(db, user)
+    with _user_lock(user.id):
+        vector = index.vector(item_id)
+        if vector is None:
+            return []
+        return index.search(np.array(vector), k, exclude=item_id)
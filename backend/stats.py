@@ -0,0 +1,178 @@
+import json
+from collections import Counter
+from typing import Dict
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import vocab
+from .db import exclusive_schema_change, sync_triggers
+from .models import Item
+
+# Closet statistics: how many of a user's items have each slot, primary color,
+# formality and season, plus the total. closet_stats holds one counter per
+# (user, attribute, value) and is kept current by triggers on the items table,
+# in the same transaction as every insert, delete and re-tag (uploads, imports,
+# bulk deletes, retag.py's batched UPDATEs), so reading the stats never scans
+# the closet. Vocabulary columns are counted by code and decoded on read.
+# Counters that drop to zero are deleted.
+
+# attribute -> SQL expression over the new/old row giving its value
+STAT_COLUMNS = {
+    "slot": "CAST({row}.slot AS TEXT)",
+    "color": "CAST({row}.color_primary AS TEXT)",
+    "formality": "CAST({row}.formality AS TEXT)",
+}
+VOCAB_KINDS = {"slot": "slot", "color": "color", "formality": "formality"}
+TOTAL = "total"
+
+_CREATE_TABLE = """
+CREATE TABLE closet_stats (
+    user_id VARCHAR NOT NULL,
+    attribute VARCHAR NOT NULL,
+    value VARCHAR NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, attribute, value)
+) WITHOUT ROWID
+"""
+
+
+def _seasons(row: str) -> str:
+    """json_each over a row's seasons (malformed JSON counts as none)"""
+    return f"json_each(CASE WHEN json_valid({row}.season) THEN {row}.season ELSE '[]' END)"
+
+
+def _values(row: str) -> str:
+    """(attribute, value) pairs one new/old row is counted under"""
+    parts = [f"SELECT '{TOTAL}' AS attribute, '' AS value"]
+    parts += [f"SELECT '{attribute}', {expr.format(row=row)}" for attribute, expr in STAT_COLUMNS.items()]
+    parts.append(f"SELECT DISTINCT 'season', lower(value) FROM {_seasons(row)} WHERE type = 'text'")
+    return " UNION ALL ".join(parts)
+
+
+def _backfill() -> str:
+    """Counters for every existing item, one GROUP BY per attribute"""
+    parts = [f"SELECT user_id, '{TOTAL}', '', count(*) FROM items GROUP BY user_id"]
+    parts += [f"SELECT user_id, '{attribute}', {expr.format(row='items')}, count(*) FROM items "
+              f"GROUP BY user_id, {expr.format(row='items')}" for attribute, expr in STAT_COLUMNS.items()]
+    # DISTINCT per item first, so a season listed twice counts once
+    parts.append(f"SELECT user_id, 'season', value, count(*) FROM ("
+                 f"SELECT DISTINCT items.id, items.user_id, lower(s.value) AS value "
+                 f"FROM items, {_seasons('items')} AS s WHERE s.type = 'text') GROUP BY user_id, value")
+    return " UNION ALL ".join(parts)
+
+
+def _increment(row: str) -> str:
+    # "WHERE true" keeps SQLite from reading ON CONFLICT as part of the SELECT
+    return f"""
+        INSERT INTO closet_stats (user_id, attribute, value, count)
+        SELECT {row}.user_id, attribute, value, 1 FROM ({_values(row)})
+        WHERE true
+        ON CONFLICT (user_id, attribute, value) DO UPDATE SET count = count + 1;
+    """
+
+
+def _decrement(row: str) -> str:
+    return f"""
+        UPDATE closet_stats SET count = count - 1
+        WHERE user_id = {row}.user_id AND (attribute, value) IN ({_values(row)});
+        DELETE FROM closet_stats WHERE user_id = {row}.user_id AND count <= 0;
+    """
+
+
+_TRIGGERS = {
+    "closet_stats_insert": f"""
+        CREATE TRIGGER closet_stats_insert AFTER INSERT ON items BEGIN
+            {_increment("new")}
+        END
+    """,
+    "closet_stats_delete": f"""
+        CREATE TRIGGER closet_stats_delete AFTER DELETE ON items BEGIN
+            {_decrement("old")}
+        END
+    """,
+    "closet_stats_update": f"""
+        CREATE TRIGGER closet_stats_update
+        AFTER UPDATE OF user_id, slot, color_primary, formality, season ON items BEGIN
+            {_decrement("old")}
+            {_increment("new")}
+        END
+    """,
+}
+
+
+def stats_available(engine: Engine) -> bool:
+    return engine.dialect.name == "sqlite"
+
+
+def init_closet_stats(engine: Engine):
+    """Create the counters table (backfilling existing items) and any missing or outdated triggers"""
+    if not stats_available(engine):
+        return
+    # One locked transaction: no write can slip past the counters between
+    # creating the table, backfilling it and creating the triggers
+    with exclusive_schema_change(engine) as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'closet_stats'"
+        )).first()
+        if not exists:
+            conn.execute(text(_CREATE_TABLE))
+            conn.execute(text(f"INSERT INTO closet_stats (user_id, attribute, value, count) {_backfill()}"))
+        sync_triggers(conn, _TRIGGERS)
+
+
+def _label(attribute: str, value: str) -> str:
+    kind = VOCAB_KINDS.get(attribute)
+    if kind is None:
+        return value
+    # Codes are stored as text; anything else is a legacy label
+    return vocab.decode(kind, int(value)) if value.isdigit() else vocab.normalize(kind, value)
+
+
+def _empty() -> Dict:
+    return {TOTAL: 0, **{attribute: {} for attribute in STAT_COLUMNS}, "season": {}}
+
+
+def closet_stats(db: Session, user_id: str) -> Dict:
+    """{"total": n, "slot": {label: n}, "color": {...}, "formality": {...}, "season": {...}}"""
+    if not stats_available(db.get_bind()):
+        return _count_items(db, user_id)
+    result = _empty()
+    rows = db.execute(text("SELECT attribute, value, count FROM closet_stats WHERE user_id = :user_id"),
+                      {"user_id": user_id})
+    for attribute, value, count in rows:
+        if attribute == TOTAL:
+            result[TOTAL] = count
+        elif attribute in result:
+            label = _label(attribute, value)
+            result[attribute][label] = result[attribute].get(label, 0) + count
+    return result
+
+
+def total_items(db: Session, user_id: str) -> int:
+    if not stats_available(db.get_bind()):
+        return _count_items(db, user_id)[TOTAL]
+    return db.execute(text(
+        "SELECT count FROM closet_stats WHERE user_id = :user_id AND attribute = :total"
+    ), {"user_id": user_id, "total": TOTAL}).scalar() or 0
+
+
+def _count_items(db: Session, user_id: str) -> Dict:
+    """The same statistics counted from the items themselves, for databases without the triggers"""
+    result, counters = _empty(), {attribute: Counter() for attribute in ("slot", "color", "formality", "season")}
+    for slot, color, formality, season in db.query(Item.slot, Item.color_primary, Item.formality, Item.season) \
+            .filter(Item.user_id == user_id):
+        result[TOTAL] += 1
+        counters["slot"][slot] += 1
+        counters["color"][color] += 1
+        counters["formality"][formality] += 1
+        try:
+            seasons = json.loads(season)
+        except ValueError:
+            continue
+        if isinstance(seasons, list):
+            counters["season"].update({s.lower() for s in seasons if isinstance(s, str)})
+    for attribute, counter in counters.items():
+        result[attribute] = dict(counter)
+    return result
@@ -0,0 +1,364 @@
+import io
+import os
+import re
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Content-addressed image storage.
+# Images are stored once per distinct content under the object key
+#   <sha[0:2]>/<sha[2:4]>/<sha>.jpg
+# and served as /images/<sha>.jpg. The blobs table counts how many rows
+# (items, profile photos) reference each object. Requests only adjust the
+# counts; objects that are unreferenced (or were never committed, e.g. a
+# failed upload) are removed later by collector.py.
+#
+# STORAGE_BACKEND picks where objects live:
+#   local - files under STORAGE_DIR (default). Files from before the
+#           content-addressed layout live flat in STORAGE_DIR and are still
+#           served; see migrate_storage.py to convert them.
+#   s3    - an S3-compatible bucket (AWS, MinIO, ...); images are served by
+#           redirecting to presigned URLs. Needs `pip install boto3`.
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_DIR = os.getenv("STORAGE_DIR", "./storage")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "images/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")    # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv("S3_REGION", "")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", "3600"))
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+READ_CHUNK_SIZE = 256 * 1024
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+_KEY_NAME = re.compile(r"^([0-9a-f]{64})\.jpg$")
+
+
+def blob_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def object_name(key: str) -> str:
+    return f"{key[:2]}/{key[2:4]}/{key}.jpg"
+
+
+def image_url(key: str) -> str:
+    return f"/images/{key}.jpg"
+
+
+def key_from_url(url: Optional[str]) -> Optional[str]:
+    """Blob key of a content-addressed image URL, or None for legacy/missing URLs"""
+    match = _KEY_NAME.match(os.path.basename(url or ""))
+    return match.group(1) if match else None
+
+
+class StorageBackend(ABC):
+    """Where blob bytes live. Keys are sha256 hex strings."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def write(self, key: str, data: bytes):
+        """Store data under key; must never expose a partially written object"""
+
+    def store(self, key: str, data: bytes):
+        """Make sure key holds data and counts as freshly written.
+
+        The collector never removes objects modified within its grace period,
+        which protects uploads whose blob row is not committed yet.
+        """
+        self.write(key, data)
+
+    @abstractmethod
+    def modified_at(self, key: str) -> Optional[float]:
+        """Last-modified time (epoch seconds), or None if the object is missing"""
+
+    @abstractmethod
+    def iter_objects(self) -> Iterator[Tuple[str, float]]:
+        """Yield (key, modified_at) for every stored object"""
+
+    @abstractmethod
+    def read(self, key: str) -> bytes:
+        ...
+
+    def iter_chunks(self, key: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+        """Stream the object's bytes without holding the whole object in memory"""
+        yield self.read(key)
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove the object; a missing object is not an error"""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path to serve directly, if the backend has one"""
+        return None
+
+    def presigned_url(self, key: str) -> Optional[str]:
+        """Time-limited URL clients can fetch the object from directly, if supported"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, object_name(key))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    def store(self, key: str, data: bytes):
+        try:
+            os.utime(self.local_path(key))  # Same content already there
+        except FileNotFoundError:
+            self.write(key, data)
+
+    def modified_at(self, key: str) -> Optional[float]:
+        try:
+            return os.stat(self.local_path(key)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def iter_objects(self) -> Iterator[Tuple[str, float]]:
+        for first in _subdirs(self.root):
+            for second in _subdirs(first.path):
+                with os.scandir(second.path) as entries:
+                    for entry in entries:
+                        match = _KEY_NAME.match(entry.name)
+                        if match and entry.is_file():
+                            yield match.group(1), entry.stat().st_mtime
+
+    def stale_temp_files(self, older_than: float) -> Iterator[str]:
+        """Temp files left behind by writes that crashed before the rename"""
+        for first in _subdirs(self.root):
+            for second in _subdirs(first.path):
+                with os.scandir(second.path) as entries:
+                    for entry in entries:
+                        if entry.name.startswith(".tmp-") and entry.stat().st_mtime < older_than:
+                            yield entry.path
+
+    def legacy_files(self) -> Iterator[Tuple[str, float]]:
+        """Yield (filename, modified_at) for flat files from before content addressing"""
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.endswith(".jpg") and entry.is_file():
+                    yield entry.name, entry.stat().st_mtime
+
+    def write(self, key: str, data: bytes):
+        path = self.local_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Temp file in the same directory + rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def read(self, key: str) -> bytes:
+        with open(self.local_path(key), "rb") as f:
+            return f.read()
+
+    def iter_chunks(self, key: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+        return _file_chunks(self.local_path(key), chunk_size)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def legacy_path(self, filename: str) -> str:
+        return os.path.join(self.root, os.path.basename(filename))
+
+
+def _file_chunks(path: str, chunk_size: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _subdirs(path: str):
+    with os.scandir(path) as entries:
+        return [entry for entry in entries if entry.is_dir() and len(entry.name) == 2]
+
+
+class S3Storage(StorageBackend):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 (pip install boto3)") from e
+
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+        self.bucket, self.prefix = bucket, prefix
+        self._client_error = ClientError
+        # One client (thread-safe, with its own connection pool) shared by all requests
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                          retries={"max_attempts": 5, "mode": "adaptive"}),
+        )
+        self.transfer_config = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD,
+                                              multipart_chunksize=S3_MULTIPART_THRESHOLD)
+
+    def _object(self, key: str) -> str:
+        return self.prefix + object_name(key)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def modified_at(self, key: str) -> Optional[float]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head["LastModified"].timestamp()
+
+    def iter_objects(self) -> Iterator[Tuple[str, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                match = _KEY_NAME.match(os.path.basename(obj["Key"]))
+                if match:
+                    yield match.group(1), obj["LastModified"].timestamp()
+
+    def write(self, key: str, data: bytes):
+        # S3 PUTs are atomic (re-putting identical content just refreshes it);
+        # large bodies are streamed as multipart uploads
+        self.client.upload_fileobj(
+            io.BytesIO(data), self.bucket, self._object(key),
+            ExtraArgs={"ContentType": "image/jpeg", "CacheControl": IMMUTABLE_CACHE},
+            Config=self.transfer_config,
+        )
+
+    def read(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._object(key))["Body"].read()
+
+    def iter_chunks(self, key: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self._object(key))["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+
+    def presigned_url(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._object(key)},
+            ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+
+
+_backend: Optional[StorageBackend] = None
+
+
+def get_backend() -> StorageBackend:
+    """Get or create the configured storage backend"""
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "s3":
+            _backend = S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+        elif STORAGE_BACKEND == "local":
+            _backend = LocalStorage(STORAGE_DIR)
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _backend
+
+
+def write_blob(data: bytes) -> str:
+    """Store data under its content hash and return the key"""
+    key = blob_key(data)
+    get_backend().store(key, data)
+    return key
+
+
+def retain(db: Session, key: str, size: int, count: int = 1):
+    """Add references to a blob (part of the caller's transaction)"""
+    db.execute(text(
+        "INSERT INTO blobs (key, size, refcount) VALUES (:key, :size, :count) "
+        "ON CONFLICT (key) DO UPDATE SET refcount = blobs.refcount + :count"
+    ), {"key": key, "size": size, "count": count})
+
+
+def release(db: Session, key: str, count: int = 1):
+    """Drop references to a blob (part of the caller's transaction); the collector removes it at zero"""
+    db.execute(text("UPDATE blobs SET refcount = refcount - :count WHERE key = :key"),
+               {"key": key, "count": count})
+
+
+def put(db: Session, data: bytes) -> str:
+    """Store image bytes and take one reference to them; returns the blob key"""
+    key = write_blob(data)
+    retain(db, key, len(data))
+    return key
+
+
+def release_url(db: Session, url: Optional[str]):
+    """Release the image behind an item or profile photo URL.
+
+    Legacy flat files are left to the collector, which removes them once no
+    row points at them.
+    """
+    key = key_from_url(url)
+    if key:
+        release(db, key)
+
+
+def iter_image(url: str) -> Optional[Iterator[bytes]]:
+    """Chunks of the image behind an item or profile photo URL, or None if it is missing"""
+    backend = get_backend()
+    key = key_from_url(url)
+    if key:
+        return backend.iter_chunks(key) if backend.exists(key) else None
+    if isinstance(backend, LocalStorage):
+        path = backend.legacy_path(url)
+        if os.path.isfile(path):
+            return _file_chunks(path, READ_CHUNK_SIZE)
+    return None
+
+
+def resolve(filename: str) -> Optional[str]:
+    """Local filesystem path for an /images/<filename> request, or None"""
+    backend = get_backend()
+    if not isinstance(backend, LocalStorage):
+        return None
+    key = key_from_url(filename)
+    path = backend.local_path(key) if key else backend.legacy_path(filename)
+    return path if os.path.isfile(path) else None
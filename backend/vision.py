@@ -1,34 +1,83 @@
 import os
 import base64
 import json
-from openai import OpenAI
-from typing import List, Optional
-from PIL import Image
-from dotenv import load_dotenv
+import time
+import random
+import hashlib
+from typing import List, Optional, Union
 from .schemas import ItemTags
-
-# Load environment variables
-load_dotenv()
+from .analyzer import analyze_image, merge_local_tags
+from .vocab import normalize_tags
+from . import metrics, scheduler
 
 # Lazy client initialization
 _client = None
 USE_MOCK_MODE = os.getenv("USE_MOCK_MODE", "false").lower() == "true"
+# Point at any OpenAI-compatible server (e.g. mock_openai_server.py for load tests)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4o")
+# Stored with every item's tags. Bump it when the prompts (or the model they
+# are tuned for) change, then `python retag.py --stale` re-tags older items.
+PROMPT_VERSION = 1
+# Mock mode: seed for deterministic tags and simulated call latency
+MOCK_SEED = os.getenv("MOCK_SEED", "0")
+MOCK_LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "0"))
+# Derive colors locally from pixels instead of asking the model for them
+LOCAL_COLOR_ANALYSIS = os.getenv("LOCAL_COLOR_ANALYSIS", "true").lower() == "true"
+
+# Images are passed as a file path or as the encoded bytes already in memory
+ImageInput = Union[str, bytes]
+
+COLOR_PROMPT_FIELDS = """  "color_primary": "main color (e.g., 'black', 'white', 'blue', 'red')",
+  "colors_secondary": ["array of secondary colors if any"],
+"""
+
+def local_analysis(image: ImageInput, bbox: Optional[dict] = None, precomputed: Optional[dict] = None) -> Optional[dict]:
+    """Local color/pattern analysis when enabled; reuses a result the caller already has"""
+    if not LOCAL_COLOR_ANALYSIS:
+        return None
+    return precomputed if precomputed is not None else analyze_image(image, bbox)
 
 def get_client():
     """Get or create OpenAI client. Returns None if no API key is available (mock mode)."""
     global _client
     if _client is None:
         api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key and OPENAI_BASE_URL:
+            api_key = "local-stand-in"  # Stand-in servers don't check keys
         if not api_key:
             return None  # Will use mock mode instead
-        _client = OpenAI(api_key=api_key)
+        from openai import OpenAI  # Heavy import; only paid by workers that actually call the API
+        _client = OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL or None)
     return _client
 
-def generate_mock_tags(image_path: str, context: dict = None) -> ItemTags:
+def calls_provider() -> bool:
+    """Whether tagging calls the vision model (through the scheduler) rather than returning mock tags"""
+    return not USE_MOCK_MODE and bool(_client or os.getenv("OPENAI_API_KEY") or OPENAI_BASE_URL)
+
+def estimated_call_tokens(max_tokens: int = 1000) -> int:
+    """Token estimate for admitting a call before its prompt is built (the prompts run ~300 tokens);
+    the scheduler re-estimates from the real prompt when the call is made"""
+    return 300 + scheduler.VISION_IMAGE_TOKENS + max_tokens
+
+def _mock_rng(image: ImageInput, context: dict = None) -> random.Random:
+    """RNG seeded by image content (and item context) so mock results are reproducible"""
+    digest = hashlib.sha256(MOCK_SEED.encode())
+    digest.update(read_image(image))
+    if context:
+        digest.update(json.dumps(context, sort_keys=True).encode())
+    return random.Random(digest.hexdigest())
+
+def _mock_delay():
+    if MOCK_LATENCY_MS > 0:
+        time.sleep(MOCK_LATENCY_MS / 1000)
+
+def generate_mock_tags(image: ImageInput, context: dict = None, local: Optional[dict] = None) -> ItemTags:
     """Generate mock clothing tags for demo/testing purposes"""
-    import random
+    _mock_delay()
+    rng = _mock_rng(image, context)
     
-    # Simple mock based on filename or random
+    # Simple mock based on filename, otherwise seeded by the image content
     slots = ["top", "bottom", "shoes", "outerwear", "accessory", "dress", "other"]
     types_map = {
         "top": ["t-shirt", "shirt", "blouse", "sweater", "hoodie"],
@@ -44,6 +93,10 @@ def generate_mock_tags(image_path: str, context: dict = None) -> ItemTags:
     fits = ["slim", "regular", "loose", "oversized", "fitted"]
     formalities = ["casual", "business casual", "formal", "sporty"]
     seasons = ["spring", "summer", "fall", "winter"]
+
+    # Colors and pattern come from the pixels rather than the dice
+    if local is None:
+        local = analyze_image(image, context.get("bbox_estimate") if context else None)
     
     # Determine slot (try to guess from filename or context)
     slot = "other"
@@ -63,7 +116,7 @@ def generate_mock_tags(image_path: str, context: dict = None) -> ItemTags:
             slot = "dress"
     
     # Use filename as hint if no context
-    filename = os.path.basename(image_path).lower()
+    filename = os.path.basename(image).lower() if isinstance(image, str) else ""
     if slot == "other":
         if any(x in filename for x in ["shirt", "tshirt", "top", "blouse", "sweater"]):
             slot = "top"
@@ -76,61 +129,61 @@ def generate_mock_tags(image_path: str, context: dict = None) -> ItemTags:
         elif any(x in filename for x in ["sunglass", "hat"]):
             slot = "accessory"
         else:
-            slot = random.choice(slots[:3])  # Prefer common slots
+            slot = rng.choice(slots[:3])  # Prefer common slots
     
-    item_type = random.choice(types_map.get(slot, [context.get("item_type", "clothing") if context else "clothing"]))
+    item_type = rng.choice(types_map.get(slot, [context.get("item_type", "clothing") if context else "clothing"]))
     
-    return ItemTags(
+    return normalize_tags(ItemTags(
         slot=slot,
         type=item_type,
-        color_primary=random.choice(colors),
-        colors_secondary=[random.choice(colors) for _ in range(random.randint(0, 2))] if random.random() > 0.5 else [],
-        pattern=random.choice(patterns),
-        material=random.choice(materials),
-        fit=random.choice(fits),
-        formality=random.choice(formalities),
-        season=random.sample(seasons, random.randint(1, 3)),
-        features=random.sample(["long sleeve", "short sleeve", "pockets", "hood", "zipper"], random.randint(0, 2)) if random.random() > 0.5 else [],
-        brand_or_logo_visible=random.random() > 0.7,
+        color_primary=local["color_primary"] if local else rng.choice(colors),
+        colors_secondary=local["colors_secondary"] if local else ([rng.choice(colors) for _ in range(rng.randint(0, 2))] if rng.random() > 0.5 else []),
+        pattern=(local and local["pattern"]) or rng.choice(patterns),
+        material=rng.choice(materials),
+        fit=rng.choice(fits),
+        formality=rng.choice(formalities),
+        season=rng.sample(seasons, rng.randint(1, 3)),
+        features=rng.sample(["long sleeve", "short sleeve", "pockets", "hood", "zipper"], rng.randint(0, 2)) if rng.random() > 0.5 else [],
+        brand_or_logo_visible=rng.random() > 0.7,
         notes="[MOCK MODE] This is demo data. Add your OpenAI API key for real AI analysis."
-    )
+    ))
 
-def encode_image(image_path: str) -> str:
-    """Encode image to base64 for OpenAI API"""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def generate_mock_items(image: ImageInput) -> List[dict]:
+    """Generate a mock outfit separation (top, bottom and sometimes shoes) for demo/testing purposes"""
+    _mock_delay()
+    rng = _mock_rng(image)
+    items = [
+        {"description": "top worn by the person", "item_type": rng.choice(["t-shirt", "shirt", "sweater"]),
+         "bbox_estimate": {"x_min": 20, "y_min": 15, "x_max": 80, "y_max": 50}},
+        {"description": "bottom worn by the person", "item_type": rng.choice(["jeans", "pants", "shorts"]),
+         "bbox_estimate": {"x_min": 25, "y_min": 45, "x_max": 75, "y_max": 85}},
+    ]
+    if rng.random() > 0.4:
+        items.append({"description": "shoes", "item_type": rng.choice(["sneakers", "boots"]),
+                      "bbox_estimate": {"x_min": 25, "y_min": 85, "x_max": 75, "y_max": 100}})
+    return items
 
-def tag_item(image_path: str) -> ItemTags:
-    """Analyze a single clothing item and return structured tags"""
-    base64_image = encode_image(image_path)
-    
-    prompt = """Analyze this clothing item image and return a JSON object with the following structure:
-{
-  "slot": "one of: top, bottom, shoes, outerwear, accessory, dress, other",
-  "type": "specific type (e.g., 't-shirt', 'jeans', 'sneakers', 'jacket', 'sunglasses')",
-  "color_primary": "main color (e.g., 'black', 'white', 'blue', 'red')",
-  "colors_secondary": ["array of secondary colors if any"],
-  "pattern": "pattern type (e.g., 'solid', 'striped', 'plaid', 'polka dot', 'floral')",
-  "material": "material (e.g., 'cotton', 'denim', 'leather', 'polyester', 'wool')",
-  "fit": "fit style (e.g., 'slim', 'regular', 'loose', 'oversized', 'fitted')",
-  "formality": "formality level (e.g., 'casual', 'business casual', 'formal', 'sporty')",
-  "season": ["array of applicable seasons: 'spring', 'summer', 'fall', 'winter'"],
-  "features": ["array of notable features like 'long sleeve', 'hood', 'pockets', etc."],
-  "brand_or_logo_visible": true or false,
-  "notes": "any additional relevant notes about the item"
-}
+def read_image(image: ImageInput) -> bytes:
+    """Raw bytes of an image given as bytes or a file path"""
+    if isinstance(image, bytes):
+        return image
+    with open(image, "rb") as image_file:
+        return image_file.read()
 
-Return ONLY valid JSON, no markdown formatting or additional text."""
+def encode_image(image: ImageInput) -> str:
+    """Encode image to base64 for OpenAI API"""
+    with metrics.stage("encode"):
+        return base64.b64encode(read_image(image)).decode('utf-8')
 
-    # Check if we should use mock mode
-    client = get_client()
-    if client is None or USE_MOCK_MODE:
-        print("⚠️  Running in MOCK MODE - using demo data. Set OPENAI_API_KEY for real AI analysis.")
-        return generate_mock_tags(image_path)
+def _vision_request(client, function: str, prompt: str, base64_image: str, max_tokens: int) -> str:
+    """Send a prompt and an image to the vision model and return the reply without markdown fences.
 
-    try:
+    Waits for a slot from the scheduler first; raises scheduler.VisionBusy when none comes in time.
+    """
+    with scheduler.slot(scheduler.estimate_tokens(prompt, max_tokens)) as ticket, \
+            metrics.vision_call(function, VISION_MODEL) as call:
         response = client.chat.completions.create(
-            model="gpt-4o",
+            model=VISION_MODEL,
             messages=[
                 {
                     "role": "user",
@@ -145,23 +198,59 @@ Return ONLY valid JSON, no markdown formatting or additional text."""
                     ]
                 }
             ],
-            max_tokens=1000,
+            max_tokens=max_tokens,
         )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
+        call.record(response)
+        ticket.record(response)
+
+    content = response.choices[0].message.content.strip()
+
+    # Remove markdown code blocks if present
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content.strip()
+
+def tag_item(image: ImageInput, local: Optional[dict] = None) -> ItemTags:
+    """Analyze a single clothing item and return structured tags.
+
+    local is the caller's analyze_image() result for the image, if it has one.
+    """
+    # Check if we should use mock mode
+    client = None if USE_MOCK_MODE else get_client()
+    if client is None:
+        print("⚠️  Running in MOCK MODE - using demo data. Set OPENAI_API_KEY for real AI analysis.")
+        return generate_mock_tags(image, local=local)
+
+    base64_image = encode_image(image)
+    local = local_analysis(image, precomputed=local)
+    color_fields = "" if local else COLOR_PROMPT_FIELDS
+    
+    prompt = f"""Analyze this clothing item image and return a JSON object with the following structure:
+{{
+  "slot": "one of: top, bottom, shoes, outerwear, accessory, dress, other",
+  "type": "specific type (e.g., 't-shirt', 'jeans', 'sneakers', 'jacket', 'sunglasses')",
+{color_fields}  "pattern": "pattern type (e.g., 'solid', 'striped', 'plaid', 'polka dot', 'floral')",
+  "material": "material (e.g., 'cotton', 'denim', 'leather', 'polyester', 'wool')",
+  "fit": "fit style (e.g., 'slim', 'regular', 'loose', 'oversized', 'fitted')",
+  "formality": "formality level (e.g., 'casual', 'business casual', 'formal', 'sporty')",
+  "season": ["array of applicable seasons: 'spring', 'summer', 'fall', 'winter'"],
+  "features": ["array of notable features like 'long sleeve', 'hood', 'pockets', etc."],
+  "brand_or_logo_visible": true or false,
+  "notes": "any additional relevant notes about the item"
+}}
+
+Return ONLY valid JSON, no markdown formatting or additional text."""
+
+    try:
+        content = _vision_request(client, "tag_item", prompt, base64_image, max_tokens=1000)
         
         data = json.loads(content)
         
-        return ItemTags(
+        tags = ItemTags(
             slot=data.get("slot", "other"),
             type=data.get("type", "unknown"),
             color_primary=data.get("color_primary", "unknown"),
@@ -175,6 +264,9 @@ Return ONLY valid JSON, no markdown formatting or additional text."""
             brand_or_logo_visible=data.get("brand_or_logo_visible", False),
             notes=data.get("notes", "")
         )
+        return normalize_tags(merge_local_tags(tags, local))
+    except scheduler.VisionBusy:
+        raise  # Saturated: let the caller answer 429 rather than store placeholder tags
     except Exception as e:
         # Return default tags on error
         print(f"Error analyzing image: {e}")
@@ -193,9 +285,13 @@ Return ONLY valid JSON, no markdown formatting or additional text."""
             notes=f"Error: {str(e)}"
         )
 
-def separate_clothing_items(image_path: str) -> List[dict]:
+def separate_clothing_items(image: ImageInput) -> List[dict]:
     """Analyze a photo of a person/outfit and separate into individual clothing items"""
-    base64_image = encode_image(image_path)
+    client = None if USE_MOCK_MODE else get_client()
+    if client is None:
+        return generate_mock_items(image)
+
+    base64_image = encode_image(image)
     
     prompt = """This image contains a person wearing clothing or multiple clothing items. 
 Analyze the image and identify each distinct article of clothing visible.
@@ -222,41 +318,15 @@ If it's a person wearing an outfit, separate each visible clothing piece (top, b
 Return ONLY valid JSON array, no markdown formatting."""
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=2000,
-        )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
+        content = _vision_request(client, "separate_clothing_items", prompt, base64_image, max_tokens=2000)
         
         items = json.loads(content)
         
         # For now, we'll treat each identified item as needing separate analysis
         # In a more advanced implementation, we could crop images based on bbox estimates
         return items if isinstance(items, list) else []
+    except scheduler.VisionBusy:
+        raise  # Saturated: let the caller answer 429 rather than store placeholder tags
     except Exception as e:
         print(f"Error separating clothing items: {e}")
         return [{
@@ -265,12 +335,22 @@ Return ONLY valid JSON array, no markdown formatting."""
             "bbox_estimate": {"x_min": 0, "y_min": 0, "x_max": 100, "y_max": 100}
         }]
 
-def tag_item_with_context(image_path: str, item_context: dict) -> ItemTags:
-    """Analyze a specific clothing item from an outfit image using context"""
-    base64_image = encode_image(image_path)
+def tag_item_with_context(image: ImageInput, item_context: dict, local: Optional[dict] = None) -> ItemTags:
+    """Analyze a specific clothing item from an outfit image using context.
+
+    local is the caller's analyze_image() result for the garment's box, if it has one.
+    """
+    client = None if USE_MOCK_MODE else get_client()
+    if client is None:
+        return generate_mock_tags(image, item_context, local)
+
+    base64_image = encode_image(image)
     
     description = item_context.get("description", "")
     item_type = item_context.get("item_type", "unknown")
+    # Colors are measured inside the garment's estimated bounding box
+    local = local_analysis(image, item_context.get("bbox_estimate"), local)
+    color_fields = "" if local else COLOR_PROMPT_FIELDS
     
     prompt = f"""This image contains a person wearing clothing or multiple clothing items. 
 Focus specifically on this item: {description} (appears to be: {item_type}).
@@ -279,9 +359,7 @@ Analyze ONLY this specific clothing item and return a JSON object with the follo
 {{
   "slot": "one of: top, bottom, shoes, outerwear, accessory, dress, other",
   "type": "specific type (e.g., 't-shirt', 'jeans', 'sneakers', 'jacket', 'sunglasses')",
-  "color_primary": "main color (e.g., 'black', 'white', 'blue', 'red')",
-  "colors_secondary": ["array of secondary colors if any"],
-  "pattern": "pattern type (e.g., 'solid', 'striped', 'plaid', 'polka dot', 'floral')",
+{color_fields}  "pattern": "pattern type (e.g., 'solid', 'striped', 'plaid', 'polka dot', 'floral')",
   "material": "material (e.g., 'cotton', 'denim', 'leather', 'polyester', 'wool')",
   "fit": "fit style (e.g., 'slim', 'regular', 'loose', 'oversized', 'fitted')",
   "formality": "formality level (e.g., 'casual', 'business casual', 'formal', 'sporty')",
@@ -294,39 +372,11 @@ Analyze ONLY this specific clothing item and return a JSON object with the follo
 Return ONLY valid JSON, no markdown formatting or additional text."""
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=1000,
-        )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
+        content = _vision_request(client, "tag_item_with_context", prompt, base64_image, max_tokens=1000)
         
         data = json.loads(content)
         
-        return ItemTags(
+        tags = ItemTags(
             slot=data.get("slot", "other"),
             type=data.get("type", item_type),
             color_primary=data.get("color_primary", "unknown"),
@@ -340,8 +390,11 @@ Return ONLY valid JSON, no markdown formatting or additional text."""
             brand_or_logo_visible=data.get("brand_or_logo_visible", False),
             notes=data.get("notes", "")
         )
+        return normalize_tags(merge_local_tags(tags, local))
+    except scheduler.VisionBusy:
+        raise  # Saturated: let the caller answer 429 rather than store placeholder tags
     except Exception as e:
         print(f"Error analyzing item with context: {e}")
         # Fallback to regular tagging
-        return tag_item(image_path)
+        return tag_item(image)
 
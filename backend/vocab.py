@@ -0,0 +1,257 @@
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import Integer, SmallInteger, case, cast, inspect, literal_column, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import TypeDecorator
+
+# Canonical tag vocabularies.
+# The vision model answers in free text ("Navy Blue", "navy", "dark blue").
+# Values are normalized onto these lists (via the synonym tables) and stored
+# as small integer codes: the code is the index in the list. Code 0 is the
+# fallback for anything unrecognized.
+#
+# Codes are persisted, so only ever APPEND to these lists.
+
+VOCABULARIES: Dict[str, List[str]] = {
+    "slot": ["other", "top", "bottom", "shoes", "outerwear", "accessory", "dress"],
+    "color": ["unknown", "black", "white", "gray", "navy", "blue", "red", "green",
+              "yellow", "pink", "brown", "beige", "orange", "purple", "multicolor"],
+    "pattern": ["other", "solid", "striped", "plaid", "polka dot", "floral", "geometric",
+                "graphic", "camouflage", "animal print", "paisley", "tie-dye"],
+    "material": ["unknown", "cotton", "denim", "leather", "polyester", "wool", "silk",
+                 "linen", "nylon", "knit", "suede", "canvas", "fleece", "cashmere",
+                 "rubber", "synthetic"],
+    "fit": ["other", "slim", "regular", "loose", "oversized", "fitted", "cropped"],
+    "formality": ["other", "casual", "business casual", "formal", "sporty"],
+}
+
+SYNONYMS: Dict[str, Dict[str, str]] = {
+    "slot": {
+        "shirt": "top", "tops": "top", "t-shirt": "top", "blouse": "top", "sweater": "top",
+        "bottoms": "bottom", "pants": "bottom", "trousers": "bottom", "skirt": "bottom",
+        "shorts": "bottom", "jeans": "bottom", "footwear": "shoes", "shoe": "shoes",
+        "sneakers": "shoes", "boots": "shoes", "jacket": "outerwear", "coat": "outerwear",
+        "accessories": "accessory", "jewelry": "accessory", "bag": "accessory", "hat": "accessory",
+        "dresses": "dress", "gown": "dress", "jumpsuit": "dress",
+    },
+    "color": {
+        "grey": "gray", "charcoal": "gray", "silver": "gray", "slate": "gray",
+        "navy blue": "navy", "dark blue": "navy", "midnight blue": "navy", "indigo": "navy",
+        "light blue": "blue", "sky blue": "blue", "royal blue": "blue", "denim": "blue",
+        "teal": "blue", "turquoise": "blue", "cobalt": "blue", "baby blue": "blue",
+        "maroon": "red", "burgundy": "red", "crimson": "red", "wine": "red", "scarlet": "red",
+        "olive": "green", "khaki green": "green", "mint": "green", "emerald": "green", "sage": "green",
+        "mustard": "yellow", "gold": "yellow", "golden": "yellow",
+        "rose": "pink", "blush": "pink", "magenta": "pink", "fuchsia": "pink", "coral": "pink",
+        "tan": "beige", "khaki": "beige", "cream": "beige", "camel": "beige", "nude": "beige",
+        "ivory": "white", "off white": "white", "off-white": "white",
+        "chocolate": "brown", "coffee": "brown", "rust": "orange", "peach": "orange",
+        "lavender": "purple", "violet": "purple", "lilac": "purple", "plum": "purple",
+        "multi": "multicolor", "multi-color": "multicolor", "multicolored": "multicolor",
+        "rainbow": "multicolor",
+    },
+    "pattern": {
+        "plain": "solid", "none": "solid", "stripes": "striped", "stripe": "striped",
+        "pinstripe": "striped", "checked": "plaid", "checkered": "plaid", "check": "plaid",
+        "tartan": "plaid", "gingham": "plaid", "polka dots": "polka dot", "dotted": "polka dot",
+        "dots": "polka dot", "flowers": "floral", "flower": "floral", "print": "graphic",
+        "printed": "graphic", "logo": "graphic", "text": "graphic", "camo": "camouflage",
+        "leopard": "animal print", "zebra": "animal print", "snakeskin": "animal print",
+        "tie dye": "tie-dye",
+    },
+    "material": {
+        "jean": "denim", "faux leather": "leather", "vegan leather": "leather",
+        "knitted": "knit", "jersey": "knit", "merino": "wool", "acrylic": "synthetic",
+        "spandex": "synthetic", "elastane": "synthetic", "rayon": "synthetic",
+        "viscose": "synthetic", "mesh": "synthetic", "satin": "silk", "chiffon": "polyester",
+        "corduroy": "cotton", "flannel": "cotton", "twill": "cotton", "chambray": "cotton",
+    },
+    "fit": {
+        "skinny": "slim", "tailored": "fitted", "tight": "fitted", "straight": "regular",
+        "standard": "regular", "classic": "regular", "relaxed": "loose", "baggy": "loose",
+        "wide leg": "loose", "boxy": "oversized", "crop": "cropped",
+    },
+    "formality": {
+        "smart casual": "business casual", "semi-formal": "business casual",
+        "semi formal": "business casual", "business": "business casual",
+        "business formal": "formal", "elegant": "formal", "evening": "formal",
+        "black tie": "formal", "dressy": "formal", "athletic": "sporty", "athleisure": "sporty",
+        "sport": "sporty", "sportswear": "sporty", "activewear": "sporty",
+        "streetwear": "casual", "everyday": "casual", "relaxed": "casual",
+    },
+}
+
+_CODES = {kind: {label: code for code, label in enumerate(labels)} for kind, labels in VOCABULARIES.items()}
+
+
+def lookup(kind: str, value: Optional[str]) -> Optional[str]:
+    """Canonical label for value, or None when nothing in it is recognized"""
+    codes, synonyms = _CODES[kind], SYNONYMS[kind]
+    phrase = re.sub(r"[\s_]+", " ", (value or "").strip().lower())
+    if phrase in codes:
+        return phrase
+    if phrase in synonyms:
+        return synonyms[phrase]
+
+    # The last recognizable word ("dark green" -> "green")
+    for word in reversed(re.split(r"[\s/,]+", phrase)):
+        if word in codes:
+            return word
+        if word in synonyms:
+            return synonyms[word]
+    return None
+
+
+def normalize(kind: str, value: Optional[str]) -> str:
+    """Map free-text model output onto the canonical label for kind (unrecognized: the fallback label)
+
+    Only for values that must be stored; filters from users go through lookup()
+    so a typo is rejected instead of matching every fallback-coded item.
+    """
+    return lookup(kind, value) or VOCABULARIES[kind][0]
+
+
+def encode(kind: str, value: Optional[str]) -> int:
+    return _CODES[kind][normalize(kind, value)]
+
+
+def decode(kind: str, code: int) -> str:
+    labels = VOCABULARIES[kind]
+    return labels[code] if 0 <= code < len(labels) else labels[0]
+
+
+def normalize_tags(tags):
+    """Canonicalize the vocabulary-backed fields of an ItemTags"""
+    primary = normalize("color", tags.color_primary)
+    secondary = []
+    for color in tags.colors_secondary:
+        color = normalize("color", color)
+        if color not in (primary, "unknown") and color not in secondary:
+            secondary.append(color)
+
+    return tags.model_copy(update={
+        "slot": normalize("slot", tags.slot),
+        "color_primary": primary,
+        "colors_secondary": secondary,
+        "pattern": normalize("pattern", tags.pattern),
+        "material": normalize("material", tags.material),
+        "fit": normalize("fit", tags.fit),
+        "formality": normalize("formality", tags.formality),
+    })
+
+
+class VocabCode(TypeDecorator):
+    """Column type storing a vocabulary label as its SMALLINT code.
+
+    Python code keeps reading and writing label strings; comparisons such as
+    Item.formality == "Business Casual" are normalized and encoded into an
+    exact-match on the indexed code.
+    """
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, kind: str):
+        super().__init__()
+        self.kind = kind
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return value
+        return encode(self.kind, value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # Databases created before codes keep TEXT affinity on these
+            # columns, so codes read back as digit strings; anything else is
+            # a label that has not been migrated yet
+            return decode(self.kind, int(value)) if value.isdigit() else normalize(self.kind, value)
+        return decode(self.kind, value)
+
+
+# Columns of the items table that hold vocabulary codes
+ITEM_CODE_COLUMNS = {
+    "slot": "slot", "color_primary": "color", "pattern": "pattern",
+    "material": "material", "fit": "fit", "formality": "formality",
+}
+
+
+def init_vocab(engine: Engine):
+    """Sync the vocab_terms lookup table and convert legacy text values in items to codes.
+
+    On SQLite, an items table created before codes keeps TEXT affinity on these
+    columns, which stores each code as text ('2'); such a table is rebuilt with
+    SMALLINT columns so codes are stored as integers. Its indexes and triggers
+    go with the old table, so this runs before the search index and closet
+    statistics (re)create theirs. On PostgreSQL the text columns are converted
+    in place; other databases with text columns are refused.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM vocab_terms"))
+        conn.execute(
+            text("INSERT INTO vocab_terms (kind, code, label) VALUES (:kind, :code, :label)"),
+            [{"kind": kind, "code": code, "label": label}
+             for kind, labels in VOCABULARIES.items() for code, label in enumerate(labels)],
+        )
+        if engine.dialect.name == "sqlite":
+            _convert_sqlite(conn)
+        else:
+            _convert_in_place(conn)
+
+
+def _convert_sqlite(conn):
+    for column, kind in ITEM_CODE_COLUMNS.items():
+        legacy = conn.execute(text(
+            f"SELECT DISTINCT {column} FROM items "
+            f"WHERE typeof({column}) = 'text' AND {column} NOT GLOB '[0-9]*'"
+        )).scalars().all()
+        for value in legacy:
+            conn.execute(
+                text(f"UPDATE items SET {column} = :code WHERE {column} = :value"),
+                {"code": encode(kind, value), "value": value},
+            )
+
+    declared = {row[1]: row[2].upper() for row in conn.execute(text("PRAGMA table_info(items)"))}
+    if any(declared.get(column) != "SMALLINT" for column in ITEM_CODE_COLUMNS):
+        _rebuild_items(conn)
+
+
+def _convert_in_place(conn):
+    """ALTER legacy text columns to SMALLINT, mapping each stored label (or digit string) to its code"""
+    declared = {column["name"]: column["type"] for column in inspect(conn).get_columns("items")}
+    legacy = [column for column in ITEM_CODE_COLUMNS if not isinstance(declared[column], Integer)]
+    if not legacy:
+        return
+    if conn.dialect.name != "postgresql":
+        raise RuntimeError(
+            f"items.{', items.'.join(legacy)} hold text; converting them to vocabulary codes "
+            f"is only implemented for SQLite and PostgreSQL"
+        )
+    for column in legacy:
+        kind = ITEM_CODE_COLUMNS[column]
+        values = conn.execute(text(f"SELECT DISTINCT {column} FROM items WHERE {column} IS NOT NULL")).scalars().all()
+        codes = {value: int(value) if value.isdigit() else encode(kind, value) for value in values}
+        stored = literal_column(column)
+        using = cast(case(codes, value=stored), SmallInteger) if codes else cast(stored, SmallInteger)
+        using = using.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        conn.execute(text(f"ALTER TABLE items ALTER COLUMN {column} TYPE SMALLINT USING {using}"))
+
+
+def _rebuild_items(conn):
+    """Recreate the items table from the model (integer code columns), copying every row"""
+    from .models import Item
+
+    table = Item.__table__
+    for index in table.indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    conn.execute(text("ALTER TABLE items RENAME TO items_legacy"))
+    table.create(conn)
+    columns = [column.name for column in table.columns]
+    values = [f"CAST({name} AS INTEGER)" if name in ITEM_CODE_COLUMNS else name for name in columns]
+    conn.execute(text(f"INSERT INTO items ({', '.join(columns)}) SELECT {', '.join(values)} FROM items_legacy"))
+    conn.execute(text("DROP TABLE items_legacy"))
@@ -1,6 +1,7 @@
 import httpx
 import os
 from typing import Optional, Dict
+from . import metrics
 
 # Using OpenWeatherMap API (free tier available)
 # You can also use other free weather APIs
@@ -26,7 +27,10 @@ def get_weather(location: str = "Los Angeles") -> Dict:
             "appid": WEATHER_API_KEY,
             "units": "imperial"
         }
-        response = httpx.get(WEATHER_API_URL, params=params, timeout=5.0)
+        with metrics.weather_call() as call:
+            response = httpx.get(WEATHER_API_URL, params=params, timeout=5.0)
+            if response.status_code != 200:
+                call.outcome = "error"
         if response.status_code == 200:
             data = response.json()
             return {
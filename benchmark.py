@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the backend hot paths.
+
+Seeds synthetic closets (100, 1k and 10k items per user by default) in a
+throwaway SQLite database and times the request handlers directly, without
+HTTP in between:
+
+  - list_items serialization (all items, one slot, and a 304 revalidation)
+  - generate_outfit with every combination of formality/season/color filters
+  - list_outfits with many saved outfits
+  - get_current_user (token decode + user lookup)
+  - the upload ingest path (ingest.load_image, thumbnail, encode_jpeg) on testphotos/
+  - startup: `import backend.app` in a fresh interpreter, and uvicorn launch
+    to the first successful /healthz response
+
+Results are written as JSON so runs from different commits can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+
+--startup-budget-ms makes the run fail when the median launch-to-first-response
+time is over budget, so it can gate CI:
+
+    python benchmark.py --sizes 100 --startup-budget-ms 1500
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+# The backend reads its configuration at import time
+_workdir = tempfile.mkdtemp(prefix="looklabs-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_workdir}/bench.db"
+os.environ["STORAGE_DIR"] = os.path.join(_workdir, "storage")
+os.environ["USE_MOCK_MODE"] = "true"
+
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from backend import app as api, etags, ingest  # noqa: E402
+from backend.auth import create_access_token, get_current_user  # noqa: E402
+from backend.db import SessionLocal, init_db  # noqa: E402
+from backend.models import Item, Outfit, User  # noqa: E402
+from backend.vocab import VOCABULARIES  # noqa: E402
+
+SEASONS = ["spring", "summer", "fall", "winter"]
+FILTER_VALUES = {"formality": "casual", "season": "summer", "color": "black"}
+
+
+def seed_closet(db, n_items: int, n_outfits: int, rng: random.Random) -> User:
+    """Insert a user with n_items synthetic items and n_outfits saved outfits"""
+    user = User(id=str(uuid.uuid4()), email=None, phone=None, name=f"bench{n_items}",
+                username=f"bench_{n_items}_{uuid.uuid4().hex[:6]}", password_hash="x")
+    db.add(user)
+    db.commit()
+
+    rows = []
+    for _ in range(n_items):
+        item_id = str(uuid.uuid4())
+        rows.append({
+            "id": item_id, "user_id": user.id, "image_url": f"/images/{item_id}.jpg",
+            "slot": rng.choice(VOCABULARIES["slot"][1:]), "type": "synthetic",
+            "color_primary": rng.choice(VOCABULARIES["color"][1:]),
+            "colors_secondary": json.dumps(rng.sample(VOCABULARIES["color"][1:], rng.randint(0, 2))),
+            "pattern": rng.choice(VOCABULARIES["pattern"][1:]),
+            "material": rng.choice(VOCABULARIES["material"][1:]),
+            "fit": rng.choice(VOCABULARIES["fit"][1:]),
+            "formality": rng.choice(VOCABULARIES["formality"][1:]),
+            "season": json.dumps(rng.sample(SEASONS, rng.randint(1, 3))),
+            "features": json.dumps(rng.sample(["long sleeve", "pockets", "hood", "zipper"], rng.randint(0, 2))),
+            "brand_or_logo_visible": rng.randint(0, 1), "notes": "",
+        })
+    for start in range(0, len(rows), 1000):
+        db.execute(insert(Item), rows[start:start + 1000])
+
+    item_ids = [row["id"] for row in rows]
+    db.execute(insert(Outfit), [{
+        "id": str(uuid.uuid4()), "user_id": user.id, "name": None,
+        "items": json.dumps(rng.sample(item_ids, min(4, len(item_ids)))), "filters": None,
+    } for _ in range(n_outfits)])
+    db.commit()
+    return user
+
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    """Run fn repeatedly and summarize wall-clock timings in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+
+def summarize(timings: list) -> dict:
+    """Min/median/p95/mean of timings in milliseconds"""
+    timings = sorted(timings)
+    repeat = len(timings)
+    return {
+        "repeat": repeat,
+        "min_ms": round(timings[0], 4),
+        "median_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+    }
+
+
+def bench_closet(size: int, n_outfits: int, repeat: int, rng: random.Random) -> dict:
+    db = SessionLocal()
+    try:
+        user = seed_closet(db, size, n_outfits, rng)
+        results = {}
+
+        results["list_items"] = measure(lambda: api.list_items(slot=None, if_none_match=None, current_user=user, db=db), repeat)
+        results["list_items[slot=top]"] = measure(
+            lambda: api.list_items(slot="top", if_none_match=None, current_user=user, db=db), repeat)
+        etag = etags.closet_etag(user)
+        results["list_items[not_modified]"] = measure(
+            lambda: api.list_items(slot=None, if_none_match=etag, current_user=user, db=db), repeat)
+
+        for n_filters in range(len(FILTER_VALUES) + 1):
+            for combo in itertools.combinations(FILTER_VALUES, n_filters):
+                filters = {name: FILTER_VALUES[name] if name in combo else None for name in FILTER_VALUES}
+
+                def generate():
+                    try:
+                        api.generate_outfit(**filters, current_user=user, db=db)
+                    except api.HTTPException:
+                        pass  # No matching items is a valid (and timed) outcome
+
+                label = ",".join(combo) or "none"
+                results[f"generate_outfit[{label}]"] = measure(generate, repeat)
+
+        results[f"list_outfits[{n_outfits}]"] = measure(
+            lambda: api.list_outfits(if_none_match=None, current_user=user, db=db), max(3, repeat // 5))
+
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=create_access_token({"sub": user.id}))
+        results["get_current_user"] = measure(lambda: get_current_user(credentials, db), repeat * 5)
+        return results
+    finally:
+        db.close()
+
+
+def bench_ingest(photo_dir: str, repeat: int) -> dict:
+    """Time the upload path itself: ingest.load_image, thumbnail, encode_jpeg"""
+    results = {}
+    for name in sorted(os.listdir(photo_dir)):
+        with open(os.path.join(photo_dir, name), "rb") as f:
+            data = f.read()
+        try:
+            ingest.load_image(io.BytesIO(data))
+        except api.HTTPException:
+            continue  # Codec not available in this Pillow build
+
+        def upload():
+            im = ingest.load_image(io.BytesIO(data))
+            im.thumbnail((1024, 1024))
+            api.encode_jpeg(im)
+
+        results[f"ingest[{name}]"] = measure(upload, repeat)
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def bench_startup(repeat: int) -> dict:
+    """Time a cold `import backend.app` and a cold uvicorn start up to the first /healthz 200"""
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{_workdir}/startup.db", COLLECTOR_INTERVAL_SECONDS="0")
+    import_ms, first_response_ms = [], []
+    for _ in range(repeat):
+        out = subprocess.check_output([
+            sys.executable, "-c",
+            "import time; t = time.perf_counter(); import backend.app; print((time.perf_counter() - t) * 1000)",
+        ], env=env, text=True)
+        import_ms.append(float(out.strip().splitlines()[-1]))
+
+        port = _free_port()
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.app:app", "--port", str(port)],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError("uvicorn exited during startup")
+                if time.perf_counter() - start > 60:
+                    raise RuntimeError("no /healthz response within 60s")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(0.01)
+            first_response_ms.append((time.perf_counter() - start) * 1000)
+        finally:
+            server.terminate()
+            server.wait()
+
+    return {"import_backend_app": summarize(import_ms), "first_response": summarize(first_response_ms)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict):
+    """Print median-time ratios against a previous results file"""
+    print(f"\n{'benchmark':<55} {'before':>10} {'after':>10} {'ratio':>7}")
+    for group, benches in current["results"].items():
+        for name, stats in benches.items():
+            before = baseline.get("results", {}).get(group, {}).get(name)
+            if not before:
+                continue
+            ratio = stats["median_ms"] / before["median_ms"] if before["median_ms"] else float("inf")
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"{group + ' ' + name:<55} {before['median_ms']:>10.3f} {stats['median_ms']:>10.3f} {ratio:>7.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="Closet sizes (items per user)")
+    parser.add_argument("--outfits", type=int, default=200, help="Saved outfits per user")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--photos", default="testphotos")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--startup-repeat", type=int, default=5, help="Cold starts to time (0 skips the startup benchmark)")
+    parser.add_argument("--startup-budget-ms", type=float,
+                        help="Exit non-zero if the median launch-to-first-response time exceeds this")
+    args = parser.parse_args()
+
+    init_db()
+    rng = random.Random(args.seed)
+    results = {}
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(f"closet size {size}...", file=sys.stderr)
+        results[f"closet_{size}"] = bench_closet(size, args.outfits, args.repeat, rng)
+    print("ingest...", file=sys.stderr)
+    results["ingest"] = bench_ingest(args.photos, args.repeat)
+    if args.startup_repeat > 0:
+        print("startup...", file=sys.stderr)
+        results["startup"] = bench_startup(args.startup_repeat)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": args.sizes, "outfits": args.outfits, "repeat": args.repeat, "seed": args.seed},
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+    if args.startup_budget_ms is not None:
+        if "startup" not in results:
+            sys.exit("--startup-budget-ms needs --startup-repeat > 0")
+        took = results["startup"]["first_response"]["median_ms"]
+        if took > args.startup_budget_ms:
+            sys.exit(f"startup budget exceeded: {took:.0f} ms to first response (budget {args.startup_budget_ms:.0f} ms)")
+        print(f"startup within budget: {took:.0f} ms (budget {args.startup_budget_ms:.0f} ms)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -175,6 +175,7 @@ function handleLogout() {
     localStorage.removeItem('user');
     currentToken = null;
     currentUser = null;
+    listCache.clear();
     showAuth();
 }
 
@@ -209,6 +210,25 @@ async function apiCall(endpoint, options = {}) {
     return response;
 }
 
+// Last response (and its ETag) per list endpoint; the server answers 304 while the closet is unchanged
+const listCache = new Map();
+
+async function cachedGet(endpoint) {
+    const cached = listCache.get(endpoint);
+    const response = await apiCall(endpoint, {
+        headers: cached ? { 'If-None-Match': cached.etag } : {}
+    });
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        listCache.set(endpoint, { etag, data });
+    }
+    return data;
+}
+
 // ==================== WEATHER & SEASON ====================
 
 async function loadWeather() {
@@ -292,14 +312,58 @@ function showSeasonColors() {
 
 // ==================== CLOSET ====================
 
+function renderClosetItemCard(item) {
+    // Build hover details text
+    const details = [];
+    if (item.pattern && item.pattern !== 'solid' && item.pattern !== 'unknown') {
+        details.push(item.pattern);
+    }
+    if (item.material && item.material !== 'unknown') {
+        details.push(item.material);
+    }
+    if (item.fit && item.fit !== 'regular' && item.fit !== 'unknown') {
+        details.push(item.fit);
+    }
+    if (item.formality && item.formality !== 'casual' && item.formality !== 'unknown') {
+        details.push(item.formality);
+    }
+    if (item.season && Array.isArray(item.season) && item.season.length > 0) {
+        details.push(item.season.join(', '));
+    }
+    if (item.features && Array.isArray(item.features) && item.features.length > 0) {
+        details.push(item.features.join(', '));
+    }
+    
+    const hoverDetails = details.length > 0 ? details.join(' • ') : '';
+    
+    return `
+    <div class="closet-item-card" data-item-id="${item.id}">
+        <button class="delete-item-btn" onclick="deleteItem('${item.id}', event)" title="Delete item">
+            <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
+                <polyline points="3 6 5 6 21 6"></polyline>
+                <path d="M19 6v14a2 2 0 0 1-2 2H7a2 2 0 0 1-2-2V6m3 0V4a2 2 0 0 1 2-2h4a2 2 0 0 1 2 2v2"></path>
+                <line x1="10" y1="11" x2="10" y2="17"></line>
+                <line x1="14" y1="11" x2="14" y2="17"></line>
+            </svg>
+        </button>
+        <img src="${API_BASE}${item.image_url}" alt="${item.type}">
+        <div class="closet-item-info">
+            <div class="closet-item-type">${item.type}</div>
+            <div class="closet-item-details">${item.slot} • ${item.color_primary}</div>
+            ${hoverDetails ? `<div class="closet-item-hover-details">${hoverDetails}</div>` : ''}
+        </div>
+    </div>
+`;
+}
+
 async function loadCloset() {
     const filterSelect = document.getElementById('closet-filter');
     const filter = filterSelect?.value || '';
     const endpoint = filter ? `/items?slot=${filter}` : '/items';
+    loadClosetStats();
     
     try {
-        const response = await apiCall(endpoint);
-        const items = await response.json();
+        const items = await cachedGet(endpoint);
         
         const grid = document.getElementById('closet-grid');
         const empty = document.getElementById('closet-empty');
@@ -309,55 +373,47 @@ async function loadCloset() {
             empty.style.display = 'block';
         } else {
             empty.style.display = 'none';
-            grid.innerHTML = items.map(item => {
-                // Build hover details text
-                const details = [];
-                if (item.pattern && item.pattern !== 'solid' && item.pattern !== 'unknown') {
-                    details.push(item.pattern);
-                }
-                if (item.material && item.material !== 'unknown') {
-                    details.push(item.material);
-                }
-                if (item.fit && item.fit !== 'regular' && item.fit !== 'unknown') {
-                    details.push(item.fit);
-                }
-                if (item.formality && item.formality !== 'casual' && item.formality !== 'unknown') {
-                    details.push(item.formality);
-                }
-                if (item.season && Array.isArray(item.season) && item.season.length > 0) {
-                    details.push(item.season.join(', '));
-                }
-                if (item.features && Array.isArray(item.features) && item.features.length > 0) {
-                    details.push(item.features.join(', '));
-                }
-                
-                const hoverDetails = details.length > 0 ? details.join(' • ') : '';
-                
-                return `
-                <div class="closet-item-card" data-item-id="${item.id}">
-                    <button class="delete-item-btn" onclick="deleteItem('${item.id}', event)" title="Delete item">
-                        <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-                            <polyline points="3 6 5 6 21 6"></polyline>
-                            <path d="M19 6v14a2 2 0 0 1-2 2H7a2 2 0 0 1-2-2V6m3 0V4a2 2 0 0 1 2-2h4a2 2 0 0 1 2 2v2"></path>
-                            <line x1="10" y1="11" x2="10" y2="17"></line>
-                            <line x1="14" y1="11" x2="14" y2="17"></line>
-                        </svg>
-                    </button>
-                    <img src="${API_BASE}${item.image_url}" alt="${item.type}">
-                    <div class="closet-item-info">
-                        <div class="closet-item-type">${item.type}</div>
-                        <div class="closet-item-details">${item.slot} • ${item.color_primary}</div>
-                        ${hoverDetails ? `<div class="closet-item-hover-details">${hoverDetails}</div>` : ''}
-                    </div>
-                </div>
-            `;
-            }).join('');
+            grid.innerHTML = items.map(renderClosetItemCard).join('');
         }
     } catch (error) {
         console.error('Error loading closet:', error);
     }
 }
 
+// Item counts per slot, color, formality and season; empty filter options are disabled
+async function loadClosetStats() {
+    try {
+        const stats = await cachedGet('/closet/stats');
+        if (!stats.slot) return;
+        
+        document.querySelectorAll('.category-btn').forEach(btn => {
+            const slot = btn.dataset.filter;
+            btn.disabled = slot !== '' && !stats.slot[slot] && !btn.classList.contains('active');
+        });
+        applyFacetCounts('discover-formality', stats.formality);
+        applyFacetCounts('discover-season', stats.season);
+        applyFacetCounts('discover-color', stats.color);
+    } catch (error) {
+        console.error('Error loading closet stats:', error);
+    }
+}
+
+function applyFacetCounts(selectId, counts) {
+    const select = document.getElementById(selectId);
+    if (!select) return;
+    
+    for (const option of select.options) {
+        if (!option.value) continue;
+        if (!option.dataset.label) option.dataset.label = option.textContent;
+        const count = counts[option.value] || 0;
+        option.textContent = `${option.dataset.label} (${count})`;
+        option.disabled = count === 0;
+    }
+    if (select.selectedOptions[0]?.disabled) {
+        select.value = '';
+    }
+}
+
 async function deleteItem(itemId, event) {
     event.stopPropagation(); // Prevent card click events
     
@@ -392,6 +448,8 @@ function openCameraModal() {
 function closeCameraModal() {
     document.getElementById('camera-modal').style.display = 'none';
     document.getElementById('upload-progress').style.display = 'none';
+    document.getElementById('upload-status').textContent = 'Analyzing clothing items with AI...';
+    document.getElementById('upload-results').innerHTML = '';
 }
 
 function setupFileHandlers() {
@@ -404,7 +462,7 @@ function setupFileHandlers() {
     });
 }
 
-async function handleFileUpload(event, type) {
+async function handleFileUpload(event, type, allowDuplicate = false) {
     const file = event.target.files[0];
     if (!file) return;
     
@@ -414,13 +472,34 @@ async function handleFileUpload(event, type) {
     const progress = document.getElementById('upload-progress');
     progress.style.display = 'block';
     
+    if (type === 'outfit') {
+        await uploadOutfitStream(formData);
+        return;
+    }
+    
     try {
-        const endpoint = type === 'single' ? '/items' : '/items/outfit';
+        let endpoint = type === 'single' ? '/items' : '/items/outfit';
+        if (allowDuplicate) endpoint += '?allow_duplicate=true';
         const response = await apiCall(endpoint, {
             method: 'POST',
             body: formData
         });
         
+        if (response.status === 409) {
+            // Server thinks this garment is already in the closet
+            const error = await response.json();
+            progress.style.display = 'none';
+            if (confirm(`${error.detail.message} Upload it anyway?`)) {
+                await handleFileUpload(event, type, true);
+            }
+            return;
+        }
+        
+        if (response.status === 429) {
+            const error = await response.json();
+            throw new Error(busyMessage(error.detail));
+        }
+        
         if (!response.ok) {
             // Try to get error message from response
             let errorMessage = 'Upload failed';
@@ -452,6 +531,88 @@ async function handleFileUpload(event, type) {
     }
 }
 
+// Image analysis is saturated: the server says where we are in line and when to retry
+function busyMessage(info) {
+    return `${info.message} You are number ${info.queue_position} in line; try again in about ${info.retry_after} seconds.`;
+}
+
+// Parse a text/event-stream response body, calling onEvent(name, data) per event
+async function readServerEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let name = 'message';
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event:')) name = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            }
+            onEvent(name, data ? JSON.parse(data) : null);
+        }
+    }
+}
+
+// Outfit photos stream each garment as soon as it is tagged instead of waiting for all of them
+async function uploadOutfitStream(formData) {
+    const progress = document.getElementById('upload-progress');
+    const status = document.getElementById('upload-status');
+    const results = document.getElementById('upload-results');
+    results.innerHTML = '';
+    status.textContent = 'Finding clothing items...';
+    
+    let total = 0;
+    let received = 0;
+    let finished = null;
+    try {
+        const response = await apiCall('/items/outfit/stream', {
+            method: 'POST',
+            body: formData
+        });
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            if (response.status === 429) throw new Error(busyMessage(error.detail));
+            throw new Error(error.detail || `${response.status} ${response.statusText}`);
+        }
+        
+        await readServerEvents(response, (name, data) => {
+            if (name === 'separated') {
+                total = data.total;
+                status.textContent = `Found ${total} items. Tagging...`;
+            } else if (name === 'item') {
+                received++;
+                results.insertAdjacentHTML('beforeend', renderClosetItemCard(data));
+                status.textContent = `Tagged ${received} of ${total} items...`;
+            } else if (name === 'error' && data.index === undefined) {
+                throw new Error(data.retry_after ? busyMessage(data) : data.detail);
+            } else if (name === 'done') {
+                finished = data;
+            }
+        });
+        if (!finished) {
+            throw new Error('Connection lost before all items were tagged');
+        }
+        
+        progress.style.display = 'none';
+        closeCameraModal();
+        loadCloset();
+        const failed = finished.failed ? ` (${finished.failed} could not be tagged)` : '';
+        alert(`${finished.total} items added successfully!${failed}`);
+    } catch (error) {
+        progress.style.display = 'none';
+        console.error('Upload error:', error);
+        if (received > 0) loadCloset();
+        alert(`Upload failed: ${error.message}`);
+    }
+}
+
 // ==================== NAVBAR ====================
 
 function setupNavbar() {
@@ -550,6 +711,7 @@ function toggleRandomFilter() {
 
 function showDiscoverPage() {
     document.getElementById('discover-modal').style.display = 'flex';
+    loadClosetStats();
 }
 
 function closeDiscoverPage() {
@@ -735,8 +897,7 @@ async function saveOutfit() {
 
 async function loadOutfits() {
     try {
-        const response = await apiCall('/outfits');
-        const outfits = await response.json();
+        const outfits = await cachedGet('/outfits');
         
         const list = document.getElementById('outfits-list');
         const empty = document.getElementById('outfits-empty');
@@ -865,3 +1026,44 @@ function loadProfile() {
         document.getElementById('profile-photo').src = 'data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" width="120" height="120"><circle cx="60" cy="60" r="60" fill="%23E0E0E0"/><text x="60" y="80" font-size="40" text-anchor="middle" fill="%23999">👤</text></svg>';
     }
 }
+
+async function exportCloset() {
+    try {
+        const response = await apiCall('/export');
+        if (!response.ok) {
+            throw new Error(`${response.status} ${response.statusText}`);
+        }
+        const blob = await response.blob();
+        const match = /filename="([^"]+)"/.exec(response.headers.get('content-disposition') || '');
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(blob);
+        link.download = match ? match[1] : 'looklabs-closet.zip';
+        link.click();
+        URL.revokeObjectURL(link.href);
+    } catch (error) {
+        alert(`Export failed: ${error.message}`);
+    }
+}
+
+async function importCloset(event) {
+    const file = event.target.files[0];
+    event.target.value = '';
+    if (!file) return;
+
+    const formData = new FormData();
+    formData.append('file', file);
+    try {
+        const response = await apiCall('/import', {
+            method: 'POST',
+            body: formData
+        });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.detail || `${response.status} ${response.statusText}`);
+        }
+        loadCloset();
+        alert(`Imported ${result.items_imported} items and ${result.outfits_imported} outfits.`);
+    } catch (error) {
+        alert(`Import failed: ${error.message}`);
+    }
+}
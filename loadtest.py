@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""End-to-end load test for a running LookLabs server.
+
+Each virtual user signs up, then loops over a weighted mix of requests
+(upload, outfit upload, list, generate, save) until the duration is over.
+Prints throughput and p50/p95/p99 latency per operation, and optionally
+writes the same numbers as JSON.
+
+Run the server against the local vision stand-in so no API money is spent:
+
+    python mock_openai_server.py --port 9000 --latency-ms 1500 &
+    OPENAI_BASE_URL=http://localhost:9000/v1 VISION_RPM=0 VISION_TPM=0 uvicorn backend.app:app --port 8000 &
+    python loadtest.py --users 20 --duration 60 --mix upload=1,list=6,generate=4,save=1
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+PHOTO_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.webp")
+DEFAULT_MIX = "upload=1,outfit=0.2,list=6,generate=4,save=1"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, op: str, seconds: float, status: int):
+        self.latencies[op].append(seconds)
+        self.statuses[op][status] += 1
+        if status >= 400:
+            self.errors[op] += 1
+
+    def report(self, elapsed: float) -> dict:
+        ops = {}
+        for op, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            ops[op] = {
+                "count": len(values),
+                "errors": self.errors[op],
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(values[-1] * 1000, 1),
+                "statuses": dict(self.statuses[op]),
+            }
+        total = sum(op["count"] for op in ops.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": total,
+                "throughput_rps": round(total / elapsed, 2), "operations": ops}
+
+
+async def timed(stats: Stats, op: str, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+        status = response.status_code
+    except httpx.HTTPError:
+        response, status = None, 599
+    stats.record(op, time.perf_counter() - start, status)
+    return response
+
+
+async def virtual_user(client: httpx.AsyncClient, stats: Stats, mix: Dict[str, float],
+                       photos: List[str], deadline: float, rng: random.Random):
+    name = f"load_{uuid.uuid4().hex[:10]}"
+    response = await timed(stats, "signup", client.post("/auth/signup", data={
+        "email": f"{name}@example.com", "name": name, "username": name, "password": "loadtest",
+    }))
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    last_outfit = None
+    ops, weights = list(mix), list(mix.values())
+
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, weights)[0]
+        if op in ("upload", "outfit"):
+            path = rng.choice(photos)
+            with open(path, "rb") as f:
+                files = {"file": (os.path.basename(path), f.read())}
+            endpoint = "/items" if op == "upload" else "/items/outfit"
+            await timed(stats, op, client.post(endpoint, files=files, headers=headers,
+                                               params={"allow_duplicate": "true"}))
+        elif op == "list":
+            await timed(stats, op, client.get("/items", headers=headers))
+        elif op == "generate":
+            response = await timed(stats, op, client.get("/outfits/generate", headers=headers))
+            if response is not None and response.status_code == 200:
+                last_outfit = [item["id"] for item in response.json()["outfit"].values()]
+        elif op == "save" and last_outfit:
+            await timed(stats, op, client.post("/outfits/save", headers=headers,
+                                               json={"items": last_outfit, "filters": None}))
+        elif op == "outfits":
+            await timed(stats, op, client.get("/outfits", headers=headers))
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        mix[op.strip()] = float(weight or 1)
+    return {op: weight for op, weight in mix.items() if weight > 0}
+
+
+async def run(args) -> dict:
+    photos = sorted(p for pattern in PHOTO_PATTERNS for p in glob.glob(os.path.join(args.photos, pattern)))
+    if not photos:
+        raise SystemExit(f"No photos found in {args.photos}")
+
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            virtual_user(client, stats, parse_mix(args.mix), photos, deadline, random.Random(args.seed + i))
+            for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - start
+    return stats.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="Weighted operations: upload, outfit, list, generate, save, outfits")
+    parser.add_argument("--photos", default="testphotos")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    print(f"{'operation':<10} {'count':>7} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for op, row in report["operations"].items():
+        print(f"{op:<10} {row['count']:>7} {row['errors']:>7} {row['throughput_rps']:>8} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+    print(f"total: {report['requests']} requests in {report['elapsed_s']}s ({report['throughput_rps']} req/s)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
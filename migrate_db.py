@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+"""Create or upgrade the database schema (tables, added columns, indexes,
+search index, vocabulary table).
+
+The app does this on startup unless RUN_MIGRATIONS_ON_STARTUP=false; run this
+once per deploy instead when many workers start at the same time.
+"""
+from backend.db import init_db
+
+if __name__ == "__main__":
+    init_db()
+    print("✓ Database schema is up to date")
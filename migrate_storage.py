@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Move flat STORAGE_DIR images into content-addressed storage.
+
+Each item image and profile photo stored as STORAGE_DIR/<name>.jpg is copied
+to STORAGE_DIR/<sha[0:2]>/<sha[2:4]>/<sha>.jpg, its row is pointed at
+/images/<sha>.jpg and the blob's reference count is recorded. Identical files
+collapse into one blob. Old files are removed once their rows are committed.
+
+    python migrate_storage.py              # migrate
+    python migrate_storage.py --dry-run    # report only
+    python migrate_storage.py --prune      # also delete flat files no row references (outfit_*.jpg)
+"""
+import argparse
+import os
+
+from backend import etags, storage
+from backend.db import SessionLocal, init_db
+from backend.models import Item, User
+
+BATCH_SIZE = 500
+
+
+def migrate_rows(db, rows, attr: str, dry_run: bool) -> dict:
+    """Convert rows whose image URL (attr) points at a flat file; returns counters"""
+    counts = {"migrated": 0, "missing": 0, "already": 0}
+    done_files = []
+    for i, row in enumerate(rows, 1):
+        url = getattr(row, attr)
+        if not url:
+            continue
+        if storage.key_from_url(url):
+            counts["already"] += 1
+            continue
+        legacy_path = os.path.join(storage.STORAGE_DIR, os.path.basename(url))
+        if not os.path.isfile(legacy_path):
+            counts["missing"] += 1
+            print(f"  missing file for {url}")
+            continue
+        counts["migrated"] += 1
+        if dry_run:
+            continue
+        with open(legacy_path, "rb") as f:
+            key = storage.put(db, f.read())
+        setattr(row, attr, storage.image_url(key))
+        if attr == "image_url":
+            etags.bump(db, row.user_id)  # Cached item lists now hold stale URLs
+        done_files.append(legacy_path)
+
+        if i % BATCH_SIZE == 0:
+            db.commit()
+            remove_files(done_files)
+            done_files = []
+    if not dry_run:
+        db.commit()
+        remove_files(done_files)
+    return counts
+
+
+def remove_files(paths):
+    for path in set(paths):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be migrated without changing anything")
+    parser.add_argument("--prune", action="store_true", help="Delete flat files that no row references")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        items = migrate_rows(db, db.query(Item).all(), "image_url", args.dry_run)
+        print(f"✓ Items: {items}")
+        users = migrate_rows(db, db.query(User).filter(User.profile_photo_url.isnot(None)).all(),
+                             "profile_photo_url", args.dry_run)
+        print(f"✓ Profile photos: {users}")
+
+        referenced = {os.path.basename(url) for (url,) in db.query(Item.image_url)}
+        referenced |= {os.path.basename(url) for (url,) in db.query(User.profile_photo_url) if url}
+        leftovers = [name for name in os.listdir(storage.STORAGE_DIR)
+                     if name.endswith(".jpg") and name not in referenced
+                     and os.path.isfile(os.path.join(storage.STORAGE_DIR, name))]
+        if args.prune and not args.dry_run:
+            remove_files(os.path.join(storage.STORAGE_DIR, name) for name in leftovers)
+            print(f"✓ Pruned {len(leftovers)} unreferenced flat files")
+        elif leftovers:
+            print(f"{len(leftovers)} unreferenced flat files left (run with --prune to delete them)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
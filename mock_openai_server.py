@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Local OpenAI-compatible stand-in for load testing the vision calls.
+
+Serves POST /v1/chat/completions with deterministic, seeded answers shaped
+like real tagging/separation responses, after a configurable latency and with
+configurable error rates. Point the app at it with:
+
+    python mock_openai_server.py --port 9000 --latency-ms 1500
+    OPENAI_BASE_URL=http://localhost:9000/v1 uvicorn backend.app:app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from backend.vocab import VOCABULARIES
+
+TYPES_BY_SLOT = {
+    "top": ["t-shirt", "shirt", "blouse", "sweater", "hoodie"],
+    "bottom": ["jeans", "pants", "shorts", "skirt"],
+    "shoes": ["sneakers", "boots", "sandals", "loafers"],
+    "outerwear": ["jacket", "coat", "blazer"],
+    "accessory": ["sunglasses", "hat", "bag", "watch"],
+    "dress": ["dress"],
+}
+SEASONS = ["spring", "summer", "fall", "winter"]
+FEATURES = ["long sleeve", "short sleeve", "pockets", "hood", "zipper", "buttons", "collar"]
+IMAGE_TOKENS = 765  # Roughly what a 1024px image costs at high detail
+
+app = FastAPI(title="LookLabs vision stand-in")
+config = argparse.Namespace(seed=0, latency_dist="lognormal", latency_ms=0.0,
+                            latency_sigma=0.5, error_rate=0.0, rate_limit_rate=0.0)
+# Latency/error draws come from one seeded stream so runs are repeatable
+_chaos = random.Random(0)
+
+
+def sample_latency() -> float:
+    """Seconds to wait before answering, drawn from the configured distribution"""
+    mean = config.latency_ms / 1000
+    if mean <= 0:
+        return 0.0
+    if config.latency_dist == "fixed":
+        return mean
+    if config.latency_dist == "uniform":
+        return _chaos.uniform(0, 2 * mean)
+    # lognormal with the requested mean
+    sigma = config.latency_sigma
+    return _chaos.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+
+def tag_response(rng: random.Random, item_type_hint: str) -> dict:
+    slot = next((s for s, types in TYPES_BY_SLOT.items()
+                 if s.rstrip("s") in item_type_hint or any(t.split("-")[-1] in item_type_hint for t in types)), None)
+    slot = slot or rng.choice(list(TYPES_BY_SLOT))
+    return {
+        "slot": slot,
+        "type": rng.choice(TYPES_BY_SLOT[slot]),
+        "color_primary": rng.choice(VOCABULARIES["color"][1:]),
+        "colors_secondary": rng.sample(VOCABULARIES["color"][1:], rng.randint(0, 2)),
+        "pattern": rng.choice(VOCABULARIES["pattern"][1:]),
+        "material": rng.choice(VOCABULARIES["material"][1:]),
+        "fit": rng.choice(VOCABULARIES["fit"][1:]),
+        "formality": rng.choice(VOCABULARIES["formality"][1:]),
+        "season": sorted(rng.sample(SEASONS, rng.randint(1, 3)), key=SEASONS.index),
+        "features": rng.sample(FEATURES, rng.randint(0, 3)),
+        "brand_or_logo_visible": rng.random() > 0.7,
+        "notes": "[STAND-IN] deterministic response from mock_openai_server.py",
+    }
+
+
+def separation_response(rng: random.Random) -> list:
+    items = [
+        {"description": "top worn by the person", "item_type": rng.choice(TYPES_BY_SLOT["top"]),
+         "bbox_estimate": {"x_min": 20, "y_min": 15, "x_max": 80, "y_max": 50}},
+        {"description": "bottom worn by the person", "item_type": rng.choice(TYPES_BY_SLOT["bottom"]),
+         "bbox_estimate": {"x_min": 25, "y_min": 45, "x_max": 75, "y_max": 85}},
+    ]
+    if rng.random() > 0.3:
+        items.append({"description": "shoes", "item_type": rng.choice(TYPES_BY_SLOT["shoes"]),
+                      "bbox_estimate": {"x_min": 25, "y_min": 85, "x_max": 75, "y_max": 100}})
+    return items
+
+
+def error(status: int, kind: str, message: str, headers: dict = None) -> JSONResponse:
+    return JSONResponse(status_code=status, headers=headers,
+                        content={"error": {"message": message, "type": kind, "code": None}})
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(sample_latency())
+
+    roll = _chaos.random()
+    if roll < config.rate_limit_rate:
+        return error(429, "rate_limit_error", "Rate limit reached (stand-in)", {"retry-after": "1"})
+    if roll < config.rate_limit_rate + config.error_rate:
+        return error(500, "server_error", "Injected failure (stand-in)")
+
+    # Same prompt + image + seed always gives the same answer
+    prompt, images = "", []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            if part.get("type") == "text":
+                prompt += part["text"]
+            elif part.get("type") == "image_url":
+                images.append(part["image_url"]["url"])
+    digest = hashlib.sha256(f"{config.seed}|{prompt}|{'|'.join(images)}".encode()).hexdigest()
+    rng = random.Random(digest)
+
+    if "JSON array" in prompt:
+        answer = separation_response(rng)
+    else:
+        hint = re.search(r"appears to be: ([^)]*)\)", prompt)
+        answer = tag_response(rng, hint.group(1).lower() if hint else "")
+    content = json.dumps(answer)
+
+    prompt_tokens = len(prompt) // 4 + IMAGE_TOKENS * len(images)
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@app.get("/healthz")
+def health():
+    return {"ok": True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--seed", type=int, default=0, help="Seed for responses, latency and errors")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Shape of the lognormal distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    args = parser.parse_args()
+
+    global _chaos
+    vars(config).update(vars(args))
+    _chaos = random.Random(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Re-tag existing closet items with the current vision prompts.
+
+Selects items by predicate (any of them may match), re-runs the vision call
+for each, and writes the new tags back in batches:
+
+    python retag.py --errors                 # tagging failed ("Error: ..." notes)
+    python retag.py --mock                   # tagged in mock mode or by the stand-in server
+    python retag.py --stale                  # tagged before the current PROMPT_VERSION
+    python retag.py --older-than 2 --user alice --concurrency 8
+    python retag.py --errors --dry-run       # count matches only
+    python retag.py --resume                 # continue an interrupted run
+
+Progress is checkpointed after every batch (the last item id done, counters
+and token usage), so --resume picks up where a crashed run stopped. The script
+has its own vision scheduler, separate from the web workers': it neither sees
+their queues nor shares their buckets. So it runs on a reduced budget
+(--rpm/--tpm, by default a quarter of VISION_RPM and VISION_TPM), and the
+workers' limits should leave that share of the account free. Items that fail
+again keep their current tags. Items with their own image get fresh colors
+from the local analysis (and a new color histogram for similar-item search).
+Garments cut from an outfit photo share its image, so they are re-tagged with
+their current type as context and keep their colors (measured inside the
+garment at upload); garments whose type is unknown are skipped.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import bindparam, func, or_, update
+
+from backend import decks, etags, scheduler, similarity, storage, vision
+from backend.analyzer import analyze_image
+from backend.db import SessionLocal, init_db
+from backend.models import Item, User
+
+ERROR_PREFIX = "Error:"
+MOCK_PREFIXES = ("[MOCK MODE]", "[STAND-IN]")
+TAG_FIELDS = ("slot", "type", "color_primary", "colors_secondary", "pattern", "material", "fit",
+              "formality", "season", "features", "brand_or_logo_visible", "notes")
+# Share of the account's limits (VISION_RPM, VISION_TPM) the script takes by default
+DEFAULT_SHARE = 0.25
+# gpt-4o list prices, USD per million tokens
+INPUT_PRICE = 2.50
+OUTPUT_PRICE = 10.00
+
+
+def selection_filter(selection: dict):
+    """SQL condition for the items a run re-tags"""
+    conditions = []
+    if selection["errors"]:
+        conditions.append(Item.notes.like(f"{ERROR_PREFIX}%"))
+    if selection["mock"]:
+        conditions.extend(Item.notes.like(f"{prefix}%") for prefix in MOCK_PREFIXES)
+    if selection["older_than"] is not None:
+        conditions.append(or_(Item.prompt_version.is_(None), Item.prompt_version < selection["older_than"]))
+    condition = or_(*conditions)
+    if selection["user_id"]:
+        condition = condition & (Item.user_id == selection["user_id"])
+    return condition
+
+
+def load_checkpoint(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(path: str, state: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def snapshot(item: Item) -> dict:
+    """What a worker thread needs from a row (rows stay with the session's thread)"""
+    return {
+        "id": item.id, "user_id": item.user_id, "image_url": item.image_url,
+        "slot": item.slot, "type": item.type, "color_primary": item.color_primary,
+        "colors_secondary": json.loads(item.colors_secondary), "color_hist": item.color_hist,
+    }
+
+
+def retag_one(item: dict, garment: bool):
+    """(outcome, new tags or None, color histogram) for one item; runs in a worker thread"""
+    scheduler.set_principal(item["user_id"], scheduler.BATCH)
+    chunks = storage.iter_image(item["image_url"])
+    if chunks is None:
+        return "missing", None, None
+    data = b"".join(chunks)
+    # Garments keep the colors measured inside their box at upload
+    local = None if garment else analyze_image(data)
+    while True:
+        try:
+            if garment:
+                context = {"description": f"the {item['type']} ({item['slot']})", "item_type": item["type"]}
+                tags = vision.tag_item_with_context(data, context)
+            else:
+                tags = vision.tag_item(data, local)
+            break
+        except scheduler.VisionBusy as e:
+            time.sleep(e.retry_after)  # Our own queue is full; wait for the calls ahead
+    if tags.notes.startswith(ERROR_PREFIX):
+        return "failed", None, None
+    if garment:
+        tags = tags.model_copy(update={"color_primary": item["color_primary"],
+                                       "colors_secondary": item["colors_secondary"]})
+        return "retagged", tags, item["color_hist"]
+    return "retagged", tags, similarity.color_histogram(local and local["color_shares"])
+
+
+def garment_images(db, items) -> set:
+    """(user id, image URL) pairs that more than one of the user's items share"""
+    urls = list({item.image_url for item in items})
+    rows = (db.query(Item.user_id, Item.image_url)
+            .filter(Item.image_url.in_(urls))
+            .group_by(Item.user_id, Item.image_url)
+            .having(func.count(Item.id) > 1))
+    return {(user_id, url) for user_id, url in rows}
+
+
+def apply_batch(db, results) -> int:
+    """Write re-tagged rows in one UPDATE and refresh the indexes; returns rows written"""
+    if not results:
+        return 0
+    params, by_user = [], defaultdict(list)
+    for item, tags, color_hist in results:
+        values = {
+            **tags.model_dump(include=set(TAG_FIELDS)),
+            "colors_secondary": json.dumps(tags.colors_secondary),
+            "season": json.dumps(tags.season), "features": json.dumps(tags.features),
+            "brand_or_logo_visible": 1 if tags.brand_or_logo_visible else 0,
+            "color_hist": color_hist,
+            "prompt_version": vision.PROMPT_VERSION,
+        }
+        params.append({"item_id": item["id"], **values})
+        by_user[item["user_id"]].append(Item(id=item["id"], user_id=item["user_id"], image_url=item["image_url"],
+                                             **values))
+    table = Item.__table__
+    db.execute(update(table).where(table.c.id == bindparam("item_id")), params)
+    etags.bump_many(db, by_user)
+    db.commit()
+    for user_id, rows in by_user.items():
+        similarity.refresh_items(user_id, rows)
+        decks.update_items(user_id, rows)
+    return len(params)
+
+
+def share(limit: int) -> int:
+    """The script's default part of an account limit (0, no limit, stays 0)"""
+    return max(1, int(limit * DEFAULT_SHARE)) if limit else 0
+
+
+def usage_report(usage: dict, input_price: float, output_price: float) -> str:
+    cost = (usage["prompt_tokens"] * input_price + usage["completion_tokens"] * output_price) / 1_000_000
+    tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+    return f"{usage['calls']} calls, {tokens} tokens, ~${cost:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--errors", action="store_true", help="Items whose tagging failed")
+    parser.add_argument("--mock", action="store_true", help="Items with mock or stand-in tags")
+    parser.add_argument("--stale", action="store_true", help=f"Items tagged before PROMPT_VERSION {vision.PROMPT_VERSION}")
+    parser.add_argument("--older-than", type=int, help="Items tagged with a prompt version below this (or unknown)")
+    parser.add_argument("--user", help="Only this username's items")
+    parser.add_argument("--limit", type=int, help="Stop after this many items (resume later for the rest)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Vision calls in flight at once (default 4)")
+    parser.add_argument("--rpm", type=int, default=share(scheduler.VISION_RPM),
+                        help="Requests per minute for this run (default a quarter of VISION_RPM; 0 = no limit)")
+    parser.add_argument("--tpm", type=int, default=share(scheduler.VISION_TPM),
+                        help="Tokens per minute for this run (default a quarter of VISION_TPM; 0 = no limit)")
+    parser.add_argument("--batch-size", type=int, default=50, help="Items per UPDATE and checkpoint (default 50)")
+    parser.add_argument("--checkpoint", default="retag.checkpoint.json", help="Progress file (default retag.checkpoint.json)")
+    parser.add_argument("--resume", action="store_true", help="Continue the run recorded in the checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="Count matching items without calling the API")
+    parser.add_argument("--input-price", type=float, default=INPUT_PRICE, help="USD per million prompt tokens")
+    parser.add_argument("--output-price", type=float, default=OUTPUT_PRICE, help="USD per million completion tokens")
+    args = parser.parse_args()
+    prices = (args.input_price, args.output_price)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.resume:
+            state = load_checkpoint(args.checkpoint)
+            if state is None:
+                sys.exit(f"✗ No checkpoint at {args.checkpoint}")
+            print(f"Resuming after item {state['cursor']} ({state['counts']['processed']} done)")
+        else:
+            user_id = None
+            if args.user:
+                user = db.query(User).filter(User.username == args.user).first()
+                if user is None:
+                    sys.exit(f"✗ No user named {args.user}")
+                user_id = user.id
+            older_than = vision.PROMPT_VERSION if args.stale else args.older_than
+            if not (args.errors or args.mock or older_than is not None):
+                parser.error("choose what to re-tag: --errors, --mock, --stale or --older-than")
+            state = {
+                "selection": {"errors": args.errors, "mock": args.mock, "older_than": older_than, "user_id": user_id},
+                "cursor": "", "elapsed": 0.0,
+                "counts": {"processed": 0, "retagged": 0, "failed": 0, "skipped": 0, "missing": 0},
+                "usage": {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0},
+            }
+        condition = selection_filter(state["selection"])
+
+        if args.dry_run:
+            remaining = db.query(func.count(Item.id)).filter(condition, Item.id > state["cursor"]).scalar()
+            print(f"{remaining} items to re-tag")
+            return
+        if vision.USE_MOCK_MODE or vision.get_client() is None:
+            sys.exit("✗ Re-tagging needs the vision API (set OPENAI_API_KEY or OPENAI_BASE_URL, not USE_MOCK_MODE)")
+
+        scheduler.set_limits(args.rpm, args.tpm)
+        print(f"Budget: {args.rpm or 'unlimited'} requests/min, {args.tpm or 'unlimited'} tokens/min")
+        counts, base_usage = state["counts"], state["usage"]
+        started, base_elapsed = time.monotonic(), state["elapsed"]
+        done, finished = 0, False
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="retag") as executor:
+            while args.limit is None or done < args.limit:
+                size = args.batch_size if args.limit is None else min(args.batch_size, args.limit - done)
+                rows = (db.query(Item).filter(condition, Item.id > state["cursor"])
+                        .order_by(Item.id).limit(size).all())
+                if not rows:
+                    finished = True
+                    break
+                shared = garment_images(db, rows)
+                items = [(snapshot(row), (row.user_id, row.image_url) in shared) for row in rows]
+                db.rollback()  # Don't hold a read transaction open during the vision calls
+
+                todo = [(item, garment) for item, garment in items if not (garment and item["type"] == "unknown")]
+                counts["skipped"] += len(items) - len(todo)
+                results = []
+                for (item, _), (outcome, tags, color_hist) in zip(todo, executor.map(lambda job: retag_one(*job), todo)):
+                    counts[outcome] += 1
+                    if tags is not None:
+                        results.append((item, tags, color_hist))
+                apply_batch(db, results)
+
+                counts["processed"] += len(items)
+                done += len(items)
+                state["cursor"] = items[-1][0]["id"]
+                usage = scheduler.usage_totals()
+                state["usage"] = {key: base_usage[key] + usage[key] for key in base_usage}
+                state["elapsed"] = base_elapsed + time.monotonic() - started
+                save_checkpoint(args.checkpoint, state)
+                rate = counts["processed"] / state["elapsed"] if state["elapsed"] else 0.0
+                print(f"  {counts['processed']} items ({rate:.1f}/s), {usage_report(state['usage'], *prices)}")
+    finally:
+        db.close()
+
+    print(f"✓ {counts}")
+    print(f"✓ {usage_report(state['usage'], *prices)} in {state['elapsed']:.1f}s")
+    if finished and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    elif not finished:
+        print(f"Stopped at --limit; run with --resume to continue (checkpoint: {args.checkpoint})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# Point the app at throwaway state before any backend module reads its settings
+_tmp = tempfile.mkdtemp(prefix="looklabs-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/closet.db")
+os.environ.setdefault("STORAGE_DIR", os.path.join(_tmp, "storage"))
+os.environ.setdefault("USE_MOCK_MODE", "true")
+os.environ.pop("OPENAI_API_KEY", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db():
+    from backend.db import SessionLocal, init_db
+    init_db()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def make_user(db):
+    """Factory for committed users"""
+    from backend.models import User
+
+    def make():
+        user = User(id=str(uuid.uuid4()), name="t", username=uuid.uuid4().hex, password_hash="x")
+        db.add(user)
+        db.commit()
+        return user
+    return make
+
+
+@pytest.fixture
+def make_item(db):
+    """Factory for committed items; tags default to a plain black casual garment"""
+    from backend.models import Item
+
+    def make(user_id, slot="top", **tags):
+        values = dict(image_url="/images/x.jpg", type=slot, color_primary="black", colors_secondary="[]",
+                      pattern="solid", material="cotton", fit="regular", formality="casual",
+                      season='["summer"]', features="[]", brand_or_logo_visible=0)
+        values.update(tags)
+        item = Item(id=str(uuid.uuid4()), user_id=user_id, slot=slot, **values)
+        db.add(item)
+        db.commit()
+        return item
+    return make
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from backend import vision
+from backend.analyzer import analyze_image
+
+PHOTOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "testphotos")
+SOLID = ["shorts.webp", "shorts2.webp", "shorts3.jpeg", "tshirt.png"]
+NOT_SOLID = ["jeans.jpg", "sweater.jpg", "sweater2.webp", "tshirt2.webp", "shoes4.webp"]
+
+
+@pytest.mark.parametrize("name", SOLID)
+def test_plain_garments_are_solid(name):
+    assert analyze_image(os.path.join(PHOTOS, name))["pattern"] == "solid"
+
+
+@pytest.mark.parametrize("name", NOT_SOLID)
+def test_multicolored_garments_are_not_solid(name):
+    assert analyze_image(os.path.join(PHOTOS, name))["pattern"] != "solid"
+
+
+def test_mock_tags_take_the_detected_pattern():
+    path = os.path.join(PHOTOS, "shorts2.webp")
+    # Different contexts seed the mock's dice differently; the pattern must not follow them
+    patterns = {vision.generate_mock_tags(path, {"item_type": f"shorts {n}"}).pattern for n in range(8)}
+    assert patterns == {"solid"}
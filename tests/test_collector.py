@@ -0,0 +1,57 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from backend import collector
+from backend.models import Outfit
+
+
+@pytest.fixture(autouse=True)
+def no_leases(db):
+    db.execute(text("DELETE FROM leases"))
+    db.commit()
+
+
+def test_lease_is_held_by_one_worker_until_it_expires(db):
+    assert collector.acquire_lease(db, holder="worker-a", seconds=60)
+    assert collector.acquire_lease(db, holder="worker-a", seconds=60)  # Renewal
+    assert not collector.acquire_lease(db, holder="worker-b", seconds=60)
+
+    collector.acquire_lease(db, holder="worker-a", seconds=-1)  # Let it lapse
+    assert collector.acquire_lease(db, holder="worker-b", seconds=60)
+    assert not collector.acquire_lease(db, holder="worker-a", seconds=60)
+
+
+def test_released_lease_can_be_taken_at_once(db):
+    assert collector.acquire_lease(db, holder="worker-a", seconds=60)
+    collector.release_lease(db, holder="worker-a")
+    assert collector.acquire_lease(db, holder="worker-b", seconds=60)
+
+
+def test_pass_is_skipped_without_the_lease(db):
+    assert collector.acquire_lease(db, holder="another-worker", seconds=60)
+    assert collector.run_once(use_lease=True) == {}
+
+
+def _outfit(db, user, item_ids):
+    outfit = Outfit(id=str(uuid.uuid4()), user_id=user.id, items=json.dumps(item_ids))
+    db.add(outfit)
+    db.commit()
+    return outfit.id
+
+
+def test_outfits_left_empty_are_kept_by_default(db, make_user):
+    outfit_id = _outfit(db, make_user(), ["deleted-item"])
+    stats = collector.prune_outfit_references(db)
+    assert stats["outfits_deleted"] == 0
+    assert json.loads(db.get(Outfit, outfit_id).items) == []
+
+
+def test_outfits_left_empty_are_deleted_when_asked(db, make_user):
+    outfit_id = _outfit(db, make_user(), ["deleted-item"])
+    stats = collector.prune_outfit_references(db, delete_empty=True)
+    assert stats["outfits_deleted"] >= 1
+    db.expire_all()
+    assert db.get(Outfit, outfit_id) is None
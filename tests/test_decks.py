@@ -0,0 +1,68 @@
+from backend import decks, etags
+from backend.models import Item
+
+KEY = decks.filter_key(None, None, None)
+
+
+def _wait_for_background():
+    # One worker thread: anything queued before this has finished once it runs
+    decks._executor.submit(lambda: None).result(timeout=10)
+
+
+def test_change_from_another_worker_is_rebuilt_in_the_background(db, make_user, make_item, monkeypatch):
+    user = make_user()
+    make_item(user.id, "top")
+    make_item(user.id, "bottom")
+    outfit, counts, total = decks.draw(db, user, KEY)
+    assert counts == {"top": 1, "bottom": 1}
+
+    # Another worker adds a pair of shoes: this process never saw the patch
+    make_item(user.id, "shoes", material="leather")
+    etags.bump(db, user.id)
+    db.commit()
+    db.refresh(user)
+
+    builds, build = [], decks._build
+    monkeypatch.setattr(decks, "_build", lambda *args: builds.append(args) or build(*args))
+    outfit, counts, total = decks.draw(db, user, KEY)
+    assert set(outfit) == {"top", "bottom"}  # Served from the old deck
+    _wait_for_background()
+    assert len(builds) == 1
+
+    outfit, counts, total = decks.draw(db, user, KEY)
+    assert set(outfit) == {"top", "bottom", "shoes"}
+    assert decks._users[user.id].version == user.items_version
+
+
+def test_outfit_with_an_item_deleted_elsewhere_is_not_served(db, make_user, make_item):
+    user = make_user()
+    top = make_item(user.id, "top")
+    make_item(user.id, "bottom")
+    decks.draw(db, user, KEY)
+
+    db.delete(db.get(Item, top.id))
+    etags.bump(db, user.id)
+    db.commit()
+    db.refresh(user)
+
+    outfit, counts, total = decks.draw(db, user, KEY)
+    assert set(outfit) == {"bottom"}
+    assert total == 1
+
+
+def test_outfit_changes_leave_decks_current(db, make_user, make_item, monkeypatch):
+    user = make_user()
+    make_item(user.id, "top")
+    decks.draw(db, user, KEY)
+
+    # A saved outfit moves the listings' ETag but not the items version
+    etags.bump(db, user.id, items=False)
+    db.commit()
+    db.refresh(user)
+
+    builds = []
+    monkeypatch.setattr(decks, "_build", lambda *args: builds.append(args) or [])
+    outfit, counts, total = decks.draw(db, user, KEY)
+    _wait_for_background()
+    assert builds == []
+    assert set(outfit) == {"top"}
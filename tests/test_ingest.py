@@ -0,0 +1,61 @@
+import io
+import os
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from backend import ingest
+
+PHOTOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "testphotos")
+
+
+def _encode(fmt: str, size=(64, 48)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buf, fmt)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("name", sorted(os.listdir(PHOTOS)))
+def test_sample_photos_load(name):
+    with open(os.path.join(PHOTOS, name), "rb") as f:
+        im = ingest.load_image(f)
+    assert im.mode == "RGB"
+    assert min(im.size) > 0
+
+
+@pytest.mark.parametrize("fmt", ["GIF", "BMP", "TIFF", "PNG", "WEBP"])
+def test_formats_pillow_reads_are_accepted(fmt):
+    im = ingest.load_image(io.BytesIO(_encode(fmt)))
+    assert im.size == (64, 48)
+
+
+def test_unidentified_file_is_415():
+    with pytest.raises(HTTPException) as error:
+        ingest.probe(io.BytesIO(b"not an image at all"))
+    assert error.value.status_code == 415
+
+
+def test_too_many_pixels_is_413(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(HTTPException) as error:
+        ingest.probe(io.BytesIO(_encode("PNG")))
+    assert error.value.status_code == 413
+
+
+@pytest.mark.parametrize("limit, text", [(512 * 1024, "512 KB"), (1536 * 1024, "1.5 MB"), (20 * 1024 * 1024, "20 MB")])
+def test_body_limit_message_is_readable(limit, text):
+    assert ingest.BodyTooLarge(limit).detail == f"Upload is larger than {text}"
+
+
+def test_signup_with_unreadable_profile_photo_is_415(db):
+    from fastapi.testclient import TestClient
+
+    from backend.app import app
+    from backend.models import User
+
+    form = {"name": "t", "username": "photo-415", "password": "pw", "email": "photo-415@example.com"}
+    response = TestClient(app).post("/auth/signup", data=form,
+                                    files={"profile_photo": ("me.jpg", b"not an image", "image/jpeg")})
+    assert response.status_code == 415
+    assert db.query(User).filter(User.username == "photo-415").first() is None
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import pytest
+
+from backend import scheduler
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Two concurrent calls, no rate limits, and an empty scheduler"""
+    monkeypatch.setattr(scheduler, "VISION_RPM", 0)
+    monkeypatch.setattr(scheduler, "VISION_TPM", 0)
+    monkeypatch.setattr(scheduler, "VISION_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(scheduler, "VISION_QUEUE_LIMIT", 200)
+    monkeypatch.setattr(scheduler, "VISION_USER_QUEUE_LIMIT", 200)
+    monkeypatch.setattr(scheduler, "VISION_MAX_WAIT_SECONDS", 600)
+    monkeypatch.setattr(scheduler, "_in_flight", 0)
+    monkeypatch.setattr(scheduler, "_queue", [])
+    monkeypatch.setattr(scheduler, "_queued", {})
+
+
+def test_queued_calls_wait_on_the_event_loop_without_threads(limits):
+    async def main():
+        scheduler.set_principal("bulk-uploader")
+        threads = threading.active_count()
+        held = [await scheduler.admit(100) for _ in range(2)]
+        waiting = [asyncio.create_task(scheduler.admit(100)) for _ in range(60)]
+        await asyncio.sleep(0.05)
+        assert len(scheduler._queue) == 60
+        assert threading.active_count() == threads
+
+        for ticket in held:
+            scheduler.release(ticket, 0.01)
+        admitted = 0
+        for next_done in asyncio.as_completed(waiting):
+            scheduler.release(await next_done, 0.01)
+            admitted += 1
+        assert admitted == 60
+        assert scheduler._in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_admitted_slot_is_used_by_the_call_and_refunded_if_unused(limits):
+    async def main():
+        async with scheduler.admitted(100) as ticket:
+            assert scheduler._in_flight == 1
+
+            def call():
+                with scheduler.slot(150) as used:
+                    return used
+            # The worker thread sees the admitted ticket through the copied context
+            assert await asyncio.to_thread(call) is ticket
+        assert scheduler._in_flight == 0
+
+        async with scheduler.admitted(100):
+            assert scheduler._in_flight == 1
+        assert scheduler._in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue(limits):
+    async def main():
+        held = [await scheduler.admit(100) for _ in range(2)]
+        waiter = asyncio.create_task(scheduler.admit(100))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler._queue == []
+        for ticket in held:
+            scheduler.release(ticket, 0.01)
+
+    asyncio.run(main())
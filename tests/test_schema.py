@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from sqlalchemy import event
+
+from backend.db import engine, init_db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_rerunning_init_db_leaves_current_triggers_alone(db):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.split()[:2])  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        init_db()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert ["DROP", "TRIGGER"] not in statements
+    assert ["CREATE", "TRIGGER"] not in statements
+
+
+def test_workers_booting_together_all_succeed(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path}/boot.db")
+    code = "from backend.db import init_db\nfor _ in range(3): init_db()"
+    workers = [subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, env=env,
+                                stderr=subprocess.PIPE, text=True) for _ in range(6)]
+    errors = [worker.communicate()[1] for worker in workers]
+    assert [worker.returncode for worker in workers] == [0] * 6, "\n".join(errors)
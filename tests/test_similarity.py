@@ -0,0 +1,34 @@
+from fastapi.testclient import TestClient
+
+from backend import etags, similarity
+from backend.app import app
+from backend.auth import create_access_token
+
+
+def test_bulk_delete_of_unknown_ids_leaves_the_index_version_alone(db, make_user, make_item):
+    user = make_user()
+    first = make_item(user.id, "top")
+    make_item(user.id, "bottom")
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user.id})}"}
+
+    assert len(client.get(f"/items/{first.id}/similar", headers=headers).json()["similar"]) == 1
+    response = client.post("/items/bulk-delete", json={"ids": ["no-such-item"]}, headers=headers)
+    assert response.json()["not_found"] == ["no-such-item"]
+
+    # Another worker adds an item: this process never saw the patch
+    make_item(user.id, "shoes")
+    etags.bump(db, user.id)
+    db.commit()
+
+    assert len(client.get(f"/items/{first.id}/similar", headers=headers).json()["similar"]) == 2
+
+
+def test_patch_without_items_does_not_bump(db, make_user, make_item):
+    user = make_user()
+    make_item(user.id)
+    index = similarity.get_index(db, user)
+    version = index.version
+    similarity.remove_items(user.id, [])
+    similarity.add_items(user.id, [])
+    assert index.version == version
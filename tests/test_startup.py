@@ -0,0 +1,53 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Launch-to-first-response budget. Generous by default so slow CI machines pass;
+# tighten it with STARTUP_BUDGET_MS to catch import-time regressions locally.
+BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "5000"))
+ATTEMPTS = 3
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _first_response_ms(env: dict) -> float:
+    """Start uvicorn in a fresh interpreter and time it up to the first /healthz 200"""
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.app:app", "--port", str(port)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while True:
+            if server.poll() is not None:
+                pytest.fail(f"uvicorn exited during startup: {server.stderr.read().decode()[-2000:]}")
+            if time.perf_counter() - start > 60:
+                pytest.fail("no /healthz response within 60s")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_launch_to_first_response_within_budget(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path}/startup.db",
+               STORAGE_DIR=str(tmp_path / "storage"), COLLECTOR_INTERVAL_SECONDS="0")
+    # The first launch also creates the database; the best of a few runs filters out scheduler noise
+    timings = [_first_response_ms(env) for _ in range(ATTEMPTS)]
+    assert min(timings) <= BUDGET_MS, \
+        f"launch to first response took {min(timings):.0f}ms (budget {BUDGET_MS:.0f}ms; runs {timings})"
@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from fastapi.testclient import TestClient
+
+from backend import storage
+
+BUCKET = "looklabs-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """An S3Storage on a moto bucket, installed as the app's backend"""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        backend = storage.S3Storage(BUCKET, prefix="images/", region="us-east-1")
+        backend.client.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(storage, "_backend", backend)
+        yield backend
+
+
+def test_write_exists_read(s3):
+    data = b"\xff\xd8 not really a jpeg"
+    key = storage.blob_key(data)
+    assert not s3.exists(key)
+    assert s3.modified_at(key) is None
+
+    s3.write(key, data)
+    assert s3.exists(key)
+    assert s3.read(key) == data
+    assert b"".join(s3.iter_chunks(key, chunk_size=4)) == data
+    assert s3.modified_at(key) is not None
+
+    head = s3.client.head_object(Bucket=BUCKET, Key="images/" + storage.object_name(key))
+    assert head["ContentType"] == "image/jpeg"
+    assert head["CacheControl"] == storage.IMMUTABLE_CACHE
+
+
+def test_iter_objects_lists_only_blobs_under_prefix(s3):
+    keys = {storage.write_blob(f"image {i}".encode()) for i in range(3)}
+    s3.client.put_object(Bucket=BUCKET, Key="images/notes.txt", Body=b"x")
+    s3.client.put_object(Bucket=BUCKET, Key="elsewhere/" + storage.object_name("a" * 64), Body=b"x")
+
+    listed = dict(s3.iter_objects())
+    assert set(listed) == keys
+    assert all(isinstance(modified, float) for modified in listed.values())
+
+
+def test_delete(s3):
+    key = storage.write_blob(b"to be deleted")
+    s3.delete(key)
+    assert not s3.exists(key)
+    assert list(s3.iter_objects()) == []
+    s3.delete(key)  # Missing objects are not an error
+
+
+def test_image_endpoint_redirects_to_presigned_url(s3):
+    from backend.app import app
+
+    key = storage.write_blob(b"served from the bucket")
+    response = TestClient(app).get(f"/images/{key}.jpg", follow_redirects=False)
+    assert response.status_code == 307
+    location = response.headers["location"]
+    assert BUCKET in location and storage.object_name(key) in location
+    assert "Signature" in location or "X-Amz-Signature" in location
+    assert response.headers["cache-control"].startswith("private, max-age=")
+
+
+def test_backend_missing_a_method_fails_when_built():
+    class Incomplete(storage.StorageBackend):
+        def exists(self, key):
+            return False
+
+    with pytest.raises(TypeError):
+        Incomplete()